@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Any
+from .invoice_api import InvoiceFormat
+from .utils import ensure_directory
+
+
+# digest (32 bytes), pack number, offset within pack, length
+_BLOB_RECORD = struct.Struct("<32sIQQ")
+
+
+class InvoiceArchive:
+	"""Content-addressed, append-only store for generated documents.
+	Documents are appended to a small number of large pack files and identified by the SHA-256
+	of their content, so identical outputs are stored once. Two indexes sit next to the packs:
+	`blobs.idx` maps each digest to its location using fixed-size binary records, and
+	`documents.idx` maps invoice number, date and format to a digest, one JSON line per document.
+	Both are loaded into memory on open, so lookups never scan the packs.
+
+	Only one process may write to an archive at a time; threads within it can share one instance.
+	An archive can be passed to `InvoiceGeneratorAPI` as its output sink.
+	"""
+
+	def __init__(self, archive_dir: str = "archive", max_pack_size: int = 256 * 1024 * 1024):
+		self.archive_dir = archive_dir
+		self.max_pack_size = max_pack_size
+		self._blobs_path = os.path.join(archive_dir, "blobs.idx")
+		self._documents_path = os.path.join(archive_dir, "documents.idx")
+		self._blobs: Dict[bytes, Tuple[int, int, int]] = {}
+		self._documents: Dict[Tuple[str, str], Dict[str, str]] = {}
+		self._lock = threading.Lock()
+		ensure_directory(archive_dir)
+		self._load_indexes()
+		self._pack_number = self._latest_pack_number()
+
+	def _pack_path(self, pack_number: int) -> str:
+		return os.path.join(self.archive_dir, f"pack-{pack_number:06d}.pack")
+
+	def _latest_pack_number(self) -> int:
+		numbers = [int(name[5:11]) for name in os.listdir(self.archive_dir)
+				   if name.startswith("pack-") and name.endswith(".pack")]
+		return max(numbers, default=1)
+
+	@staticmethod
+	def _read_complete(path: str, usable_length) -> bytes:
+		"""Read an index, cutting off a partially written record at its end so later appends line up."""
+		with open(path, 'r+b') as f:
+			raw = f.read()
+			usable = usable_length(raw)
+			if usable < len(raw):
+				f.truncate(usable)
+		return raw[:usable]
+
+	def _load_indexes(self) -> None:
+		"""Read both indexes, dropping a partially written record at the end of either file."""
+		if os.path.exists(self._blobs_path):
+			raw = self._read_complete(self._blobs_path, lambda raw: len(raw) - len(raw) % _BLOB_RECORD.size)
+			for digest, pack_number, offset, length in _BLOB_RECORD.iter_unpack(raw):
+				self._blobs[digest] = (pack_number, offset, length)
+		if os.path.exists(self._documents_path):
+			raw = self._read_complete(self._documents_path, lambda raw: raw.rfind(b"\n") + 1)
+			for line in raw.decode('utf-8').splitlines():
+				try:
+					record = json.loads(line)
+				except json.JSONDecodeError:
+					continue
+				self._documents.setdefault((record["number"], record["format"]), {})[record["date"]] = record["digest"]
+
+	def _append_blob(self, content: bytes) -> bytes:
+		"""Append content to the current pack unless an identical blob is already stored."""
+		digest = hashlib.sha256(content).digest()
+		if digest in self._blobs:
+			return digest
+		pack_path = self._pack_path(self._pack_number)
+		if os.path.exists(pack_path) and os.path.getsize(pack_path) + len(content) > self.max_pack_size:
+			self._pack_number += 1
+			pack_path = self._pack_path(self._pack_number)
+		with open(pack_path, 'ab') as f:
+			offset = f.tell()
+			f.write(content)
+			f.flush()
+			os.fsync(f.fileno())
+		# The index record is only written once the blob is safely on disk
+		with open(self._blobs_path, 'ab') as f:
+			f.write(_BLOB_RECORD.pack(digest, self._pack_number, offset, len(content)))
+		self._blobs[digest] = (self._pack_number, offset, len(content))
+		return digest
+
+	def store(self, content: bytes, number: Optional[str], invoice_date: Optional[str],
+			  format_type: InvoiceFormat = InvoiceFormat.PDF) -> str:
+		"""
+		Archive a generated document.
+		Args:
+			content: The document bytes
+			number: Invoice number ("" or None if the invoice has none)
+			invoice_date: Invoice date as YYYY-MM-DD ("" or None if unset)
+			format_type: Format of the document
+		Returns:
+			Hex digest identifying the stored content
+		"""
+		number = number or ""
+		invoice_date = invoice_date or ""
+		with self._lock:
+			digest = self._append_blob(content)
+			dates = self._documents.setdefault((number, format_type.value), {})
+			if dates.get(invoice_date) != digest.hex():
+				record = {
+					"number": number,
+					"date": invoice_date,
+					"format": format_type.value,
+					"digest": digest.hex(),
+					"stored": datetime.now().isoformat(timespec="seconds"),
+				}
+				with open(self._documents_path, 'a', encoding='utf-8') as f:
+					f.write(json.dumps(record, ensure_ascii=False) + "\n")
+				dates[invoice_date] = digest.hex()
+		return digest.hex()
+
+	def write(self, data: Dict[str, Any], format_type: InvoiceFormat, content: bytes) -> str:
+		"""Output sink interface used by `InvoiceGeneratorAPI`. Returns a description of where the document went."""
+		digest = self.store(content, data.get("number"), data.get("date"), format_type)
+		return f"archive {digest[:12]}"
+
+	def lookup(self, number: str, invoice_date: str = None, format_type: InvoiceFormat = InvoiceFormat.PDF) -> Optional[str]:
+		"""
+		Find the digest of an archived document.
+		Args:
+			number: Invoice number
+			invoice_date: Invoice date as YYYY-MM-DD. If None, the latest date wins.
+			format_type: Format of the document
+		Returns:
+			Hex digest, or None if no such document was archived
+		"""
+		dates = self._documents.get((number or "", format_type.value))
+		if not dates:
+			return None
+		if invoice_date is not None:
+			return dates.get(invoice_date)
+		return dates[max(dates)]
+
+	def documents(self) -> List[Dict[str, str]]:
+		"""List every archived document as number, date, format and digest."""
+		return [{"number": number, "date": invoice_date, "format": fmt, "digest": digest}
+				for (number, fmt), dates in self._documents.items()
+				for invoice_date, digest in dates.items()]
+
+	def read(self, digest: str) -> Optional[bytes]:
+		"""Read the content for a hex digest, or None if it is not stored."""
+		location = self._blobs.get(bytes.fromhex(digest))
+		if location is None:
+			return None
+		pack_number, offset, length = location
+		with open(self._pack_path(pack_number), 'rb') as f:
+			f.seek(offset)
+			return f.read(length)
+
+	def extract(self, number: str, output_path: str, invoice_date: str = None,
+				format_type: InvoiceFormat = InvoiceFormat.PDF) -> bool:
+		"""
+		Write a single archived document to a loose file.
+		Returns:
+			True if the document was found and written, False otherwise
+		"""
+		digest = self.lookup(number, invoice_date, format_type)
+		if digest is None:
+			return False
+		content = self.read(digest)
+		if content is None:
+			return False
+		try:
+			with open(output_path, 'wb') as f:
+				f.write(content)
+			return True
+		except (IOError, OSError):
+			return False
@@ -0,0 +1,153 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+import requests
+from .utils import ensure_directory, safe_json_load, atomic_json_save
+
+
+# Leading bytes of the image formats accepted as logos
+IMAGE_SIGNATURES = [
+	(b"\x89PNG\r\n\x1a\n", "image/png", "png"),
+	(b"\xff\xd8\xff", "image/jpeg", "jpg"),
+	(b"GIF87a", "image/gif", "gif"),
+	(b"GIF89a", "image/gif", "gif"),
+]
+
+
+def detect_image_type(content: bytes) -> Optional[Tuple[str, str]]:
+	"""Return (mime type, extension) for a supported image, or None if the content is not one."""
+	for signature, mime, extension in IMAGE_SIGNATURES:
+		if content.startswith(signature):
+			return mime, extension
+	if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+		return "image/webp", "webp"
+	return None
+
+
+class LogoCache:
+	"""Resolves each distinct logo once and serves it from a local content-addressed cache.
+	Logos may be http(s) URLs, `file://` URLs or local paths. Each one is fetched once, checked
+	to be an image, downscaled if Pillow is installed and it is larger than `max_dimension`, and
+	stored as `<sha256>.<ext>` in `cache_dir`. `resolve` then returns a data URI for the cached
+	file, so the API receives the image inline instead of fetching the remote URL on every render.
+	"""
+
+	def __init__(self, cache_dir: str = "logo_cache", max_dimension: int = 600, max_bytes: int = 1024 * 1024,
+				 session: requests.Session = None, timeout: float = 15, retry_after: float = 60):
+		"""
+		Args:
+			cache_dir: Directory holding cached images and the source index
+			max_dimension: Images wider or taller than this are downscaled (requires Pillow)
+			max_bytes: Logos larger than this after downscaling are rejected
+			session: HTTP session used for remote logos
+			timeout: Timeout in seconds for fetching remote logos
+			retry_after: Seconds before a logo that could not be read (timeout, connection or
+				file error) is tried again. Logos rejected as invalid images are not retried.
+		"""
+		self.cache_dir = cache_dir
+		self.max_dimension = max_dimension
+		self.max_bytes = max_bytes
+		self.session = session or requests.Session()
+		self.timeout = timeout
+		self.retry_after = retry_after
+		self._index_path = os.path.join(cache_dir, "index.json")
+		ensure_directory(cache_dir)
+		self._index: Dict[str, str] = safe_json_load(self._index_path) or {}
+		self._resolved: Dict[str, str] = {}
+		self._failed: Dict[str, float] = {}  # source -> monotonic time after which it is tried again
+		self._index_lock = threading.Lock()
+		self._source_locks = defaultdict(threading.Lock)
+
+	def _fetch(self, source: str) -> bytes:
+		"""Read logo bytes from a URL or local path."""
+		parsed = urlparse(source)
+		if parsed.scheme in ("http", "https"):
+			response = self.session.get(source, timeout=self.timeout)
+			response.raise_for_status()
+			return response.content
+		path = url2pathname(parsed.path) if parsed.scheme == "file" else source
+		with open(path, 'rb') as f:
+			return f.read()
+
+	def _downscale(self, content: bytes) -> bytes:
+		"""Shrink images larger than `max_dimension`. Returns the content unchanged without Pillow."""
+		try:
+			from PIL import Image
+		except ImportError:
+			return content
+		with Image.open(io.BytesIO(content)) as image:
+			if max(image.size) <= self.max_dimension:
+				return content
+			image_format = image.format
+			image.thumbnail((self.max_dimension, self.max_dimension))
+			output = io.BytesIO()
+			image.save(output, format=image_format)
+			return output.getvalue()
+
+	def cache(self, source: str) -> str:
+		"""
+		Fetch, validate and store a logo, unless it is already cached.
+		Args:
+			source: Logo URL or local path
+		Returns:
+			Path of the cached image
+		Raises:
+			ValueError: The logo is not a supported image or is too large
+			IOError, requests.RequestException: The logo could not be read
+		"""
+		with self._source_locks[source]:
+			filename = self._index.get(source)
+			if filename and os.path.exists(os.path.join(self.cache_dir, filename)):
+				return os.path.join(self.cache_dir, filename)
+			content = self._fetch(source)
+			if detect_image_type(content) is None:
+				raise ValueError(f"Logo is not a PNG, JPEG, GIF or WebP image: {source}")
+			content = self._downscale(content)
+			if len(content) > self.max_bytes:
+				raise ValueError(f"Logo is larger than {self.max_bytes} bytes: {source}")
+			filename = f"{hashlib.sha256(content).hexdigest()}.{detect_image_type(content)[1]}"
+			path = os.path.join(self.cache_dir, filename)
+			# Identical images from different sources share one file
+			if not os.path.exists(path):
+				with open(path, 'wb') as f:
+					f.write(content)
+			with self._index_lock:
+				self._index[source] = filename
+				atomic_json_save(self._index_path, self._index)
+			return path
+
+	def resolve(self, source: str) -> str:
+		"""
+		Get the value to send as the invoice logo.
+		Returns:
+			A data URI of the cached image, or `source` unchanged if it could not be cached
+		"""
+		resolved = self._resolved.get(source)
+		if resolved is not None:
+			return resolved
+		if self._failed.get(source, 0) > time.monotonic():
+			return source
+		try:
+			path = self.cache(source)
+			with open(path, 'rb') as f:
+				content = f.read()
+		except ValueError:
+			# Not a usable image; fetching it again would give the same answer
+			self._resolved[source] = source
+			return source
+		except (IOError, OSError, requests.RequestException):
+			# Possibly transient: skip the logo for a while instead of fetching it for every invoice in a batch
+			self._failed[source] = time.monotonic() + self.retry_after
+			return source
+		self._failed.pop(source, None)
+		mime, _ = detect_image_type(content)
+		resolved = f"data:{mime};base64,{base64.b64encode(content).decode('ascii')}"
+		self._resolved[source] = resolved
+		return resolved
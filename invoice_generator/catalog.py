@@ -0,0 +1,215 @@
+import csv
+import math
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Any
+
+
+_KEY_LENGTH = 32  # Index keys are truncated to this many characters; longer queries are verified per match
+_FUZZY_THRESHOLD = 0.4  # Minimum share of the query's trigrams a name must contain for a fuzzy match
+_POSTINGS_CAP = 1000  # Entries read from each trigram's postings when gathering fuzzy candidates
+_WORD_START = re.compile(r"(?<=\s)\S")
+
+_catalogs: Dict[str, Tuple[int, "ProductCatalog"]] = {}
+_catalogs_lock = threading.Lock()
+
+
+def normalize(text: str) -> str:
+	"""Case-fold and collapse whitespace, for matching."""
+	return " ".join(text.casefold().split())
+
+
+def _padded(text: str) -> str:
+	"""Each word padded like `_trigrams` does, so `gram in _padded(text)` tells whether `text` has the trigram."""
+	return "".join(f"  {word} " for word in text.split())
+
+
+def _trigrams(text: str) -> set:
+	"""Trigrams of each word, padded to mark the word's start and end."""
+	return {padded[i:i + 3] for padded in (f"  {word} " for word in text.split()) for i in range(len(padded) - 2)}
+
+
+@dataclass(frozen=True)
+class CatalogEntry:
+	"""A product or service that can be billed."""
+	name: str
+	unit_cost: float
+	sku: str = ""
+	description: str = ""
+	discount: Optional[float] = None  # Default discount per line
+	tax_category: Optional[str] = None
+
+	def to_item(self, quantity: int = 1) -> Any:
+		"""Create an `InvoiceItem` for this product."""
+		from .invoice_api import InvoiceItem
+		return InvoiceItem(self.name, quantity, self.unit_cost, self.description or None, self.discount, self.tax_category)
+
+
+class ProductCatalog:
+	"""Product catalog with prefix and fuzzy name search.
+	Prefix lookups use sorted key arrays searched with `bisect`, which works like a compact trie:
+	one index for whole names, one for the text starting at each later word (so "shirt" finds
+	"Blue shirt"), and one for SKUs. When those give too few results, a trigram index finds
+	names with typos or in a different word order.
+	"""
+
+	def __init__(self, entries: List[CatalogEntry] = None):
+		self.entries: List[CatalogEntry] = list(entries or [])
+		self._names = [normalize(entry.name) for entry in self.entries]
+		self._by_name: Dict[str, int] = {}
+		self._by_sku: Dict[str, int] = {}
+		for index, (entry, name) in enumerate(zip(self.entries, self._names)):
+			self._by_name.setdefault(name, index)
+			if entry.sku:
+				self._by_sku.setdefault(normalize(entry.sku), index)
+		self._name_index = self._build_index((name, index) for index, name in enumerate(self._names))
+		self._word_index = self._build_index(
+			(name[match.start():], index) for index, name in enumerate(self._names) for match in _WORD_START.finditer(name)
+		)
+		self._sku_index = self._build_index((sku, index) for sku, index in self._by_sku.items())
+		self._padded = [_padded(name) for name in self._names]
+		self._trigram_index: Dict[str, array] = {}
+		self._trigram_counts = array('H')
+		for index, name in enumerate(self._names):
+			grams = _trigrams(name)
+			self._trigram_counts.append(min(len(grams), 0xFFFF))
+			for gram in grams:
+				postings = self._trigram_index.get(gram)
+				if postings is None:
+					postings = self._trigram_index[gram] = array('L')
+				postings.append(index)
+
+	@staticmethod
+	def _build_index(pairs) -> Tuple[List[str], array]:
+		ordered = sorted((key[:_KEY_LENGTH], index) for key, index in pairs)
+		return [key for key, _ in ordered], array('L', [index for _, index in ordered])
+
+	def __len__(self) -> int:
+		return len(self.entries)
+
+	@classmethod
+	def from_csv(cls, path: str) -> "ProductCatalog":
+		"""
+		Load a catalog from a CSV file with a `name` and `unit_cost` column, and optionally
+		`sku`, `description`, `discount` and `tax_category`. Rows without a name are skipped.
+		Raises:
+			ValueError: A price or discount is not a number
+		"""
+		entries = []
+		with open(path, 'r', encoding='utf-8', newline='') as f:
+			for line, row in enumerate(csv.DictReader(f), start=2):
+				name = (row.get("name") or "").strip()
+				if not name:
+					continue
+				try:
+					unit_cost = float(row.get("unit_cost") or 0)
+					discount = float(row["discount"]) if (row.get("discount") or "").strip() else None
+				except ValueError:
+					raise ValueError(f"{path}, line {line}: unit_cost and discount must be numbers")
+				entries.append(CatalogEntry(
+					name=name,
+					unit_cost=unit_cost,
+					sku=(row.get("sku") or "").strip(),
+					description=(row.get("description") or "").strip(),
+					discount=discount,
+					tax_category=(row.get("tax_category") or "").strip() or None,
+				))
+		return cls(entries)
+
+	@classmethod
+	def load(cls, path: str) -> "ProductCatalog":
+		"""Load a catalog CSV, reusing the indexed catalog from an earlier call until the file changes."""
+		mtime = os.stat(path).st_mtime_ns
+		with _catalogs_lock:
+			cached = _catalogs.get(path)
+			if cached is not None and cached[0] == mtime:
+				return cached[1]
+			catalog = cls.from_csv(path)
+			_catalogs[path] = (mtime, catalog)
+			return catalog
+
+	def get(self, name_or_sku: str) -> Optional[CatalogEntry]:
+		"""Find an entry by exact name or SKU (case-insensitive)."""
+		key = normalize(name_or_sku)
+		index = self._by_name.get(key)
+		if index is None:
+			index = self._by_sku.get(key)
+		return self.entries[index] if index is not None else None
+
+	def _prefix(self, index: Tuple[List[str], array], query: str, found: Dict[int, None], limit: int, whole_name: bool) -> None:
+		keys, positions = index
+		key = query[:_KEY_LENGTH]
+		start = bisect_left(keys, key)
+		end = bisect_left(keys, key + "\U0010ffff", start)
+		for position in range(start, end):
+			if len(found) >= limit:
+				return
+			entry_index = positions[position]
+			if entry_index in found:
+				continue
+			if len(query) > _KEY_LENGTH:
+				name = self._names[entry_index]
+				if not (name.startswith(query) if whole_name else query in name):
+					continue
+			found[entry_index] = None
+
+	def _fuzzy(self, query: str, found: Dict[int, None], limit: int) -> None:
+		postings = self._trigram_index
+		grams = sorted(_trigrams(query), key=lambda gram: len(postings.get(gram, ())))
+		needed = math.ceil(_FUZZY_THRESHOLD * len(grams))
+		# A name with `needed` of the query's trigrams has one of the len - needed + 1 rarest, so
+		# only their postings are read. Postings of common trigrams are capped, and every trigram
+		# not read in full is checked per candidate instead.
+		probe = grams[:len(grams) - needed + 1]
+		check = grams[len(probe):]
+		common: Counter = Counter()
+		for gram in probe:
+			entries = postings.get(gram, ())
+			if len(entries) > _POSTINGS_CAP:
+				check.append(gram)
+				common.update(dict.fromkeys(entries[:_POSTINGS_CAP], 0))  # Candidates only, counted below
+			else:
+				common.update(entries)
+		scored = []
+		for entry_index, count in common.items():
+			if entry_index in found:
+				continue
+			if check:
+				padded = self._padded[entry_index]
+				count += sum(gram in padded for gram in check)
+			if count >= needed:
+				scored.append((-count, self._trigram_counts[entry_index], self._names[entry_index], entry_index))
+		scored.sort()
+		for _, _, _, entry_index in scored[:limit - len(found)]:
+			found[entry_index] = None
+
+	def search(self, query: str, limit: int = 10, fuzzy: bool = True) -> List[CatalogEntry]:
+		"""
+		Find entries for a partial name or SKU.
+		Names starting with the query come first, then names with a later word starting with it,
+		then SKUs starting with it. Fuzzy matches fill any remaining places.
+		"""
+		query = normalize(query)
+		if not query or limit <= 0:
+			return []
+		found: Dict[int, None] = {}  # Insertion-ordered set of entry indices
+		self._prefix(self._name_index, query, found, limit, whole_name=True)
+		self._prefix(self._word_index, query, found, limit, whole_name=False)
+		self._prefix(self._sku_index, query, found, limit, whole_name=True)
+		if fuzzy and len(found) < limit and len(query) >= 3:
+			self._fuzzy(query, found, limit)
+		return [self.entries[index] for index in found]
+
+
+def default_catalog() -> Optional[ProductCatalog]:
+	"""Catalog from the `catalog_file` setting (default: catalog.csv), or None if the file does not exist."""
+	from .config import config
+	path = config.get('catalog_file', 'catalog.csv')
+	if not os.path.exists(path):
+		return None
+	return ProductCatalog.load(path)
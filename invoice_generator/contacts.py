@@ -0,0 +1,216 @@
+import os
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left, insort
+from dataclasses import dataclass, asdict
+from operator import itemgetter
+from typing import Dict, Iterator, List, Optional, Tuple
+from .catalog import normalize
+from .utils import safe_json_load, atomic_json_save
+
+
+_TOKEN = re.compile(r"\w+")
+_INTERSECT_LIMIT = 2048  # Intersect another query word's contacts up front only when it has at most this many
+_MISS_LIMIT = 256  # Candidates failing the per-candidate check before the least common unchecked word is intersected
+
+
+def tokenize(text: str) -> List[str]:
+	"""Case-folded words of `text`, for matching."""
+	return _TOKEN.findall(text.casefold())
+
+
+@dataclass(frozen=True)
+class Contact:
+	"""A client that invoices are addressed to."""
+	name: str
+	address: str = ""  # Billing address and contact details, without the name
+	ship_to: str = ""
+
+	@property
+	def recipient(self) -> str:
+		"""Text for the invoice's To field."""
+		return "\n".join(part for part in (self.name, self.address) if part)
+
+	@classmethod
+	def from_recipient(cls, recipient: str, ship_to: str = "") -> "Contact":
+		"""
+		Contact from the To field of an invoice: the first line is the name, the rest the address.
+		Raises:
+			ValueError: The recipient is empty
+		"""
+		lines = recipient.strip().splitlines()
+		if not lines or not lines[0].strip():
+			raise ValueError("Recipient name is required")
+		return cls(lines[0].strip(), "\n".join(line.rstrip() for line in lines[1:]).strip(), ship_to.strip())
+
+
+class AddressBook:
+	"""Contacts with incremental search over their names and addresses.
+	Every word of a contact's name and address goes into a token index: sorted (word, position)
+	pairs, searched with `bisect` for words starting with a query word, which works like a compact
+	trie. A query matches contacts that have a word starting with each of its words, so
+	"acm spring" finds "ACME Corp, 12 Spring St". Names starting with the query come first.
+	Only the contacts of the query word with the fewest contacts are scanned, and the scan stops as
+	soon as `limit` contacts are found, so a search stays fast however large the book is.
+
+	Replaced and removed contacts leave stale entries in the index, which are skipped.
+	"""
+
+	def __init__(self, contacts: List[Contact] = None, path: str = None):
+		self.path = path
+		self._contacts: List[Optional[Contact]] = []
+		self._tokens: List[Tuple[str, ...]] = []
+		self._by_name: Dict[str, int] = {}
+		pairs = []
+		for contact in contacts or []:
+			position = self._append(contact)
+			pairs.extend((token, position) for token in self._tokens[position])
+		pairs.sort(key=itemgetter(0))  # Stable, so each word's positions stay in ascending order
+		self._names: List[Tuple[str, int]] = sorted(self._by_name.items())
+		self._keys: List[str] = [token for token, _ in pairs]
+		self._positions = array('L', [position for _, position in pairs])
+		self._lock = threading.Lock()
+
+	@classmethod
+	def load(cls, path: str) -> "AddressBook":
+		"""Load an address book saved with `save`, or start an empty one if the file does not exist."""
+		data = safe_json_load(path) if os.path.exists(path) else None
+		entries = data.get("contacts") if isinstance(data, dict) else None
+		contacts = []
+		for entry in entries or []:
+			if isinstance(entry, dict) and entry.get("name"):
+				contacts.append(Contact(entry["name"], entry.get("address") or "", entry.get("ship_to") or ""))
+		return cls(contacts, path)
+
+	def save(self, path: str = None) -> bool:
+		"""Write the contacts to `path` (default: the file the book was loaded from). Returns False on failure."""
+		path = path or self.path
+		if not path:
+			raise ValueError("No address book file given")
+		with self._lock:
+			contacts = [asdict(contact) for contact in self._contacts if contact is not None]
+		return atomic_json_save(path, {"contacts": contacts})
+
+	def __len__(self) -> int:
+		return len(self._by_name)
+
+	def __iter__(self) -> Iterator[Contact]:
+		return (contact for contact in list(self._contacts) if contact is not None)
+
+	def _append(self, contact: Contact) -> int:
+		key = normalize(contact.name)
+		previous = self._by_name.get(key)
+		if previous is not None:
+			self._contacts[previous] = None
+		position = len(self._contacts)
+		self._contacts.append(contact)
+		self._tokens.append(tuple(sys.intern(token) for token in dict.fromkeys(tokenize(contact.name) + tokenize(contact.address))))
+		self._by_name[key] = position
+		return position
+
+	def add(self, contact: Contact) -> Contact:
+		"""Add a contact, replacing any contact with the same name (ignoring case and spacing)."""
+		if not contact.name.strip():
+			raise ValueError("Contact name is required")
+		with self._lock:
+			position = self._append(contact)
+			insort(self._names, (normalize(contact.name), position))
+			for token in self._tokens[position]:
+				# The new position is the largest, so it goes after every entry for the same word
+				index = bisect_left(self._keys, token + "\0")
+				self._keys.insert(index, token)
+				self._positions.insert(index, position)
+		return contact
+
+	def remove(self, name: str) -> bool:
+		"""Remove the contact with this name. Returns False if there is none."""
+		with self._lock:
+			position = self._by_name.pop(normalize(name), None)
+			if position is None:
+				return False
+			self._contacts[position] = None
+			return True
+
+	def get(self, name: str) -> Optional[Contact]:
+		"""Find a contact by exact name (case-insensitive)."""
+		position = self._by_name.get(normalize(name))
+		return self._contacts[position] if position is not None else None
+
+	def _word_range(self, word: str) -> Tuple[int, int]:
+		start = bisect_left(self._keys, word)
+		return start, bisect_left(self._keys, word + "\U0010ffff", start)
+
+	def _has_words(self, position: int, words: List[str]) -> bool:
+		tokens = self._tokens[position]
+		return all(any(token.startswith(word) for token in tokens) for word in words)
+
+	def _collect(self, words: List[str], found: Dict[int, None], limit: int) -> None:
+		"""Add contacts with a word starting with each of `words` to `found`, up to `limit`."""
+		ranges = sorted((end - start, start, end, word) for start, end, word in
+						((*self._word_range(word), word) for word in words))
+		# Scan the word with the fewest contacts. Other words with few contacts are intersected up
+		# front. Common words are checked per candidate instead, as that stops once `limit` contacts
+		# are found; each time too many candidates fail the check, the least common of them is
+		# intersected after all.
+		_, start, end, _ = ranges[0]
+		candidates, verify = None, []
+		for count, other_start, other_end, word in ranges[1:]:
+			if count > _INTERSECT_LIMIT:
+				verify.append((other_start, other_end, word))
+				continue
+			candidates = self._intersect(candidates, other_start, other_end)
+			if not candidates:
+				return
+		misses = 0
+		for position in self._positions[start:end]:
+			if position in found or self._contacts[position] is None:
+				continue
+			if misses == _MISS_LIMIT:
+				other_start, other_end, _ = verify.pop(0)
+				candidates = self._intersect(candidates, other_start, other_end)
+				if not candidates:
+					return
+				misses = 0
+			if candidates is not None and position not in candidates:
+				continue
+			if verify and not self._has_words(position, [word for _, _, word in verify]):
+				misses += 1
+				continue
+			found[position] = None
+			if len(found) >= limit:
+				return
+
+	def _intersect(self, candidates: Optional[set], start: int, end: int) -> set:
+		positions = set(self._positions[start:end])
+		return positions if candidates is None else candidates & positions
+
+	def search(self, query: str, limit: int = 10) -> List[Contact]:
+		"""
+		Find contacts for a partial name or address.
+		Contacts whose name starts with the query come first, in name order, then contacts with a
+		word starting with each query word.
+		"""
+		words = list(dict.fromkeys(tokenize(query)))
+		if not words or limit <= 0:
+			return []
+		found: Dict[int, None] = {}  # Insertion-ordered set of positions
+		with self._lock:
+			key = normalize(query)
+			start = bisect_left(self._names, (key,))
+			for index in range(start, len(self._names)):
+				name, position = self._names[index]
+				if len(found) >= limit or not name.startswith(key):
+					break
+				if self._by_name.get(name) == position:
+					found[position] = None
+			if len(found) < limit:
+				self._collect(words, found, limit)
+			return [self._contacts[position] for position in found]
+
+
+def default_address_book() -> AddressBook:
+	"""Address book from the `contacts_file` setting (default: contacts.json), empty if the file does not exist yet."""
+	from .config import config
+	return AddressBook.load(config.get('contacts_file', 'contacts.json'))
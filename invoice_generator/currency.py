@@ -0,0 +1,175 @@
+import csv
+import dataclasses
+import os
+import threading
+from datetime import date
+from typing import Dict, List, Optional, Sequence, Tuple, Union, Any
+try:
+	import numpy as np
+except ImportError as e:
+	raise ImportError("Currency conversion requires NumPy. Install it with: uv pip install 'invoice-gen[reports]'") from e
+
+
+# Currencies whose amounts are rounded to fewer than two decimal places
+MINOR_UNITS = {"JPY": 0, "KRW": 0, "ISK": 0, "CLP": 0, "VND": 0}
+
+RATE_DTYPE = np.dtype([("currency", "U3"), ("date", "datetime64[D]"), ("rate", "f8")])
+
+_tables: Dict[Tuple[str, str], Tuple[int, "RateTable"]] = {}  # By path and base currency
+_tables_lock = threading.Lock()
+
+
+class RateTable:
+	"""Date-indexed exchange rates relative to a single base currency.
+	Each rate is the number of units of a currency per one unit of the base currency, so
+	converting from A to B is `amount / rate[A] * rate[B]`. The rate used for a date is the
+	latest one published on or before it.
+
+	Rates are kept in one array sorted by currency and date, with a composite integer key
+	per row so that any number of (currency, date) lookups resolve in a single `searchsorted`.
+	"""
+
+	def __init__(self, rates: np.ndarray, base: str = "USD", presorted: bool = False):
+		self.base = base.upper()
+		if not presorted:
+			rates = np.sort(rates, order=["currency", "date"])
+		self.rates = rates
+		self.currencies = np.unique(rates["currency"])
+		self._keys = self._composite(np.searchsorted(self.currencies, rates["currency"]), rates["date"])
+
+	@staticmethod
+	def _composite(codes: np.ndarray, dates: np.ndarray) -> np.ndarray:
+		return codes.astype(np.int64) * (1 << 32) + (dates.astype("datetime64[D]").astype(np.int64) + (1 << 31))
+
+	@classmethod
+	def from_csv(cls, path: str, base: str = "USD") -> "RateTable":
+		"""Load rates from a CSV file with `date`, `currency` and `rate` columns."""
+		with open(path, 'r', encoding='utf-8', newline='') as f:
+			rows = [(row["currency"].strip().upper(), row["date"].strip(), float(row["rate"]))
+					for row in csv.DictReader(f)]
+		return cls(np.array(rows, dtype=RATE_DTYPE), base)
+
+	@classmethod
+	def load(cls, path: str, base: str = "USD") -> "RateTable":
+		"""Load a rate table, reusing a compiled `.npy` copy next to the CSV when it is up to date.
+		The compiled copy is memory-mapped, so large histories are not read into memory up front.
+		Tables are also cached per process and base currency until the CSV changes.
+		"""
+		mtime = os.stat(path).st_mtime_ns
+		key = (path, base.upper())
+		with _tables_lock:
+			cached = _tables.get(key)
+			if cached is not None and cached[0] == mtime:
+				return cached[1]
+			compiled_path = f"{path}.npy"
+			if os.path.exists(compiled_path) and os.stat(compiled_path).st_mtime_ns >= mtime:
+				table = cls(np.load(compiled_path, mmap_mode='r'), base, presorted=True)
+			else:
+				table = cls.from_csv(path, base)
+				try:
+					np.save(compiled_path, table.rates)
+				except OSError:
+					pass
+			_tables[key] = (mtime, table)
+			return table
+
+	def rates_for(self, currencies: Union[str, Sequence[str], np.ndarray], dates: Union[date, Sequence[Any], np.ndarray]) -> np.ndarray:
+		"""
+		Look up rates for many (currency, date) pairs at once.
+		Args:
+			currencies: One code, or one code per lookup
+			dates: One date, or one date per lookup
+		Returns:
+			Array of rates (1.0 for the base currency)
+		Raises:
+			KeyError: A currency is unknown or has no rate on or before the requested date
+		"""
+		currencies = np.char.upper(np.asarray(currencies, dtype="U3"))
+		dates = np.asarray(dates, dtype="datetime64[D]")
+		currencies, dates = np.broadcast_arrays(currencies, dates)
+		shape = currencies.shape
+		currencies, dates = currencies.ravel(), dates.ravel()
+		is_base = currencies == self.base
+		codes = np.searchsorted(self.currencies, currencies)
+		codes = np.minimum(codes, max(len(self.currencies) - 1, 0))
+		known = ~is_base & (len(self.currencies) > 0)
+		if len(self.currencies):
+			known &= self.currencies[codes] == currencies
+		positions = np.searchsorted(self._keys, self._composite(codes, dates), side="right") - 1
+		found = known & (positions >= 0)
+		found[found] &= self._keys[positions[found]] >> 32 == codes[found]
+		missing = ~is_base & ~found
+		if missing.any():
+			index = int(np.argmax(missing))
+			raise KeyError(f"No {currencies[index]} rate on or before {dates[index]}")
+		rates = np.ones(currencies.shape, dtype=np.float64)
+		rates[found] = self.rates["rate"][positions[found]]
+		return rates.reshape(shape)
+
+	def convert(self, amounts: Union[float, Sequence[float], np.ndarray], from_currencies: Any, to_currencies: Any,
+				dates: Any) -> np.ndarray:
+		"""Convert amounts between currencies in one vectorized pass. Arguments broadcast against each other."""
+		amounts = np.asarray(amounts, dtype=np.float64)
+		return amounts / self.rates_for(from_currencies, dates) * self.rates_for(to_currencies, dates)
+
+
+def default_rate_table() -> RateTable:
+	"""Rate table from the `fx_rates_file` setting (default: fx_rates.csv), in base currency `fx_base`."""
+	from .config import config
+	return RateTable.load(config.get('fx_rates_file', 'fx_rates.csv'), config.get('fx_base', 'USD'))
+
+
+def round_amount(amount: float, currency: str) -> float:
+	return round(float(amount), MINOR_UNITS.get(currency.upper(), 2))
+
+
+# Monetary invoice fields converted along with item unit costs and discounts
+_INVOICE_AMOUNTS = ("tax", "discounts", "shipping", "amount_paid")
+
+
+def convert_invoices(invoices: Sequence[Any], currency: str, rates: RateTable = None,
+					 as_of: Optional[date] = None) -> List[Any]:
+	"""
+	Convert a batch of invoices to another currency.
+	Every amount of every invoice, including item unit costs and discounts, is converted in a
+	single vectorized pass. Rates are taken as of `as_of`, or each invoice's own date
+	(today for undated invoices). The originals are left untouched.
+	Args:
+		invoices: `Invoice` objects to convert
+		currency: Target currency code
+		rates: Rate table (defaults to `default_rate_table()`)
+		as_of: Rate date to use for every invoice
+	Returns:
+		New `Invoice` objects, in the same order
+	"""
+	rates = rates or default_rate_table()
+	currency = currency.upper()
+	amounts, sources, dates = [], [], []
+	today = date.today()
+	for invoice in invoices:
+		rate_date = as_of or invoice.date or today
+		values = [getattr(invoice, name) for name in _INVOICE_AMOUNTS]
+		for item in invoice.items:
+			values.append(item.unit_cost)
+			values.append(item.discount or 0.0)
+		amounts.extend(values)
+		sources.extend([invoice.currency] * len(values))
+		dates.extend([rate_date] * len(values))
+	converted = iter(rates.convert(amounts, sources, currency, dates).tolist()) if amounts else iter(())
+	results = []
+	for invoice in invoices:
+		changes = {name: round_amount(next(converted), currency) for name in _INVOICE_AMOUNTS}
+		if invoice.display_fields.tax == "%":
+			# A percentage tax does not depend on the currency
+			changes["tax"] = invoice.tax
+		items = []
+		for item in invoice.items:
+			unit_cost = round_amount(next(converted), currency)
+			discount = round_amount(next(converted), currency)
+			items.append(dataclasses.replace(item, unit_cost=unit_cost,
+											 discount=discount if item.discount is not None else None))
+		results.append(dataclasses.replace(
+			invoice, currency=currency, items=items, custom_fields=list(invoice.custom_fields),
+			display_fields=dataclasses.replace(invoice.display_fields), **changes
+		))
+	return results
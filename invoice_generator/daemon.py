@@ -0,0 +1,271 @@
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Any
+from .invoice_api import ErrorCategory, GenerationResult, InvoiceFormat, InvoiceGeneratorAPI, invoice_from_dict
+from .outbox import FORMAT_EXTENSIONS
+from .utils import ensure_directory
+
+
+def is_transient_error(result: GenerationResult) -> bool:
+	"""Whether a failed generation is worth retrying later (timeouts, connection problems, rate limits, server errors)."""
+	return not result.succeeded and result.transient
+
+
+class AdaptiveLimit:
+	"""Concurrency limit that adapts to how the API is coping (additive increase, multiplicative decrease).
+	The limit halves when a request is slower than `target_latency` or fails transiently, and grows
+	back by about one slot per round of successful, fast requests.
+	"""
+
+	def __init__(self, max_limit: int, target_latency: float = 10.0):
+		self.max_limit = max(1, max_limit)
+		self.target_latency = target_latency
+		self.limit = float(self.max_limit)
+		self.in_flight = 0
+		self._condition = threading.Condition()
+
+	def acquire(self, timeout: float = None) -> bool:
+		"""Wait for a free slot and take it. Returns False on timeout."""
+		with self._condition:
+			if not self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+				return False
+			self.in_flight += 1
+			return True
+
+	def release(self, latency: float = None, overloaded: bool = False) -> None:
+		"""Free a slot, adjusting the limit from the outcome of the request that held it."""
+		with self._condition:
+			self.in_flight -= 1
+			if overloaded or (latency is not None and latency > self.target_latency):
+				self.limit = max(1.0, self.limit / 2)
+			elif latency is not None:
+				self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+			self._condition.notify_all()
+
+
+class InboxDaemon:
+	"""Generates invoices from JSON files dropped into an inbox directory.
+	Each file holds one invoice in the API format (as produced by `Invoice.to_dict`). A file is
+	claimed by renaming it into a per-host processing directory, which is atomic, so several
+	daemons can share one inbox. After generation it is moved to `done/`, or to `failed/` with
+	an `.error.txt` note. Files that fail for a transient reason go back to the inbox to be retried.
+	While the client's quota governor is paused at its soft limit, no files are claimed.
+
+	Files are only claimed while there is capacity, and capacity shrinks when the API slows down
+	or fails, so a backlog stays in the inbox instead of piling up in memory. `stop()` finishes
+	every claimed file before returning; files left claimed by a crash are returned to the
+	inbox when the daemon starts.
+	"""
+
+	def __init__(self, api: InvoiceGeneratorAPI, inbox_dir: str, output_dir: str = None,
+				 format_type: InvoiceFormat = InvoiceFormat.PDF, workers: int = 4, poll_interval: float = 2.0,
+				 settle_time: float = 1.0, target_latency: float = 10.0, max_attempts: int = 10,
+				 max_backoff: float = 300.0, on_result: Callable[[str, GenerationResult], None] = None):
+		"""
+		Args:
+			api: Client used to generate the invoices
+			inbox_dir: Directory to watch
+			output_dir: Where to save generated documents, named after the input file. If None, the
+				client's default naming (and path template) is used.
+			format_type: Output format
+			workers: Maximum number of invoices generated concurrently
+			poll_interval: Seconds between inbox scans
+			settle_time: Files modified more recently than this are assumed to be still being written
+			target_latency: Request time in seconds above which the API is considered slow
+			max_attempts: Transient failures tolerated per file before it is moved to `failed/`
+			max_backoff: Longest pause, in seconds, after repeated transient failures
+			on_result: Called with (file name, `GenerationResult`) after each file
+		"""
+		self.api = api
+		self.inbox_dir = inbox_dir
+		self.output_dir = output_dir
+		self.format_type = format_type
+		self.poll_interval = poll_interval
+		self.settle_time = settle_time
+		self.max_attempts = max_attempts
+		self.max_backoff = max_backoff
+		self.on_result = on_result
+		self.workers = max(1, workers)
+		self.limit = AdaptiveLimit(self.workers, target_latency)
+		self.processing_dir = os.path.join(inbox_dir, ".processing", socket.gethostname())
+		self.done_dir = os.path.join(inbox_dir, "done")
+		self.failed_dir = os.path.join(inbox_dir, "failed")
+		self.stats: Dict[str, int] = {"done": 0, "failed": 0, "retried": 0}
+		self._attempts: Dict[str, int] = {}
+		self._backoff = 0.0
+		self._paused_until = 0.0
+		self._lock = threading.Lock()
+		self._stop_event = threading.Event()
+		for directory in (self.processing_dir, self.done_dir, self.failed_dir, output_dir):
+			if directory:
+				ensure_directory(directory)
+
+	def stop(self) -> None:
+		"""Stop claiming new files. `run()` returns once every claimed file is finished."""
+		self._stop_event.set()
+
+	def _move(self, source: str, directory: str) -> str:
+		"""Move a file into a directory, adding a timestamp if the name is taken. Returns the new path."""
+		name = os.path.basename(source)
+		target = os.path.join(directory, name)
+		if os.path.exists(target):
+			stem, extension = os.path.splitext(name)
+			target = os.path.join(directory, f"{stem}.{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}{extension}")
+		os.replace(source, target)
+		return target
+
+	def _requeue_abandoned(self) -> int:
+		"""Return files left in this host's processing directory (e.g. after a crash) to the inbox."""
+		count = 0
+		for name in os.listdir(self.processing_dir):
+			try:
+				self._move(os.path.join(self.processing_dir, name), self.inbox_dir)
+				count += 1
+			except OSError:
+				continue
+		return count
+
+	def _scan(self) -> List[str]:
+		"""Inbox files ready to be claimed, oldest first."""
+		ready = []
+		now = time.time()
+		try:
+			with os.scandir(self.inbox_dir) as entries:
+				for entry in entries:
+					if entry.name.startswith(".") or not entry.name.endswith(".json") or not entry.is_file():
+						continue
+					try:
+						modified = entry.stat().st_mtime
+					except OSError:
+						continue
+					if now - modified >= self.settle_time:
+						ready.append((modified, entry.name))
+		except OSError:
+			return []
+		ready.sort()
+		return [name for _, name in ready]
+
+	def _quota_paused(self) -> bool:
+		"""Whether the client's governor is holding work at the soft limit."""
+		governor = getattr(self.api, "governor", None)
+		return governor is not None and governor.paused
+
+	def _claim(self, name: str) -> Optional[str]:
+		"""Atomically take a file from the inbox. Returns its new path, or None if another daemon took it."""
+		target = os.path.join(self.processing_dir, name)
+		try:
+			os.rename(os.path.join(self.inbox_dir, name), target)
+		except OSError:
+			return None
+		return target
+
+	def _output_path(self, path: str, invoice: Any) -> str:
+		extension = FORMAT_EXTENSIONS[self.format_type]
+		if self.output_dir:
+			return os.path.join(self.output_dir, f"{os.path.splitext(os.path.basename(path))[0]}.{extension}")
+		return self.api._generate_filename(invoice, extension)
+
+	def _fail(self, path: str, message: str) -> None:
+		target = self._move(path, self.failed_dir)
+		try:
+			with open(f"{target}.error.txt", 'w', encoding='utf-8') as f:
+				f.write(message + "\n")
+		except OSError:
+			pass
+
+	def _process(self, path: str) -> None:
+		"""Generate one claimed file and file it away. Runs on a worker thread."""
+		name = os.path.basename(path)
+		started = time.monotonic()
+		latency, transient = None, False
+		try:
+			try:
+				with open(path, 'r', encoding='utf-8') as f:
+					invoice = invoice_from_dict(json.load(f))
+				errors = self.api.validate_invoice(invoice)
+				if errors:
+					raise ValueError("; ".join(errors))
+			except (ValueError, OSError) as e:
+				result = GenerationResult.failure(f"Error: {e}", ErrorCategory.IO if isinstance(e, OSError) else ErrorCategory.INVALID)
+				self._fail(path, str(result))
+				with self._lock:
+					self.stats["failed"] += 1
+				return
+			output_path = self._output_path(path, invoice)
+			if self.format_type == InvoiceFormat.UBL:
+				result = self.api.generate_ubl(invoice, output_path)
+			else:
+				result = self.api.generate_pdf(invoice, output_path)
+			latency = time.monotonic() - started
+			with self._lock:
+				if result.succeeded:
+					self._attempts.pop(name, None)
+					self._backoff = 0.0
+					outcome = "done"
+				elif result.error == ErrorCategory.QUOTA and self._quota_paused():
+					# Claimed just before the soft limit was reached; not the file's fault
+					outcome = "retried"
+				elif is_transient_error(result):
+					attempts = self._attempts[name] = self._attempts.get(name, 0) + 1
+					transient = True
+					outcome = "retried" if attempts < self.max_attempts else "failed"
+					if outcome == "failed":
+						self._attempts.pop(name, None)
+					self._backoff = min(self.max_backoff, max(self.poll_interval, self._backoff * 2))
+					self._paused_until = time.monotonic() + self._backoff
+				else:
+					self._attempts.pop(name, None)
+					outcome = "failed"
+				self.stats[outcome] += 1
+			if outcome == "done":
+				self._move(path, self.done_dir)
+			elif outcome == "retried":
+				self._move(path, self.inbox_dir)
+			else:
+				self._fail(path, str(result))
+		except Exception as e:
+			# Never leave a claimed file behind because of an unexpected error
+			result = GenerationResult.failure(f"Error: {e}", ErrorCategory.IO)
+			if os.path.exists(path):
+				self._fail(path, str(result))
+		finally:
+			self.limit.release(latency, overloaded=transient)
+		if self.on_result is not None:
+			self.on_result(name, result)
+
+	def run(self) -> Dict[str, int]:
+		"""
+		Process the inbox until `stop()` is called.
+		Returns:
+			Counts of files done, failed and returned to the inbox for retry
+		"""
+		self._requeue_abandoned()
+		with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inbox") as executor:
+			while not self._stop_event.is_set():
+				pause = self._paused_until - time.monotonic()
+				if pause > 0:
+					self._stop_event.wait(pause)
+					continue
+				if self._quota_paused():
+					# Leave files in the inbox until `governor.resume()` is called
+					self._stop_event.wait(self.poll_interval)
+					continue
+				claimed = 0
+				for name in self._scan():
+					if self._stop_event.is_set() or self._paused_until > time.monotonic():
+						break
+					if not self.limit.acquire(timeout=self.poll_interval):
+						break
+					path = self._claim(name)
+					if path is None:
+						self.limit.release()
+						continue
+					executor.submit(self._process, path)
+					claimed += 1
+				if not claimed:
+					self._stop_event.wait(self.poll_interval)
+		return dict(self.stats)
@@ -0,0 +1,405 @@
+import mimetypes
+import os
+import queue
+import re
+import smtplib
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Any
+from .invoice_api import GenerationResult
+from .quota import TokenBucket
+from .utils import payload_hash
+
+
+_EMAIL = re.compile(r"[A-Za-z0-9.!#$%&'*+/=?^_`{|}~-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+")
+_SAVED_AS = "Invoice saved as "
+
+DELIVERY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+	key TEXT PRIMARY KEY,
+	number TEXT,
+	recipient TEXT,
+	path TEXT,
+	status TEXT,
+	attempts INTEGER,
+	message TEXT,
+	updated TEXT
+);
+"""
+
+
+def recipient_email(invoice: Any, field_name: str = "Email") -> Optional[str]:
+	"""
+	Email address to send an invoice to: the custom field named `field_name` (case-insensitive),
+	otherwise the first address found in the recipient text.
+	Args:
+		invoice: An `Invoice`, `FrozenInvoice`, invoice dict in the `Invoice.to_dict()` format, or `LedgerEntry`
+	"""
+	if isinstance(invoice, dict):
+		fields = [(field.get("name", ""), field.get("value", "")) for field in invoice.get("custom_fields") or []]
+		recipient = invoice.get("to") or ""
+	else:
+		fields = [(field.name, field.value) for field in getattr(invoice, "custom_fields", None) or []]
+		recipient = invoice.recipient or ""
+	for name, value in fields:
+		if name.strip().casefold() == field_name.casefold():
+			match = _EMAIL.search(value or "")
+			if match:
+				return match.group()
+	match = _EMAIL.search(recipient)
+	return match.group() if match else None
+
+
+@dataclass
+class Delivery:
+	"""One generated invoice to email."""
+	key: str  # Identifies the invoice version, so an unchanged invoice is only sent once
+	to: str
+	path: str
+	number: Optional[str] = None
+	recipient: str = ""
+
+	@classmethod
+	def from_result(cls, invoice: Any, result: GenerationResult, field_name: str = "Email") -> Optional["Delivery"]:
+		"""
+		Delivery for a generation result, or None if the invoice was not saved to a file.
+		Raises:
+			ValueError: The invoice has no email address
+		"""
+		if not result.succeeded or not result.output_path:
+			return None
+		data = invoice if isinstance(invoice, dict) else invoice.to_dict()
+		to = recipient_email(data, field_name)
+		if to is None:
+			raise ValueError(f"No email address for invoice {data.get('number') or '(no number)'}")
+		return cls(payload_hash(data), to, result.output_path, data.get("number"), data.get("to") or "")
+
+	@classmethod
+	def from_ledger(cls, entry: Any) -> Optional["Delivery"]:
+		"""
+		Delivery for a successful `LedgerEntry` saved to a file, or None.
+		Ledger entries have no custom fields, so the address is taken from the recipient text.
+		Raises:
+			ValueError: The recipient text has no email address
+		"""
+		if not entry.succeeded or not entry.output_path or not entry.message.startswith(_SAVED_AS):
+			return None
+		to = recipient_email({"to": entry.recipient})
+		if to is None:
+			raise ValueError(f"No email address for invoice {entry.number or '(no number)'}")
+		return cls(entry.payload_hash, to, entry.output_path, entry.number, entry.recipient)
+
+
+class DeliveryLog:
+	"""Delivery status per invoice, stored in SQLite, so a rerun only sends what has not been sent."""
+
+	def __init__(self, db_path: str = "deliveries.db"):
+		self.db_path = db_path
+		self._lock = threading.Lock()
+		self._connection = sqlite3.connect(db_path, check_same_thread=False)
+		self._connection.execute("PRAGMA journal_mode=WAL")
+		self._connection.executescript(DELIVERY_SCHEMA)
+
+	def record(self, delivery: Delivery, status: str, message: str, attempts: int) -> None:
+		with self._lock, self._connection:
+			self._connection.execute(
+				"INSERT OR REPLACE INTO deliveries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+				(delivery.key, delivery.number, delivery.to, delivery.path, status, attempts, message,
+				 datetime.now().isoformat(timespec="seconds"))
+			)
+
+	def status(self, key: str) -> Optional[str]:
+		"""Status of an invoice: "sent", "failed", or None if it was never attempted."""
+		with self._lock:
+			row = self._connection.execute("SELECT status FROM deliveries WHERE key = ?", (key,)).fetchone()
+		return row[0] if row else None
+
+	def entries(self, status: str = None) -> List[Dict[str, Any]]:
+		"""Recorded deliveries, optionally only those with `status`."""
+		sql = "SELECT * FROM deliveries" + (" WHERE status = ?" if status else "") + " ORDER BY updated"
+		with self._lock:
+			cursor = self._connection.execute(sql, (status,) if status else ())
+			columns = [column[0] for column in cursor.description]
+			return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+	def close(self) -> None:
+		with self._lock:
+			self._connection.close()
+
+
+class SMTPPool:
+	"""A small pool of persistent SMTP connections.
+	Connections are opened on demand up to `size`, reused for many messages, and replaced after
+	`max_messages` messages, after an error, or when an idle connection no longer answers.
+	"""
+
+	def __init__(self, host: str = "localhost", port: int = 25, username: str = None, password: str = None,
+				 starttls: bool = False, use_ssl: bool = False, size: int = 3, timeout: float = 30.0,
+				 max_messages: int = 100, idle_check: float = 30.0):
+		"""
+		Args:
+			host, port: SMTP server
+			username, password: Login, if the server requires it
+			starttls: Upgrade plain connections with STARTTLS
+			use_ssl: Connect with implicit TLS (usually port 465)
+			size: Most connections open at once
+			timeout: Socket timeout in seconds
+			max_messages: Messages sent over one connection before it is replaced
+			idle_check: Connections idle for longer than this many seconds are checked before reuse
+		"""
+		if size < 1:
+			raise ValueError("Pool size must be at least 1")
+		self.host = host
+		self.port = port
+		self.username = username
+		self.password = password
+		self.starttls = starttls
+		self.use_ssl = use_ssl
+		self.size = size
+		self.timeout = timeout
+		self.max_messages = max_messages
+		self.idle_check = idle_check
+		self._idle: "queue.LifoQueue[Tuple[smtplib.SMTP, int, float]]" = queue.LifoQueue()
+		self._slots = threading.BoundedSemaphore(size)
+		self.opened = 0  # Connections opened over the pool's lifetime
+
+	@classmethod
+	def from_config(cls, config: Any) -> "SMTPPool":
+		"""Pool for the `smtp_host`, `smtp_port`, `smtp_username`, `smtp_password`, `smtp_starttls`,
+		`smtp_ssl` and `smtp_pool_size` settings."""
+		use_ssl = bool(config.get('smtp_ssl', False))
+		return cls(config.get('smtp_host', 'localhost'), int(config.get('smtp_port', 465 if use_ssl else 25)),
+				   config.get('smtp_username'), config.get('smtp_password'), bool(config.get('smtp_starttls', False)),
+				   use_ssl, int(config.get('smtp_pool_size', 3)))
+
+	def _open(self) -> smtplib.SMTP:
+		if self.use_ssl:
+			connection = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+		else:
+			connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+		try:
+			connection.ehlo()
+			if self.starttls:
+				connection.starttls()
+				connection.ehlo()
+			if self.username:
+				connection.login(self.username, self.password or "")
+		except BaseException:
+			self._discard(connection)
+			raise
+		self.opened += 1
+		return connection
+
+	@staticmethod
+	def _discard(connection: smtplib.SMTP) -> None:
+		try:
+			connection.quit()
+		except (smtplib.SMTPException, OSError):
+			connection.close()
+
+	@contextmanager
+	def connection(self):
+		"""
+		Borrow a connection for sending one message. A connection that raises is not reused.
+		Raises:
+			smtplib.SMTPException, OSError: A new connection could not be opened
+		"""
+		self._slots.acquire()
+		try:
+			connection, sent = None, 0
+			while connection is None:
+				try:
+					connection, sent, last_used = self._idle.get_nowait()
+				except queue.Empty:
+					connection, sent = self._open(), 0
+					break
+				if time.monotonic() - last_used > self.idle_check:
+					try:
+						if connection.noop()[0] != 250:
+							raise smtplib.SMTPServerDisconnected("No answer to NOOP")
+					except (smtplib.SMTPException, OSError):
+						self._discard(connection)
+						connection = None
+			try:
+				yield connection
+			except BaseException:
+				self._discard(connection)
+				raise
+			if sent + 1 >= self.max_messages:
+				self._discard(connection)
+			else:
+				self._idle.put((connection, sent + 1, time.monotonic()))
+		finally:
+			self._slots.release()
+
+	def close(self) -> None:
+		"""Close the idle connections."""
+		while True:
+			try:
+				connection, _, _ = self._idle.get_nowait()
+			except queue.Empty:
+				return
+			self._discard(connection)
+
+
+def _is_transient(error: Exception) -> bool:
+	"""Whether a send failure may succeed on another try (dropped connections, 4xx replies)."""
+	if isinstance(error, smtplib.SMTPRecipientsRefused):
+		return all(400 <= code < 500 for code, _ in error.recipients.values())
+	if isinstance(error, smtplib.SMTPResponseException):
+		return 400 <= error.smtp_code < 500
+	return isinstance(error, (smtplib.SMTPServerDisconnected, OSError))
+
+
+class DeliveryStage:
+	"""Emails generated invoices to their recipients.
+	Messages are sent concurrently over a shared `SMTPPool`, optionally rate limited, and retried
+	on a fresh connection after temporary failures. The outcome of each invoice is recorded in a
+	`DeliveryLog`, and invoices already sent are skipped, so an interrupted run can simply be repeated.
+	"""
+
+	def __init__(self, pool: SMTPPool, sender: str, log: DeliveryLog = None, messages_per_second: float = None,
+				 subject: str = "Invoice {number}", body: str = None, max_attempts: int = 3,
+				 on_result: Callable[[Delivery, str], None] = None):
+		"""
+		Args:
+			pool: Connections to send through
+			sender: From address
+			log: Where to record delivery status (None to keep no record)
+			messages_per_second: Sustained sending rate (None for no limit)
+			subject, body: Message templates; `{number}` and `{recipient}` (its first line) are filled in
+			max_attempts: Tries per message before it is recorded as failed
+			on_result: Called with each delivery and its result message
+		"""
+		self.pool = pool
+		self.sender = sender
+		self.log = log
+		self.bucket = TokenBucket(messages_per_second) if messages_per_second else None
+		self.subject = subject
+		self.body = body or "Dear customer,\n\nPlease find invoice {number} attached.\n\nThank you for your business.\n"
+		self.max_attempts = max(1, max_attempts)
+		self.on_result = on_result
+
+	def build_message(self, delivery: Delivery) -> EmailMessage:
+		"""
+		The email for a delivery, with the invoice attached.
+		Raises:
+			OSError: The invoice file cannot be read
+		"""
+		fields = {"number": delivery.number or "", "recipient": delivery.recipient.strip().split("\n", 1)[0].strip()}
+		message = EmailMessage()
+		message["From"] = self.sender
+		message["To"] = delivery.to
+		message["Subject"] = self.subject.format(**fields)
+		message["Date"] = formatdate(localtime=True)
+		message["Message-ID"] = make_msgid(domain=self.sender.rpartition("@")[2] or None)
+		message.set_content(self.body.format(**fields))
+		content_type = mimetypes.guess_type(delivery.path)[0] or "application/octet-stream"
+		maintype, subtype = content_type.split("/", 1)
+		with open(delivery.path, 'rb') as f:
+			message.add_attachment(f.read(), maintype=maintype, subtype=subtype, filename=os.path.basename(delivery.path))
+		return message
+
+	def send(self, delivery: Delivery) -> str:
+		"""
+		Send one delivery now, retrying temporary failures, and record the outcome.
+		Returns:
+			"Sent to <address>" or an error message
+		"""
+		attempts = 0
+		try:
+			message = self.build_message(delivery)
+		except OSError as e:
+			result = f"Error: Cannot read {delivery.path}: {e}"
+		else:
+			while True:
+				attempts += 1
+				if self.bucket is not None:
+					self.bucket.acquire()
+				try:
+					with self.pool.connection() as connection:
+						connection.send_message(message)
+					result = f"Sent to {delivery.to}"
+					break
+				except (smtplib.SMTPException, OSError) as e:
+					result = f"Error: {e}"
+					if attempts >= self.max_attempts or not _is_transient(e):
+						break
+					time.sleep(min(30.0, 2 ** (attempts - 1)))
+		if self.log is not None:
+			self.log.record(delivery, "sent" if result.startswith("Sent") else "failed", result, attempts)
+		if self.on_result is not None:
+			self.on_result(delivery, result)
+		return result
+
+	def deliver(self, deliveries: Iterable[Delivery], workers: int = None, force: bool = False) -> Dict[str, str]:
+		"""
+		Send many deliveries concurrently.
+		Args:
+			deliveries: Invoices to send
+			workers: Concurrent senders (default: the pool size)
+			force: Also send invoices the log records as sent
+		Returns:
+			Result message per delivery key; invoices skipped because they were already sent get "Already sent"
+		"""
+		results: Dict[str, str] = {}
+		pending = []
+		for delivery in deliveries:
+			if delivery.key in results:
+				continue
+			if not force and self.log is not None and self.log.status(delivery.key) == "sent":
+				results[delivery.key] = "Already sent"
+				continue
+			results[delivery.key] = ""
+			pending.append(delivery)
+		with ThreadPoolExecutor(max_workers=workers or self.pool.size, thread_name_prefix="smtp") as executor:
+			for delivery, result in zip(pending, executor.map(self.send, pending)):
+				results[delivery.key] = result
+		return results
+
+	def deliver_results(self, results: Iterable[Tuple[Any, GenerationResult]], field_name: str = "Email", workers: int = None,
+						force: bool = False) -> Dict[str, str]:
+		"""
+		Send the invoices from (invoice, generation result) pairs, e.g. a batch just generated.
+		Failed generations and documents that were not saved to a file are skipped. Invoices
+		without an email address get an error result and are recorded as failed.
+		Returns:
+			Result message per delivery key (the invoice's payload hash)
+		"""
+		deliveries, results_by_key = [], {}
+		for invoice, result in results:
+			try:
+				delivery = Delivery.from_result(invoice, result, field_name)
+			except ValueError as e:
+				data = invoice if isinstance(invoice, dict) else invoice.to_dict()
+				delivery = Delivery(payload_hash(data), "", "", data.get("number"), data.get("to") or "")
+				if self.log is not None:
+					self.log.record(delivery, "failed", f"Error: {e}", 0)
+				results_by_key[delivery.key] = f"Error: {e}"
+				continue
+			if delivery is not None:
+				deliveries.append(delivery)
+		results_by_key.update(self.deliver(deliveries, workers, force))
+		return results_by_key
+
+
+def delivery_stage_from_config(config: Any, log: DeliveryLog = None,
+							   on_result: Callable[[Delivery, str], None] = None) -> DeliveryStage:
+	"""
+	Delivery stage for the SMTP settings plus `smtp_sender`, `emails_per_second`, `email_subject`
+	and `email_body`.
+	Raises:
+		ValueError: `smtp_sender` is not set
+	"""
+	sender = config.get('smtp_sender')
+	if not sender:
+		raise ValueError("Set smtp_sender in config.json to the address invoices are sent from")
+	return DeliveryStage(SMTPPool.from_config(config), sender, log, config.get('emails_per_second'),
+						 config.get('email_subject', "Invoice {number}"), config.get('email_body'), on_result=on_result)
@@ -0,0 +1,279 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Deque, Dict, List, Optional, Tuple, Any
+from .invoice_api import ErrorCategory, GenerationResult, Invoice, InvoiceFormat
+from .quota import TokenBucket
+
+
+class Priority(IntEnum):
+	"""Request classes, most urgent first."""
+	INTERACTIVE = 0  # Someone is waiting for the result, e.g. the Generate button
+	NORMAL = 1
+	BULK = 2  # Batch runs that can wait
+
+
+@dataclass(order=True)
+class _Waiter:
+	priority: int
+	sequence: int
+	cancelled: bool = field(default=False, compare=False)
+	bucket: Optional[TokenBucket] = field(default=None, compare=False)  # Rate limit of the key the request uses
+	token_due: float = field(default=0.0, compare=False)  # When `bucket` will next have a token for it
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+	return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+class PriorityDispatcher:
+	"""Admission control in front of a client, so urgent requests never queue behind batch work.
+	At most `max_concurrency` requests run at once, and `reserved_interactive` of those slots are
+	only used by interactive requests. Waiting requests are admitted strictly by priority, then
+	in arrival order. Where the client has a rate limit, the dispatcher reserves each request's
+	token in the same order, so an interactive request does not wait for the tokens wanted by
+	queued bulk requests either. With an `ApiRouter`, each request uses the rate limit of the
+	key it is routed to, and a request waiting for one key's token does not hold up requests for
+	other keys. The client keeps its rate limit, so calls made to it directly are still limited.
+
+	Use `client(priority)` to get an object that works like the wrapped client and sends all of
+	its requests with that priority:
+
+		dispatcher = PriorityDispatcher(api, max_concurrency=8)
+		scheduler.run_due(dispatcher.client(Priority.BULK))
+		dispatcher.client(Priority.INTERACTIVE).generate_pdf(invoice)
+	"""
+
+	def __init__(self, api: Any, max_concurrency: int = 8, reserved_interactive: int = 1,
+				 queue_timeout: float = None, window: int = 1000):
+		"""
+		Args:
+			api: An `InvoiceGeneratorAPI` or `ApiRouter`
+			max_concurrency: Requests sent at once
+			reserved_interactive: Slots kept free for interactive requests
+			queue_timeout: Longest wait for a slot in seconds (None to wait indefinitely)
+			window: Number of recent requests per class used for latency percentiles
+		Raises:
+			ValueError: The reservation leaves no slot for other requests
+		"""
+		if max_concurrency < 1:
+			raise ValueError("max_concurrency must be at least 1")
+		if not 0 <= reserved_interactive < max_concurrency:
+			raise ValueError("reserved_interactive must leave at least one slot for other requests")
+		self.api = api
+		self.max_concurrency = max_concurrency
+		self.reserved_interactive = reserved_interactive
+		self.queue_timeout = queue_timeout
+		self._queue: List[_Waiter] = []
+		self._sequence = itertools.count()
+		self._condition = threading.Condition()
+		self._in_flight = 0
+		self._running: Dict[Priority, int] = {priority: 0 for priority in Priority}
+		self._completed: Dict[Priority, int] = {priority: 0 for priority in Priority}
+		self._timeouts: Dict[Priority, int] = {priority: 0 for priority in Priority}
+		self._latencies: Dict[Priority, Deque[Tuple[float, float]]] = {priority: deque(maxlen=window) for priority in Priority}
+
+	def _capacity(self, priority: Priority) -> int:
+		if priority == Priority.INTERACTIVE:
+			return self.max_concurrency
+		return self.max_concurrency - self.reserved_interactive
+
+	def _bucket_for(self, payload: Any) -> Optional[TokenBucket]:
+		"""Rate limit of the client that sends `payload`: for a router, the client of the key it is routed to."""
+		client = self.api
+		if payload is not None and hasattr(client, "client_for"):
+			try:
+				client = client.client_for(payload)
+			except ValueError:
+				return None  # The router rejects it without sending anything
+		governor = getattr(client, "governor", None)
+		return governor.bucket if governor is not None else None
+
+	def _first_in_line(self, waiter: _Waiter, now: float) -> bool:
+		"""Whether every waiter ahead of `waiter` is only waiting for a token of another key."""
+		waiting = {other.bucket for other in self._queue if other.token_due > now}
+		for other in self._queue:
+			if other is waiter or not other < waiter:
+				continue
+			if other.bucket is None or other.bucket is waiter.bucket or other.bucket not in waiting:
+				return False
+		return True
+
+	def acquire(self, priority: Priority = Priority.NORMAL, timeout: float = None, bucket: TokenBucket = None) -> bool:
+		"""
+		Wait for a slot, and a token of `bucket` if given. The token is reserved for the calling
+		thread, so the client's own rate limit check lets the request through without taking
+		another. Every successful call must be followed by `release`.
+		Returns:
+			False if `timeout` seconds passed first
+		"""
+		priority = Priority(priority)
+		waiter = _Waiter(priority, next(self._sequence), bucket=bucket)
+		deadline = None if timeout is None else time.monotonic() + timeout
+		with self._condition:
+			heapq.heappush(self._queue, waiter)
+			while True:
+				wait = None
+				now = time.monotonic()
+				if self._in_flight < self._capacity(priority) and self._first_in_line(waiter, now):
+					wait = bucket.reserve() if bucket is not None else 0.0
+					if wait == 0:
+						self._queue.remove(waiter)
+						heapq.heapify(self._queue)
+						self._in_flight += 1
+						self._running[priority] += 1
+						# The next waiter may be able to start too
+						self._condition.notify_all()
+						return True
+					if waiter.token_due <= now:
+						# Requests for other keys no longer wait behind this one
+						self._condition.notify_all()
+					waiter.token_due = now + wait
+				if deadline is not None:
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						self._queue.remove(waiter)
+						heapq.heapify(self._queue)
+						self._timeouts[priority] += 1
+						self._condition.notify_all()
+						return False
+					wait = remaining if wait is None else min(wait, remaining)
+				self._condition.wait(wait)
+
+	def release(self, priority: Priority = Priority.NORMAL, queued: float = None, duration: float = None) -> None:
+		"""Free a slot, recording how long the request waited and ran (in seconds) if given."""
+		priority = Priority(priority)
+		with self._condition:
+			self._in_flight -= 1
+			self._running[priority] -= 1
+			self._completed[priority] += 1
+			if queued is not None and duration is not None:
+				self._latencies[priority].append((queued, duration))
+			self._condition.notify_all()
+
+	@contextmanager
+	def slot(self, priority: Priority = Priority.NORMAL, timeout: float = None, payload: Any = None):
+		"""
+		Hold a slot for the duration of a `with` block.
+		Args:
+			priority: Request class
+			timeout: Longest wait in seconds (default: `queue_timeout`)
+			payload: The invoice or invoice dict to be sent, to reserve a token of its key's rate limit
+		Raises:
+			TimeoutError: No slot became free within `timeout` seconds
+		"""
+		started = time.monotonic()
+		bucket = self._bucket_for(payload)
+		if not self.acquire(priority, self.queue_timeout if timeout is None else timeout, bucket):
+			raise TimeoutError(f"Timed out waiting to send a {Priority(priority).name.lower()} request")
+		admitted = time.monotonic()
+		try:
+			yield
+		finally:
+			if bucket is not None:
+				bucket.cancel_reservation()
+			self.release(priority, admitted - started, time.monotonic() - admitted)
+
+	def _call(self, priority: Priority, method: str, *args: Any) -> GenerationResult:
+		try:
+			with self.slot(priority, payload=args[0]):
+				return getattr(self.api, method)(*args)
+		except TimeoutError as e:
+			return GenerationResult.failure(f"Error: {str(e)}", ErrorCategory.TIMEOUT)
+
+	def generate_pdf(self, invoice: Invoice, output_path: str = None, priority: Priority = Priority.NORMAL) -> GenerationResult:
+		"""Generate a PDF once admitted. See `InvoiceGeneratorAPI.generate_pdf`."""
+		return self._call(priority, "generate_pdf", invoice, output_path)
+
+	def generate_ubl(self, invoice: Invoice, output_path: str = None, priority: Priority = Priority.NORMAL) -> GenerationResult:
+		"""Generate a UBL e-invoice once admitted. See `InvoiceGeneratorAPI.generate_ubl`."""
+		return self._call(priority, "generate_ubl", invoice, output_path)
+
+	def _send_payload(self, data: Dict[str, Any], format_type: InvoiceFormat, output_path: str,
+					  priority: Priority = Priority.NORMAL) -> GenerationResult:
+		return self._call(priority, "_send_payload", data, format_type, output_path)
+
+	def fetch_document(self, data: Dict[str, Any], format_type: InvoiceFormat = InvoiceFormat.PDF,
+					   priority: Priority = Priority.NORMAL) -> Tuple[Optional[bytes], GenerationResult]:
+		"""Generate a document once admitted, without saving it. See `InvoiceGeneratorAPI.fetch_document`."""
+		try:
+			with self.slot(priority, payload=data):
+				return self.api.fetch_document(data, format_type)
+		except TimeoutError as e:
+			return None, GenerationResult.failure(f"Error: {str(e)}", ErrorCategory.TIMEOUT)
+
+	def generate_document(self, data: Dict[str, Any], format_type: InvoiceFormat = InvoiceFormat.PDF,
+						  priority: Priority = Priority.NORMAL) -> Tuple[Optional[bytes], GenerationResult]:
+		"""Generate and return a document once admitted. See `InvoiceGeneratorAPI.generate_document`."""
+		try:
+			with self.slot(priority, payload=data):
+				return self.api.generate_document(data, format_type)
+		except TimeoutError as e:
+			return None, GenerationResult.failure(f"Error: {str(e)}", ErrorCategory.TIMEOUT)
+
+	def client(self, priority: Priority) -> "PriorityClient":
+		"""A client-like view that sends every request with `priority`."""
+		return PriorityClient(self, Priority(priority))
+
+	def stats(self) -> Dict[str, Dict[str, Any]]:
+		"""
+		Per-class counters and latencies over the recent window: queued and running requests,
+		completed and timed out totals, and median, 95th percentile and maximum queue wait and
+		request time in milliseconds.
+		"""
+		with self._condition:
+			queued = {priority: 0 for priority in Priority}
+			for waiter in self._queue:
+				queued[Priority(waiter.priority)] += 1
+			latencies = {priority: list(samples) for priority, samples in self._latencies.items()}
+			result = {}
+			for priority in Priority:
+				waits = sorted(sample[0] * 1000 for sample in latencies[priority])
+				durations = sorted(sample[1] * 1000 for sample in latencies[priority])
+				result[priority.name.lower()] = {
+					"queued": queued[priority],
+					"running": self._running[priority],
+					"completed": self._completed[priority],
+					"timed_out": self._timeouts[priority],
+					"wait_p50_ms": round(_percentile(waits, 0.5), 1),
+					"wait_p95_ms": round(_percentile(waits, 0.95), 1),
+					"wait_max_ms": round(waits[-1], 1) if waits else 0.0,
+					"request_p50_ms": round(_percentile(durations, 0.5), 1),
+					"request_p95_ms": round(_percentile(durations, 0.95), 1),
+					"request_max_ms": round(durations[-1], 1) if durations else 0.0,
+				}
+			return result
+
+
+class PriorityClient:
+	"""Client-like view of a `PriorityDispatcher` bound to one priority.
+	Generation goes through the dispatcher; everything else (validation, output naming, quota)
+	is answered by the wrapped client directly.
+	"""
+
+	def __init__(self, dispatcher: PriorityDispatcher, priority: Priority):
+		self.dispatcher = dispatcher
+		self.priority = priority
+
+	def generate_pdf(self, invoice: Invoice, output_path: str = None) -> GenerationResult:
+		return self.dispatcher.generate_pdf(invoice, output_path, self.priority)
+
+	def generate_ubl(self, invoice: Invoice, output_path: str = None) -> GenerationResult:
+		return self.dispatcher.generate_ubl(invoice, output_path, self.priority)
+
+	def _send_payload(self, data: Dict[str, Any], format_type: InvoiceFormat, output_path: str) -> GenerationResult:
+		return self.dispatcher._send_payload(data, format_type, output_path, self.priority)
+
+	def fetch_document(self, data: Dict[str, Any], format_type: InvoiceFormat = InvoiceFormat.PDF) -> Tuple[Optional[bytes], GenerationResult]:
+		return self.dispatcher.fetch_document(data, format_type, self.priority)
+
+	def generate_document(self, data: Dict[str, Any], format_type: InvoiceFormat = InvoiceFormat.PDF) -> Tuple[Optional[bytes], GenerationResult]:
+		return self.dispatcher.generate_document(data, format_type, self.priority)
+
+	def __getattr__(self, name: str) -> Any:
+		return getattr(self.dispatcher.api, name)
@@ -0,0 +1,203 @@
+import dataclasses
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Iterable, Optional, Tuple, Union, Any
+from .invoice_api import Invoice, InvoiceItem, CustomField, DisplayFields
+
+
+_POOL_SIZE = 10000  # Interned values kept; the least recently used are dropped first
+_pool: "OrderedDict[Any, Any]" = OrderedDict()
+_pool_lock = threading.Lock()
+_field_names: Dict[type, Tuple[str, ...]] = {}
+
+
+def _pool_key(value: Any) -> Any:
+	"""Key telling apart values that compare equal but differ in type, such as 5 and 5.0, or 1 and True."""
+	if isinstance(value, tuple):
+		return tuple, tuple(_pool_key(part) for part in value)
+	names = _field_names.get(type(value))
+	if names is None:
+		if not dataclasses.is_dataclass(value):
+			return type(value), value
+		names = _field_names[type(value)] = tuple(field.name for field in dataclasses.fields(value))
+	return type(value), tuple(_pool_key(getattr(value, name)) for name in names)
+
+
+def intern_value(value: Any) -> Any:
+	"""Get the shared instance equal to `value` (and of the same types), storing it if it is the first one seen.
+	Used for strings, frozen items, custom fields and display settings, so repeated text
+	blocks and line items exist once in memory however many invoices use them. The pool keeps
+	the most recently used values only, so it does not grow with the number of invoices.
+	"""
+	if value is None:
+		return None
+	key = _pool_key(value)
+	with _pool_lock:
+		shared = _pool.get(key)
+		if shared is not None:
+			_pool.move_to_end(key)
+			return shared
+		_pool[key] = value
+		if len(_pool) > _POOL_SIZE:
+			_pool.popitem(last=False)
+		return value
+
+
+def clear_interned() -> None:
+	"""Forget every interned value. Existing frozen invoices keep working; later ones stop sharing with them."""
+	with _pool_lock:
+		_pool.clear()
+
+
+@dataclass(frozen=True, slots=True)
+class FrozenItem:
+	"""Immutable `InvoiceItem`."""
+	name: str
+	quantity: int
+	unit_cost: float
+	description: Optional[str] = None
+	discount: Optional[float] = None
+	tax_category: Optional[str] = None
+
+	__post_init__ = InvoiceItem.__post_init__
+	total_cost = InvoiceItem.total_cost
+	to_dict = InvoiceItem.to_dict
+
+	@classmethod
+	def of(cls, item: Union[InvoiceItem, "FrozenItem", Dict[str, Any]]) -> "FrozenItem":
+		"""Get the interned frozen form of an item, `InvoiceItem` or item dict."""
+		if isinstance(item, cls):
+			return intern_value(item)
+		if isinstance(item, dict):
+			item = cls(**item)
+		else:
+			item = cls(item.name, item.quantity, item.unit_cost, item.description, item.discount, item.tax_category)
+		return intern_value(cls(
+			intern_value(item.name), item.quantity, item.unit_cost,
+			intern_value(item.description), item.discount, intern_value(item.tax_category)
+		))
+
+	def thaw(self) -> InvoiceItem:
+		return InvoiceItem(self.name, self.quantity, self.unit_cost, self.description, self.discount, self.tax_category)
+
+
+@dataclass(frozen=True, slots=True)
+class FrozenCustomField:
+	"""Immutable `CustomField`."""
+	name: str
+	value: str
+
+	to_dict = CustomField.to_dict
+
+
+@dataclass(frozen=True, slots=True)
+class FrozenDisplayFields:
+	"""Immutable `DisplayFields`."""
+	tax: Union[bool, str] = "%"
+	discounts: bool = False
+	shipping: bool = False
+
+	to_dict = DisplayFields.to_dict
+
+
+def _freeze_items(items: Iterable[Any]) -> Tuple[FrozenItem, ...]:
+	return intern_value(tuple(FrozenItem.of(item) for item in items))
+
+
+def _freeze_custom_fields(fields: Iterable[Any]) -> Tuple[FrozenCustomField, ...]:
+	return intern_value(tuple(
+		intern_value(FrozenCustomField(intern_value(field.name), intern_value(field.value))) for field in fields
+	))
+
+
+def _freeze_display_fields(fields: Any) -> FrozenDisplayFields:
+	return intern_value(FrozenDisplayFields(fields.tax, fields.discounts, fields.shipping))
+
+
+# Text attributes interned when set. Invoice numbers are unique, so they are not.
+_TEXT_FIELDS = ("sender", "recipient", "currency", "ship_to", "payment_terms", "logo", "notes", "terms")
+
+
+@dataclass(frozen=True, slots=True)
+class FrozenInvoice:
+	"""Immutable invoice whose parts are shared between variants.
+	Create one with `Invoice.freeze()` or `FrozenInvoice.of(invoice)`, then derive variants with
+	`evolve`, which keeps every unchanged part, such as the items, notes, terms and display settings,
+	as the same object. Text, items and custom fields are interned, so memory for a large batch grows
+	with what differs between invoices rather than with their number.
+
+	A frozen invoice can be passed to `InvoiceGeneratorAPI.generate_pdf`, `generate_ubl`,
+	`validate_invoice` and `validate_batch` in place of an `Invoice`.
+	"""
+	sender: str
+	recipient: str
+	items: Tuple[FrozenItem, ...] = ()
+	number: Optional[str] = None
+	date: Optional[date] = None
+	due_date: Optional[date] = None
+	currency: str = "USD"
+	tax: float = 0.0
+	discounts: float = 0.0
+	shipping: float = 0.0
+	amount_paid: float = 0.0
+	ship_to: Optional[str] = None
+	payment_terms: Optional[str] = None
+	logo: Optional[str] = None
+	notes: Optional[str] = None
+	terms: Optional[str] = None
+	custom_fields: Tuple[FrozenCustomField, ...] = ()
+	display_fields: FrozenDisplayFields = FrozenDisplayFields()
+
+	__post_init__ = Invoice.__post_init__
+	subtotal = Invoice.subtotal
+	total = Invoice.total
+	balance_due = Invoice.balance_due
+	to_dict = Invoice.to_dict
+
+	@classmethod
+	def of(cls, invoice: Union[Invoice, "FrozenInvoice"]) -> "FrozenInvoice":
+		"""Get a frozen copy of an invoice, sharing interned parts with other frozen invoices."""
+		if isinstance(invoice, cls):
+			return invoice
+		return cls(**cls._frozen_values({name: getattr(invoice, name) for name in cls.__dataclass_fields__}))
+
+	@staticmethod
+	def _frozen_values(values: Dict[str, Any]) -> Dict[str, Any]:
+		for name in _TEXT_FIELDS:
+			if name in values:
+				values[name] = intern_value(values[name])
+		if "items" in values:
+			values["items"] = _freeze_items(values["items"])
+		if "custom_fields" in values:
+			values["custom_fields"] = _freeze_custom_fields(values["custom_fields"])
+		if "display_fields" in values:
+			values["display_fields"] = _freeze_display_fields(values["display_fields"])
+		return values
+
+	def evolve(self, **changes: Any) -> "FrozenInvoice":
+		"""
+		Get a variant with some attributes changed; everything else is shared with this invoice.
+		Args:
+			changes: `Invoice` attributes, e.g. `recipient`, `number` or `items` (a list of
+				`InvoiceItem`, `FrozenItem` or item dicts)
+		Raises:
+			TypeError: An unknown attribute was given
+			ValueError: The variant is not a valid invoice
+		"""
+		return dataclasses.replace(self, **self._frozen_values(changes))
+
+	def with_items(self, *items: Union[InvoiceItem, FrozenItem, Dict[str, Any]]) -> "FrozenInvoice":
+		"""Get a variant with extra items appended."""
+		return self.evolve(items=self.items + tuple(items))
+
+	def thaw(self) -> Invoice:
+		"""Get a mutable `Invoice` copy."""
+		return Invoice(
+			**{name: getattr(self, name) for name in self.__dataclass_fields__
+			   if name not in ("items", "custom_fields", "display_fields")},
+			items=[item.thaw() for item in self.items],
+			custom_fields=[CustomField(field.name, field.value) for field in self.custom_fields],
+			display_fields=DisplayFields(self.display_fields.tax, self.display_fields.discounts, self.display_fields.shipping)
+		)
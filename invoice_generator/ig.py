@@ -1,13 +1,21 @@
+import threading
 import wx
 import wx.adv
 from datetime import date
 from .invoice_api import *
+from .catalog import default_catalog
 from .config import config
+from .contacts import Contact, default_address_book
+from .ledger import close_ledgers
+from .routing import client_from_config
 from .speech import speak
 from .templates import template_manager
+from .template_watcher import TemplateWatcher, template_catalog
 from .template_dialogs import SaveTemplateDialog, LoadTemplateDialog, ManageTemplatesDialog
-from .utils import parse_wx_date_to_python, python_date_to_wx_date
+from .utils import parse_wx_date_to_python, python_date_to_wx_date, sanitize_filename
 
+_CONTACT_SEARCH_DELAY = 150  # Milliseconds without typing before the To field is searched
+_CONTACT_SUGGESTIONS = 8
 
 class OptionsDialog(wx.Dialog):
 	def __init__(self, parent):
@@ -151,6 +159,28 @@ class EditableListCtrl(wx.ListCtrl):
 		return items
 
 
+class CatalogCompleter(wx.TextCompleter):
+	"""Offers catalog product names as completions for the item name field."""
+
+	def __init__(self, catalog, limit=20):
+		wx.TextCompleter.__init__(self)
+		self.catalog = catalog
+		self.limit = limit
+		self._names = []
+		self._position = 0
+
+	def Start(self, prefix):
+		self._names = [entry.name for entry in self.catalog.search(prefix, self.limit)]
+		self._position = 0
+		return bool(self._names)
+
+	def GetNext(self):
+		if self._position >= len(self._names):
+			return ""
+		self._position += 1
+		return self._names[self._position - 1]
+
+
 class InvoiceFrame(wx.Frame):
 	def __init__(self):
 		wx.Frame.__init__(self, None, title="Invoice Generator", size=(700, 800))
@@ -159,6 +189,11 @@ class InvoiceFrame(wx.Frame):
 		self._setup_field_definitions()
 		self._create_menu()
 		self._build_ui()
+		self.catalog = None
+		self._load_catalog()
+		self.address_book = None
+		self._contact_matches = []
+		self._load_address_book()
 
 	def _create_menu(self):
 		menubar = wx.MenuBar()
@@ -170,6 +205,7 @@ class InvoiceFrame(wx.Frame):
 		save_template_item = template_menu.Append(wx.ID_ANY, "&Save as Template\tCtrl+S", "Save current values as a template")
 		manage_templates_item = template_menu.Append(wx.ID_ANY, "&Manage Templates", "View and delete existing templates")
 		file_menu.AppendSubMenu(template_menu, "&Templates")
+		save_contact_item = file_menu.Append(wx.ID_ANY, "Save &Recipient to Address Book\tCtrl+B", "Save the To and Ship to fields as a contact")
 		file_menu.AppendSeparator()
 		exit_item = file_menu.Append(wx.ID_EXIT, "E&xit\tCtrl+Q", "Exit the application")
 		menubar.Append(file_menu, "&File")
@@ -178,6 +214,7 @@ class InvoiceFrame(wx.Frame):
 		self.Bind(wx.EVT_MENU, self._on_load_template, load_template_item)
 		self.Bind(wx.EVT_MENU, self._on_save_template, save_template_item)
 		self.Bind(wx.EVT_MENU, self._on_manage_templates, manage_templates_item)
+		self.Bind(wx.EVT_MENU, self._on_save_contact, save_contact_item)
 		self.Bind(wx.EVT_MENU, self._on_exit, exit_item)
 
 	def _setup_field_definitions(self):
@@ -341,6 +378,128 @@ class InvoiceFrame(wx.Frame):
 		self.message = wx.StaticText(self.panel, label="", size=(400,25))
 		parent_sizer.Add(self.message, 0, wx.ALL | wx.EXPAND, 10)
 
+	def _load_catalog(self):
+		"""Load the product catalog in the background, then enable item name autocompletion."""
+		def load():
+			try:
+				catalog = default_catalog()
+			except (IOError, OSError, ValueError) as e:
+				wx.CallAfter(self.display, f"Error loading product catalog: {e}")
+				return
+			if catalog is not None:
+				wx.CallAfter(self._enable_catalog, catalog)
+		threading.Thread(target=load, name="catalog-loader", daemon=True).start()
+
+	def _enable_catalog(self, catalog):
+		self.catalog = catalog
+		self.item_name.AutoComplete(CatalogCompleter(catalog))
+		self.item_name.Bind(wx.EVT_TEXT, self._on_item_name_changed)
+		self.item_name.SetToolTip(f"{self.field_configs['item_inputs']['item_name']['hint']} - type to search {len(catalog)} catalog products")
+
+	def _on_item_name_changed(self, event):
+		"""Fill in the item details when the name matches a catalog product."""
+		event.Skip()
+		entry = self.catalog.get(self.item_name.GetValue()) if self.catalog else None
+		if entry is None:
+			return
+		self.item_description.SetValue(entry.description)
+		self.item_unit_cost.SetValue(entry.unit_cost)
+		self.item_discount.SetValue(entry.discount or 0)
+
+	def _load_address_book(self):
+		"""Load the address book in the background, then enable contact suggestions in the To field."""
+		def load():
+			address_book = default_address_book()
+			wx.CallAfter(self._enable_address_book, address_book)
+		threading.Thread(target=load, name="address-book-loader", daemon=True).start()
+
+	def _enable_address_book(self, address_book):
+		self.address_book = address_book
+		to_ctrl = self.fields['to']
+		self.contact_list = wx.ListBox(self.panel, size=(300, 90))
+		self.contact_list.SetToolTip("Matching contacts - press Enter to fill in the recipient and shipping address")
+		to_ctrl.GetContainingSizer().Add(self.contact_list, 0, wx.EXPAND | wx.TOP, 2)
+		self.contact_list.Hide()
+		self.contact_list.Bind(wx.EVT_LISTBOX_DCLICK, self._on_contact_chosen)
+		self.contact_list.Bind(wx.EVT_KEY_DOWN, self._on_contact_list_key)
+		# Search once typing pauses rather than on every keystroke
+		self._contact_timer = wx.Timer(self)
+		self.Bind(wx.EVT_TIMER, self._on_search_contacts, self._contact_timer)
+		to_ctrl.Bind(wx.EVT_TEXT, self._on_to_changed)
+		to_ctrl.Bind(wx.EVT_KEY_DOWN, self._on_to_key)
+		to_ctrl.SetToolTip(f"{self.field_configs['multiline']['to']['hint']} - type a name or address to search {len(address_book)} saved contacts")
+
+	def _on_to_changed(self, event):
+		event.Skip()
+		self._contact_timer.StartOnce(_CONTACT_SEARCH_DELAY)
+
+	def _on_search_contacts(self, event):
+		query = self.fields['to'].GetValue().strip()
+		# Only suggest while the first line is typed; a filled-in address is left alone
+		matches = self.address_book.search(query, _CONTACT_SUGGESTIONS) if query and "\n" not in query else []
+		self._show_contacts(matches)
+
+	def _show_contacts(self, matches):
+		announce = bool(matches) and len(matches) != len(self._contact_matches)
+		self._contact_matches = matches
+		self.contact_list.Set([f"{contact.name} - {contact.address.splitlines()[0]}" if contact.address else contact.name for contact in matches])
+		if matches:
+			self.contact_list.SetSelection(0)
+		self.contact_list.Show(bool(matches))
+		self.panel.Layout()
+		if announce:
+			speak(f"{len(matches)} matching contacts, press Down to choose")
+
+	def _on_to_key(self, event):
+		key = event.GetKeyCode()
+		if self._contact_matches and key == wx.WXK_DOWN:
+			self.contact_list.SetFocus()
+		elif self._contact_matches and key == wx.WXK_ESCAPE:
+			self._show_contacts([])
+		else:
+			event.Skip()
+
+	def _on_contact_list_key(self, event):
+		key = event.GetKeyCode()
+		if key in (wx.WXK_RETURN, wx.WXK_NUMPAD_ENTER):
+			self._on_contact_chosen(event)
+		elif key == wx.WXK_ESCAPE:
+			self._show_contacts([])
+			self.fields['to'].SetFocus()
+		else:
+			event.Skip()
+
+	def _on_contact_chosen(self, event):
+		"""Fill in the recipient and shipping address from the selected contact."""
+		index = self.contact_list.GetSelection()
+		if index == wx.NOT_FOUND or index >= len(self._contact_matches):
+			return
+		contact = self._contact_matches[index]
+		# ChangeValue does not send EVT_TEXT, so filling in does not start another search
+		self.fields['to'].ChangeValue(contact.recipient)
+		self.fields['ship_to'].ChangeValue(contact.ship_to)
+		self._show_contacts([])
+		self.fields['to'].SetFocus()
+		self.display(f"Filled in {contact.name}")
+
+	def _on_save_contact(self, event):
+		"""Save the To and Ship to fields as a contact, replacing any contact with the same name."""
+		if self.address_book is None:
+			self.display("Error: The address book is still loading")
+			return
+		try:
+			contact = Contact.from_recipient(self.fields['to'].GetValue(), self.fields['ship_to'].GetValue())
+		except ValueError as e:
+			self.display(f"Error: {e}")
+			return
+		self.address_book.add(contact)
+		def save():
+			if self.address_book.save():
+				wx.CallAfter(self.display, f"Saved {contact.name} to the address book")
+			else:
+				wx.CallAfter(self.display, "Error: Failed to save the address book")
+		threading.Thread(target=save, name="address-book-saver", daemon=True).start()
+
 	def on_add_item(self, event):
 		name = self.item_name.GetValue().strip()
 		description = self.item_description.GetValue().strip()
@@ -394,10 +553,17 @@ class InvoiceFrame(wx.Frame):
 		if result == wx.ID_OK:
 			template_name = dialog.get_template_name()
 			field_values = self._get_current_field_values()
-			if template_manager.save_template(template_name, field_values):
-				self.display(f"Template '{template_name}' saved successfully")
+			try:
+				saved = template_manager.save_template(template_name, field_values, extends=dialog.get_base_template())
+			except ValueError as e:
+				self.display(f"Error: {e}")
 			else:
-				self.display(f"Failed to save template '{template_name}'")
+				if saved:
+					# Show the new template in open dialogs without waiting for the watcher
+					template_catalog.update([f"{sanitize_filename(template_name)}.json"])
+					self.display(f"Template '{template_name}' saved successfully")
+				else:
+					self.display(f"Failed to save template '{template_name}'")
 		dialog.Destroy()
 
 	def _on_load_template(self, event):
@@ -484,14 +650,13 @@ class InvoiceFrame(wx.Frame):
 				discounts=self.discounts_field.GetValue(),
 				shipping=self.shipping_field.GetValue()
 			)
-			api_key = config.get('api_key')
-			api = create_api_client(api_key)
+			api = client_from_config(config)
 			validation_errors = api.validate_invoice(invoice)
 			if validation_errors:
 				self.display("Validation errors: " + "; ".join(validation_errors))
 				return
-			msg = api.generate_pdf(invoice)
-			self.display(msg)
+			result = api.generate_pdf(invoice)
+			self.display(str(result))
 		except Exception as e:
 			self.display(f"Error: {str(e)}")
 			raise
@@ -520,6 +685,7 @@ class InvoiceFrame(wx.Frame):
 		values['tax_display'] = self.tax_field.GetSelection()
 		values['discounts_display'] = self.discounts_field.GetValue()
 		values['shipping_display'] = self.shipping_field.GetValue()
+		values['items'] = self.listctrl.get_items()
 		return values
 
 	def _set_field_values(self, values):
@@ -553,10 +719,22 @@ class InvoiceFrame(wx.Frame):
 			self.discounts_field.SetValue(bool(values['discounts_display']))
 		if 'shipping_display' in values:
 			self.shipping_field.SetValue(bool(values['shipping_display']))
+		if values.get('items'):
+			self.listctrl.DeleteAllItems()
+			for item in values['items']:
+				self.listctrl.add_item(item)
 
 
 class InvoiceApp(wx.App):
 	def OnInit(self):
+		# Keep the template catalog current while the app runs, including changes made elsewhere
+		self.template_watcher = TemplateWatcher(template_catalog)
+		self.template_watcher.start()
 		frame = InvoiceFrame()
 		frame.Show()
 		return True
+
+	def OnExit(self):
+		self.template_watcher.stop()
+		close_ledgers()
+		return 0
@@ -1,10 +1,16 @@
 from dataclasses import dataclass, field, asdict
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Tuple, Union
 from datetime import date, datetime
 from enum import Enum
+from contextlib import contextmanager
 import requests
 import json
+import time
 from .utils import sanitize_filename
+from .quota import QuotaGovernor, QuotaExceededError, QuotaExhaustedError
+from .paths import OutputPathTemplate
+from .assets import LogoCache
+from .tracing import tracer
 
 
 class InvoiceFormat(Enum):
@@ -29,6 +35,17 @@ class Language(Enum):
 	THAI = "th"
 
 
+class ErrorCategory(Enum):
+	"""Why a generation failed."""
+	TIMEOUT = "timeout"
+	CONNECTION = "connection"
+	API = "api"  # The API answered with an error status
+	IO = "io"  # The document could not be saved
+	QUOTA = "quota"  # Held back by the client-side rate limit or soft quota limit
+	QUOTA_EXHAUSTED = "quota_exhausted"  # The hard monthly quota is used up
+	INVALID = "invalid"  # Not sent, e.g. the invoice failed validation or has no API key
+
+
 @dataclass
 class CustomField:
 	name: str
@@ -44,6 +61,7 @@ class InvoiceItem:
 	unit_cost: float
 	description: Optional[str] = None
 	discount: Optional[float] = None
+	tax_category: Optional[str] = None  # Used by the tax engine; not sent to the API
 
 	def __post_init__(self):
 		if not self.name.strip():
@@ -147,6 +165,26 @@ class Invoice:
 		"""Calculate remaining balance after payments."""
 		return max(0, self.total() - self.amount_paid)
 
+	def converted_to(self, currency: str, as_of: Optional[date] = None, rates: Any = None) -> "Invoice":
+		"""
+		Get a copy of this invoice with every amount converted to another currency.
+		Args:
+			currency: Target currency code
+			as_of: Date of the exchange rates to use (defaults to the invoice date, then today)
+			rates: A `currency.RateTable` (defaults to the configured rate table)
+		Returns:
+			A new invoice; this one is left unchanged
+		Raises:
+			ImportError: NumPy (the `reports` extra) is not installed
+		"""
+		from .currency import convert_invoices
+		return convert_invoices([self], currency, rates, as_of)[0]
+
+	def freeze(self) -> Any:
+		"""Get an immutable `frozen.FrozenInvoice` copy, for deriving many variants that share unchanged parts."""
+		from .frozen import FrozenInvoice
+		return FrozenInvoice.of(self)
+
 	def to_dict(self) -> Dict[str, Any]:
 		"""Convert invoice to API format."""
 		data = {
@@ -189,18 +227,92 @@ class Invoice:
 		return data
 
 
+@dataclass
+class GenerationResult:
+	"""Outcome of generating one invoice.
+	`str(result)` is the message shown to users ("Invoice saved as ...", "Error 429: ..."), while
+	batch code can check `succeeded`, `error` and `transient` without parsing it.
+	"""
+	status: str  # "success", "failed", or "skipped" when nothing was attempted
+	message: str
+	http_status: Optional[int] = None
+	error: Optional[ErrorCategory] = None
+	output_path: Optional[str] = None  # File the document was saved to
+	location: Optional[str] = None  # Where the sink stored the document, when a sink is used
+	size: int = 0  # Bytes in the generated document
+	timings: Dict[str, float] = field(default_factory=dict)  # Seconds spent per phase, e.g. "http", "write"
+
+	@classmethod
+	def failure(cls, message: str, error: ErrorCategory, http_status: int = None) -> "GenerationResult":
+		return cls("failed", message, http_status=http_status, error=error)
+
+	def fail(self, message: str, error: ErrorCategory) -> "GenerationResult":
+		"""Mark this result as failed. Returns the result."""
+		self.status, self.message, self.error = "failed", message, error
+		return self
+
+	@property
+	def succeeded(self) -> bool:
+		return self.status == "success"
+
+	@property
+	def transient(self) -> bool:
+		"""
+		Whether trying again later may succeed: timeouts, connection problems, rate or soft quota
+		limits and server errors. An exhausted monthly quota is not transient.
+		"""
+		if self.error in (ErrorCategory.TIMEOUT, ErrorCategory.CONNECTION, ErrorCategory.QUOTA):
+			return True
+		return self.error == ErrorCategory.API and self.http_status is not None and (self.http_status == 429 or self.http_status >= 500)
+
+	@property
+	def elapsed(self) -> float:
+		"""Total seconds across all timed phases."""
+		return sum(self.timings.values())
+
+	@contextmanager
+	def phase(self, name: str):
+		"""Time a block of work as phase `name`."""
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - started
+
+	def __str__(self) -> str:
+		return self.message
+
+
 class InvoiceGeneratorAPI:
 	"""Client for the invoice-generator.com API."""
 	BASE_URL = "https://invoice-generator.com"
 
-	def __init__(self, api_key: str):
+	def __init__(self, api_key: str, governor: QuotaGovernor = None, sink: Any = None,
+				 path_template: OutputPathTemplate = None, logo_cache: LogoCache = None, ledger: Any = None,
+				 optimize_pdfs: bool = False):
 		"""
 		Initialize the API client.
 		Args:
 			api_key: API key for authenticated requests.
 				This used to be optional but is now required.
+			governor: Optional rate and monthly quota limits checked before each request
+			sink: Optional output sink, such as an `InvoiceArchive`. When set, generated
+				documents are passed to `sink.write(data, format_type, content)` instead of
+				being written to `output_path`.
+			path_template: Optional template used for default output paths instead of
+				the flat `invoice_<number>` naming
+			logo_cache: Optional cache that resolves each distinct logo once and sends
+				it inline instead of the remote URL
+			ledger: Optional `InvoiceLedger` that records every generation attempt
+			optimize_pdfs: Shrink generated PDFs (see `invoice_generator.optimize`) before saving them
 		"""
 		self.api_key = api_key
+		self.governor = governor
+		self.sink = sink
+		self.path_template = path_template
+		self.logo_cache = logo_cache
+		self.ledger = ledger
+		self.optimize_pdfs = optimize_pdfs
 		self.session = requests.Session()
 		self._setup_headers()
 
@@ -220,70 +332,195 @@ class InvoiceGeneratorAPI:
 			invoice: The invoice data
 			extension: File extension (without dot)
 		Returns:
-			Sanitized filename
+			Sanitized filename, or a path rendered from `path_template` if one is set
 		"""
+		if self.path_template is not None:
+			return self.path_template.render(invoice, extension)
 		base_name = "invoice"
 		if invoice.number and invoice.number.strip():
 			base_name += f"_{invoice.number.strip()}"
 		filename = f"{base_name}.{extension}"
 		return sanitize_filename(filename)
 
-	def generate_pdf(self, invoice: Invoice, output_path: str = None) -> str:
+	def plan_output_paths(self, invoices: List[Invoice], extension: str = "pdf") -> List[str]:
+		"""
+		Generate default output paths for a batch of invoices.
+		With a path template, collisions are resolved and directories are created once for the batch.
+		Args:
+			invoices: The invoices to be generated
+			extension: File extension (without dot)
+		Returns:
+			One path per invoice, in the same order
+		"""
+		if self.path_template is not None:
+			return self.path_template.plan(invoices, extension)
+		return [self._generate_filename(invoice, extension) for invoice in invoices]
+
+	def generate_pdf(self, invoice: Invoice, output_path: str = None) -> GenerationResult:
 		"""
 		Generate a PDF invoice.
 		Args:
 			invoice: The invoice data to generate
 			output_path: Where to save the PDF file (if None, uses invoice number)
 		Returns:
-			Success message or error details
-		Raises:
-			requests.RequestException: On network or API errors
+			A `GenerationResult`. Check `succeeded`, or `error` (an `ErrorCategory`) and `transient`
+			on failure; `str(result)` is the message shown to users.
 		"""
 		if output_path is None:
 			output_path = self._generate_filename(invoice, "pdf")
 		return self._generate_invoice(invoice, InvoiceFormat.PDF, output_path)
 
-	def generate_ubl(self, invoice: Invoice, output_path: str = None) -> str:
+	def generate_ubl(self, invoice: Invoice, output_path: str = None) -> GenerationResult:
 		"""
 		Generate an e-invoice in UBL format.
 		Args:
 			invoice: The invoice data to generate
 			output_path: Where to save the UBL XML file (if None, uses invoice number)
 		Returns:
-			Success message or error details
-		Raises:
-			requests.RequestException: On network or API errors
+			A `GenerationResult`. Check `succeeded`, or `error` (an `ErrorCategory`) and `transient`
+			on failure; `str(result)` is the message shown to users.
 		"""
 		if output_path is None:
 			output_path = self._generate_filename(invoice, "xml")
 		return self._generate_invoice(invoice, InvoiceFormat.UBL, output_path)
 
-	def _generate_invoice(self, invoice: Invoice, format_type: InvoiceFormat, output_path: str) -> str:
+	def _generate_invoice(self, invoice: Invoice, format_type: InvoiceFormat, output_path: str) -> GenerationResult:
 		"""Internal method to generate invoices."""
+		started = time.perf_counter()
+		with tracer.span("to_dict", number=invoice.number):
+			data = invoice.to_dict()
+		serialized = time.perf_counter() - started
+		result = self._send_payload(data, format_type, output_path)
+		result.timings = {"serialize": serialized, **result.timings}
+		return result
+
+	def _send_payload(self, data: Dict[str, Any], format_type: InvoiceFormat, output_path: str) -> GenerationResult:
+		"""
+		Post an already serialized invoice and save the response.
+		Args:
+			data: Invoice in API format, as returned by `Invoice.to_dict`
+			format_type: Output format to request
+			output_path: Where to save the generated document
+		Returns:
+			A `GenerationResult`
+		"""
+		with tracer.span("generate", number=data.get("number"), format=format_type.value):
+			result = self._post_payload(data, format_type, output_path)
+			if self.ledger is not None:
+				with tracer.span("ledger_record"), result.phase("ledger"):
+					self.ledger.record(data, format_type, output_path, result)
+		return result
+
+	def generate_document(self, data: Dict[str, Any], format_type: InvoiceFormat = InvoiceFormat.PDF) -> Tuple[Optional[bytes], GenerationResult]:
+		"""
+		Post an already serialized invoice and return the document instead of saving it.
+		Like `generate_pdf`, the PDF is optimized if enabled and the attempt is recorded in the ledger.
+		Returns:
+			(document bytes or None, `GenerationResult`)
+		"""
+		with tracer.span("generate", number=data.get("number"), format=format_type.value):
+			content, result = self.fetch_document(data, format_type)
+			if content is not None:
+				content = self._optimize(content, format_type, result)
+			if self.ledger is not None:
+				with tracer.span("ledger_record"), result.phase("ledger"):
+					self.ledger.record(data, format_type, None, result)
+		return content, result
+
+	def _optimize(self, content: bytes, format_type: InvoiceFormat, result: GenerationResult) -> bytes:
+		if self.optimize_pdfs and format_type == InvoiceFormat.PDF:
+			from .optimize import optimize_document
+			with tracer.span("optimize", bytes=len(content)), result.phase("optimize"):
+				try:
+					content = optimize_document(content)
+				except Exception:
+					pass  # The document is already generated and paid for: keep it as received
+		result.size = len(content)
+		return content
+
+	def _post_payload(self, data: Dict[str, Any], format_type: InvoiceFormat, output_path: str) -> GenerationResult:
+		"""Send a serialized invoice to the API and store the response."""
+		content, result = self.fetch_document(data, format_type)
+		if content is None:
+			return result
+		content = self._optimize(content, format_type, result)
+		try:
+			if self.sink is not None:
+				with tracer.span("sink_write", bytes=len(content)), result.phase("write"):
+					location = self.sink.write(data, format_type, content)
+				result.location = str(location)
+				result.message = f"Invoice saved to {location}"
+				return result
+			# Save the file
+			with tracer.span("file_write", bytes=len(content)), result.phase("write"):
+				with open(output_path, 'wb') as f:
+					f.write(content)
+			result.output_path = output_path
+			result.message = f"Invoice saved as {output_path}"
+			return result
+		except IOError as e:
+			return result.fail(f"Error saving file: {str(e)}", ErrorCategory.IO)
+
+	def fetch_document(self, data: Dict[str, Any], format_type: InvoiceFormat = InvoiceFormat.PDF) -> Tuple[Optional[bytes], GenerationResult]:
+		"""
+		Send a serialized invoice to the API and return the generated document without saving it.
+		Args:
+			data: Invoice in API format, as returned by `Invoice.to_dict`
+			format_type: Output format to request
+		Returns:
+			(document bytes or None, `GenerationResult` with the HTTP status, error and timings)
+		"""
+		result = GenerationResult("failed", "")
+		if self.logo_cache is not None and data.get("logo"):
+			with tracer.span("logo_resolve"), result.phase("logo"):
+				data = dict(data, logo=self.logo_cache.resolve(data["logo"]))
+		if self.governor:
+			try:
+				with tracer.span("quota_acquire"), result.phase("quota"):
+					self.governor.acquire()
+			except QuotaExhaustedError as e:
+				return None, result.fail(f"Error: {str(e)}", ErrorCategory.QUOTA_EXHAUSTED)
+			except QuotaExceededError as e:
+				return None, result.fail(f"Error: {str(e)}", ErrorCategory.QUOTA)
+		generated = False
 		try:
 			# Choose endpoint based on format
 			url = self.BASE_URL
 			if format_type == InvoiceFormat.UBL:
 				url += "/ubl"
-			# Prepare data
-			data = invoice.to_dict()
 			# Make request
-			response = self.session.post(url, json=data, timeout=30)
+			with tracer.span("http_post", url=url), result.phase("http"):
+				response = self.session.post(url, json=data, timeout=30)
+			result.http_status = response.status_code
 			if response.status_code == 200:
-				# Save the file
-				with open(output_path, 'wb') as f:
-					f.write(response.content)
-				return f"Invoice saved as {output_path}"
-			else:
-				return f"Error {response.status_code}: {response.text}"
+				generated = True
+				result.status, result.size = "success", len(response.content)
+				result.message = f"Invoice generated ({result.size} bytes)"
+				return response.content, result
+			return None, result.fail(f"Error {response.status_code}: {response.text}", ErrorCategory.API)
 		except requests.exceptions.Timeout:
-			return "Error: Request timed out"
+			return None, result.fail("Error: Request timed out", ErrorCategory.TIMEOUT)
 		except requests.exceptions.ConnectionError:
-			return "Error: Unable to connect to the API"
+			return None, result.fail("Error: Unable to connect to the API", ErrorCategory.CONNECTION)
 		except requests.exceptions.RequestException as e:
-			return f"Error: {str(e)}"
-		except IOError as e:
-			return f"Error saving file: {str(e)}"
+			return None, result.fail(f"Error: {str(e)}", ErrorCategory.CONNECTION)
+		finally:
+			if self.governor:
+				# The API counts the invoice once it is returned, even if saving it failed
+				if generated:
+					self.governor.commit()
+				else:
+					self.governor.release()
+
+	def remaining_quota(self) -> Optional[int]:
+		"""
+		Get the number of invoices that can still be generated this month.
+		Returns:
+			Remaining invoices, or None when no governor or hard limit is configured
+		"""
+		if self.governor is None:
+			return None
+		return self.governor.remaining_quota()
 
 	def validate_invoice(self, invoice: Invoice) -> List[str]:
 		"""
@@ -297,17 +534,26 @@ class InvoiceGeneratorAPI:
 		# Check for required items
 		if not invoice.items:
 			errors.append("At least one item is required")
-		try:
-			# This will raise ValueError for invalid data
-			invoice.to_dict()
-		except ValueError as e:
-			errors.append(str(e))
 		if invoice.due_date and invoice.date and invoice.due_date < invoice.date:
 			errors.append("Due date cannot be before invoice date")
 		if invoice.amount_paid > invoice.total():
 			errors.append("Amount paid cannot exceed total")
 		return errors
 
+	def validate_batch(self, invoices_or_rows: List[Union[Invoice, Dict[str, Any]]]) -> Any:
+		"""
+		Validate many invoices at once, before spending any API quota.
+		Requires the `reports` extra (NumPy).
+		Args:
+			invoices_or_rows: Invoices, or dicts in the `Invoice.to_dict()` format
+		Returns:
+			A `validation.BatchValidation` with structured per-invoice, per-field issues
+		Raises:
+			ImportError: If NumPy is not installed
+		"""
+		from .validation import validate_batch
+		return validate_batch(invoices_or_rows)
+
 	def get_supported_currencies(self) -> List[str]:
 		"""Get list of supported currency codes."""
 		return [currency.value for currency in Currency]
@@ -335,9 +581,41 @@ def create_item(name: str, quantity: int, unit_cost: float,
 	)
 
 
-def create_api_client(api_key: str = None) -> InvoiceGeneratorAPI:
+def invoice_from_dict(data: Dict[str, Any]) -> Invoice:
+	"""
+	Build an invoice from a dict in the API format, as produced by `Invoice.to_dict`.
+	Items may also carry a `tax_category`.
+	Raises:
+		ValueError: Required values are missing or invalid
+	"""
+	try:
+		invoice = create_invoice(str(data.get("from") or ""), str(data.get("to") or ""))
+		for item_data in data.get("items", []):
+			item = create_item(item_data["name"], int(item_data.get("quantity", 1)), float(item_data["unit_cost"]),
+							   item_data.get("description"), item_data.get("discount"))
+			item.tax_category = item_data.get("tax_category")
+			invoice.add_item(item)
+		for name in ("number", "currency", "payment_terms", "logo", "notes", "terms", "ship_to"):
+			if data.get(name):
+				setattr(invoice, name, str(data[name]))
+		for name in ("tax", "discounts", "shipping", "amount_paid"):
+			if data.get(name):
+				setattr(invoice, name, float(data[name]))
+		for name in ("date", "due_date"):
+			if data.get(name):
+				setattr(invoice, name, date.fromisoformat(str(data[name])[:10]))
+		if data.get("fields"):
+			invoice.display_fields = DisplayFields(**data["fields"])
+		for custom_field in data.get("custom_fields", []):
+			invoice.add_custom_field(str(custom_field["name"]), str(custom_field["value"]))
+	except (KeyError, TypeError, AttributeError) as e:
+		raise ValueError(f"Invalid invoice data: {e}")
+	return invoice
+
+
+def create_api_client(api_key: str = None, governor: QuotaGovernor = None) -> InvoiceGeneratorAPI:
 	"""Create a new API client instance."""
-	return InvoiceGeneratorAPI(api_key=api_key)
+	return InvoiceGeneratorAPI(api_key=api_key, governor=governor)
 
 
 # Example usage
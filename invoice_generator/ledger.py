@@ -0,0 +1,242 @@
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, List, Optional, Any
+from .utils import payload_hash
+
+
+COLUMNS = ("recorded", "payload_hash", "number", "sender", "recipient", "recipient_key", "date", "due_date",
+		   "currency", "subtotal", "tax", "total", "amount_paid", "balance_due", "format", "output_path",
+		   "status", "message")
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS entries (
+	id INTEGER PRIMARY KEY,
+	{", ".join(COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS entries_number ON entries (number);
+CREATE INDEX IF NOT EXISTS entries_recipient ON entries (recipient_key, date);
+CREATE INDEX IF NOT EXISTS entries_date ON entries (date);
+CREATE TRIGGER IF NOT EXISTS entries_no_update BEFORE UPDATE ON entries
+	BEGIN SELECT RAISE(ABORT, 'The invoice ledger is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS entries_no_delete BEFORE DELETE ON entries
+	BEGIN SELECT RAISE(ABORT, 'The invoice ledger is append-only'); END;
+"""
+
+_STOP = object()
+_BUSY_TIMEOUT = 30.0  # Seconds to wait for another process's write lock
+
+logger = logging.getLogger(__name__)
+
+_ledgers: Dict[str, "InvoiceLedger"] = {}
+_ledgers_lock = threading.Lock()
+
+
+def recipient_key(recipient: Optional[str]) -> str:
+	"""Normalized first line of a recipient, used to index entries by client."""
+	return (recipient or "").strip().split("\n", 1)[0].strip().lower()
+
+
+def payload_totals(data: Dict[str, Any]) -> Dict[str, float]:
+	"""Compute subtotal, total and balance due from an invoice in API format, as `Invoice` does."""
+	subtotal = 0.0
+	for item in data.get("items", []):
+		cost = item.get("quantity", 1) * item.get("unit_cost", 0) - (item.get("discount") or 0)
+		subtotal += max(0, cost)
+	total = max(0, subtotal + data.get("tax", 0) + data.get("shipping", 0) - data.get("discounts", 0))
+	return {
+		"subtotal": subtotal,
+		"total": total,
+		"balance_due": max(0, total - data.get("amount_paid", 0)),
+	}
+
+
+@dataclass
+class LedgerEntry:
+	id: int
+	recorded: str
+	payload_hash: str
+	number: Optional[str]
+	sender: str
+	recipient: str
+	recipient_key: str
+	date: Optional[str]
+	due_date: Optional[str]
+	currency: str
+	subtotal: float
+	tax: float
+	total: float
+	amount_paid: float
+	balance_due: float
+	format: str
+	output_path: Optional[str]
+	status: str
+	message: str
+
+	@property
+	def succeeded(self) -> bool:
+		return self.status == "success"
+
+
+class InvoiceLedger:
+	"""Append-only record of every generation attempt, stored in SQLite.
+	Entries are indexed by invoice number, recipient and date. `record` only queues the entry;
+	a background thread writes queued entries in batches, so generation never waits on the disk.
+	Call `flush` to wait for queued entries, e.g. before querying entries that were just recorded.
+	"""
+
+	def __init__(self, db_path: str = "ledger.db", batch_size: int = 500):
+		self.db_path = db_path
+		self.batch_size = batch_size
+		self._queue = queue.Queue()
+		self._local = threading.local()
+		connection = sqlite3.connect(db_path)
+		connection.execute("PRAGMA journal_mode=WAL")
+		connection.executescript(SCHEMA)
+		connection.close()
+		self._writer = threading.Thread(target=self._write_loop, name="ledger-writer", daemon=True)
+		self._writer.start()
+
+	def _connection(self) -> sqlite3.Connection:
+		"""Per-thread read connection."""
+		connection = getattr(self._local, "connection", None)
+		if connection is None:
+			connection = sqlite3.connect(self.db_path)
+			connection.row_factory = sqlite3.Row
+			self._local.connection = connection
+		return connection
+
+	def _write_loop(self) -> None:
+		connection = sqlite3.connect(self.db_path, timeout=_BUSY_TIMEOUT)
+		placeholders = ", ".join("?" for _ in COLUMNS)
+		insert = f"INSERT INTO entries ({', '.join(COLUMNS)}) VALUES ({placeholders})"
+		running = True
+		while running:
+			batch = []
+			waiters = []
+			item = self._queue.get()
+			while True:
+				if item is _STOP:
+					running = False
+				elif isinstance(item, threading.Event):
+					waiters.append(item)
+				else:
+					batch.append(item)
+				if len(batch) >= self.batch_size:
+					break
+				try:
+					item = self._queue.get_nowait()
+				except queue.Empty:
+					break
+			if batch:
+				try:
+					with connection:
+						connection.executemany(insert, batch)
+				except sqlite3.Error as e:
+					# Keep the writer alive: losing one batch is better than every later entry
+					logger.error("Could not write %d ledger entries to %s: %s", len(batch), self.db_path, e)
+			for waiter in waiters:
+				waiter.set()
+		connection.close()
+
+	def record(self, data: Dict[str, Any], format_type: Any, output_path: Optional[str], result: Any) -> None:
+		"""
+		Queue a ledger entry for a generation attempt.
+		Args:
+			data: Invoice in API format, as sent to the API
+			format_type: `InvoiceFormat` that was requested
+			output_path: Where the document was meant to be saved
+			result: `GenerationResult` (or result message) returned by the API client
+		"""
+		message = str(result)
+		status = getattr(result, "status", None) or ("success" if message.startswith("Invoice saved") else "failed")
+		totals = payload_totals(data)
+		self._queue.put((
+			datetime.now().isoformat(timespec="milliseconds"),
+			payload_hash(data),
+			data.get("number"),
+			data.get("from", ""),
+			data.get("to", ""),
+			recipient_key(data.get("to")),
+			data.get("date"),
+			data.get("due_date"),
+			data.get("currency", "USD"),
+			totals["subtotal"],
+			data.get("tax", 0.0),
+			totals["total"],
+			data.get("amount_paid", 0.0),
+			totals["balance_due"],
+			getattr(format_type, "value", format_type),
+			output_path,
+			status,
+			message,
+		))
+
+	def flush(self, timeout: float = None) -> bool:
+		"""Wait until every entry queued so far is written. Returns False on timeout."""
+		done = threading.Event()
+		self._queue.put(done)
+		return done.wait(timeout)
+
+	def close(self) -> None:
+		"""Write the remaining entries and stop the writer thread."""
+		self._queue.put(_STOP)
+		self._writer.join()
+
+	def _query(self, where: str, params: tuple, limit: int = None) -> List[LedgerEntry]:
+		sql = f"SELECT * FROM entries WHERE {where} ORDER BY id"
+		if limit is not None:
+			sql += f" LIMIT {int(limit)}"
+		return [LedgerEntry(**dict(row)) for row in self._connection().execute(sql, params)]
+
+	def find_by_number(self, number: str) -> List[LedgerEntry]:
+		"""Every entry recorded for an invoice number, oldest first."""
+		return self._query("number = ?", (number,))
+
+	def find_by_recipient(self, recipient: str, limit: int = None) -> List[LedgerEntry]:
+		"""Every entry for a client, matched on the first line of the recipient, case-insensitively."""
+		return self._query("recipient_key = ?", (recipient_key(recipient),), limit)
+
+	def find_by_date_range(self, start: date, end: date, recipient: str = None) -> List[LedgerEntry]:
+		"""Entries with an invoice date between `start` and `end` inclusive, optionally for one client."""
+		if recipient is not None:
+			return self._query("recipient_key = ? AND date BETWEEN ? AND ?",
+							   (recipient_key(recipient), start.isoformat(), end.isoformat()))
+		return self._query("date BETWEEN ? AND ?", (start.isoformat(), end.isoformat()))
+
+	def was_generated(self, number: str, recipient: str = None) -> Optional[LedgerEntry]:
+		"""The latest successful entry for an invoice number (and client, if given), or None."""
+		entries = [entry for entry in self.find_by_number(number) if entry.succeeded]
+		if recipient is not None:
+			entries = [entry for entry in entries if entry.recipient_key == recipient_key(recipient)]
+		return entries[-1] if entries else None
+
+
+def ledger_from_config(config: Any) -> Optional[InvoiceLedger]:
+	"""
+	Ledger for the `ledger_file` setting (default: ledger.db), or None when it is set to null or "".
+	Every client in the process shares one ledger per file; it is closed when the process exits.
+	"""
+	path = config.get('ledger_file', 'ledger.db')
+	if not path:
+		return None
+	with _ledgers_lock:
+		ledger = _ledgers.get(path)
+		if ledger is None:
+			if not _ledgers:
+				atexit.register(close_ledgers)
+			ledger = _ledgers[path] = InvoiceLedger(path)
+		return ledger
+
+
+def close_ledgers() -> None:
+	"""Write the queued entries of every ledger opened by `ledger_from_config` and close them."""
+	with _ledgers_lock:
+		ledgers = list(_ledgers.values())
+		_ledgers.clear()
+	for ledger in ledgers:
+		ledger.close()
@@ -1,11 +1,300 @@
-from .ig import InvoiceApp
+import argparse
+import csv
+import json
+import os
+import signal
+import sys
+import threading
+from datetime import date
 
 
-def main():
+def run_recurring(args):
+	from .config import config
+	from .routing import client_from_config
+	from .scheduler import RecurringScheduler
+	from .templates import template_manager
+	api = client_from_config(config)
+	scheduler = RecurringScheduler(template_manager, config.get('schedule_state_file', 'schedule_state.json'))
+	today = date.fromisoformat(args.date) if args.date else None
+	if args.dry_run:
+		for name, run_date in scheduler.due_runs(today):
+			print(f"{run_date.isoformat()}  {name}")
+		return 0
+	results = scheduler.run_due(api, today, max_workers=args.workers)
+	for name, run_date, result in results:
+		print(f"{run_date.isoformat()}  {name}: {result}")
+	return 0 if all(result.succeeded for _, _, result in results) else 1
+
+
+def ledger_path(args):
+	"""The ledger given with --ledger, otherwise the `ledger_file` setting."""
+	from .config import config
+	return args.ledger or config.get('ledger_file') or "ledger.db"
+
+
+def write_rows(rows, output_format, output=None):
+	"""Write report rows as CSV or JSON to a file, or to stdout."""
+	stream = open(output, 'w', encoding='utf-8', newline='') if output else sys.stdout
+	try:
+		if output_format == "json":
+			json.dump(rows, stream, indent=2, ensure_ascii=False)
+			stream.write("\n")
+		elif rows:
+			writer = csv.DictWriter(stream, fieldnames=list(rows[0].keys()))
+			writer.writeheader()
+			writer.writerows(rows)
+	finally:
+		if output:
+			stream.close()
+
+
+def run_report(args):
+	try:
+		from . import reports
+	except ImportError:
+		print("Reports require NumPy. Install it with: uv pip install 'invoice-gen[reports]'", file=sys.stderr)
+		return 1
+	try:
+		columns = reports.InvoiceColumns.from_ledger(ledger_path(args))
+	except ValueError as e:
+		print(f"Error: {e}", file=sys.stderr)
+		return 1
+	if args.report == "revenue":
+		rows = reports.revenue_by_recipient(columns, args.period)
+	elif args.report == "tax":
+		rows = reports.tax_by_period(columns, args.period)
+	else:
+		rows = reports.aging(columns, date.fromisoformat(args.as_of) if args.as_of else None)
+	write_rows(rows, args.format, args.output)
+	return 0
+
+
+def run_statement(args):
+	from .ledger import InvoiceLedger
+	from .statement import PDFError, statement_from_ledger
+	today = date.today()
+	start = date.fromisoformat(args.start) if args.start else today.replace(day=1)
+	end = date.fromisoformat(args.end) if args.end else today
+	path = ledger_path(args)
+	if not os.path.isfile(path):
+		print(f"Error: No ledger found at {path}", file=sys.stderr)
+		return 1
+	ledger = InvoiceLedger(path)
+	try:
+		entries = ledger.find_by_date_range(start, end, args.recipient)
+	finally:
+		ledger.close()
+	if not entries:
+		print(f"Error: No invoices for {args.recipient} from {start.isoformat()} to {end.isoformat()}", file=sys.stderr)
+		return 1
+	title = args.title or f"Statement for {args.recipient}, {start.isoformat()} to {end.isoformat()}"
+	try:
+		pages, missing = statement_from_ledger(entries, args.output, title)
+	except (PDFError, OSError, ValueError) as e:
+		print(f"Error: {e}", file=sys.stderr)
+		return 1
+	for entry in missing:
+		print(f"Skipped {entry.number}: {entry.output_path} not found", file=sys.stderr)
+	print(f"Statement saved as {args.output} ({pages} pages)")
+	return 0
+
+
+def run_daemon(args):
+	from .config import config
+	from .daemon import InboxDaemon
+	from .invoice_api import InvoiceFormat
+	from .routing import client_from_config
+	api = client_from_config(config)
+	daemon = InboxDaemon(
+		api, args.inbox, args.output_dir, InvoiceFormat(args.format), workers=args.workers,
+		poll_interval=args.interval, on_result=lambda name, message: print(f"{name}: {message}", flush=True)
+	)
+
+	def stop(signum, frame):
+		print("Stopping after in-flight invoices finish...", flush=True)
+		daemon.stop()
+
+	signal.signal(signal.SIGINT, stop)
+	signal.signal(signal.SIGTERM, stop)
+	print(f"Watching {args.inbox} (Ctrl+C to stop)", flush=True)
+	stats = daemon.run()
+	print(f"Stopped: {stats['done']} generated, {stats['failed']} failed, {stats['retried']} returned for retry")
+	return 0
+
+
+def run_serve(args):
+	from .config import config
+	from .routing import client_from_config
+	from .server import InvoiceServer, InvoiceService
+	api = client_from_config(config)
+	server = InvoiceServer(InvoiceService(api, max_concurrency=args.workers), args.host, args.port, verbose=args.verbose)
+
+	def stop(signum, frame):
+		# shutdown() waits for serve_forever to return, so it must not run on the serving thread
+		threading.Thread(target=server.shutdown).start()
+
+	signal.signal(signal.SIGINT, stop)
+	signal.signal(signal.SIGTERM, stop)
+	host, port = server.server_address[:2]
+	print(f"Serving on http://{host}:{port} (POST /pdf or /ubl, GET /health; Ctrl+C to stop)", flush=True)
+	try:
+		server.serve_forever()
+	finally:
+		server.server_close()
+	stats = server.service.health()
+	print(f"Stopped: {stats['requests']} requests, {stats['upstream_calls']} upstream calls, {stats['coalesced']} coalesced")
+	return 0
+
+
+def run_deliver(args):
+	from .config import config
+	from .delivery import Delivery, DeliveryLog, delivery_stage_from_config
+	from .ledger import InvoiceLedger
+	today = date.today()
+	start = date.fromisoformat(args.start) if args.start else today.replace(day=1)
+	end = date.fromisoformat(args.end) if args.end else today
+	path = ledger_path(args)
+	if not os.path.isfile(path):
+		print(f"Error: No ledger found at {path}", file=sys.stderr)
+		return 1
+	ledger = InvoiceLedger(path)
+	try:
+		entries = ledger.find_by_date_range(start, end, args.recipient)
+	finally:
+		ledger.close()
+	# An invoice generated more than once is sent once, using its latest file. Numbers are only
+	# unique per client, so the same number for two recipients is two invoices.
+	latest = {}
+	for entry in entries:
+		if entry.succeeded and entry.output_path:
+			latest[(entry.recipient_key, entry.number) if entry.number else entry.output_path] = entry
+	deliveries = []
+	for entry in latest.values():
+		try:
+			delivery = Delivery.from_ledger(entry)
+		except ValueError as e:
+			print(f"Skipped: {e}", file=sys.stderr)
+			continue
+		if delivery is not None:
+			deliveries.append(delivery)
+	if args.dry_run:
+		for delivery in deliveries:
+			print(f"{delivery.number or delivery.path}: {delivery.to}")
+		return 0
+	log = DeliveryLog(args.deliveries)
+	try:
+		try:
+			stage = delivery_stage_from_config(
+				config, log, on_result=lambda delivery, result: print(f"{delivery.number or delivery.path}: {result}", flush=True)
+			)
+		except ValueError as e:
+			print(f"Error: {e}", file=sys.stderr)
+			return 1
+		try:
+			results = stage.deliver(deliveries, force=args.force)
+		finally:
+			stage.pool.close()
+	finally:
+		log.close()
+	sent = sum(1 for result in results.values() if result.startswith("Sent"))
+	skipped = sum(1 for result in results.values() if result == "Already sent")
+	failed = len(results) - sent - skipped
+	print(f"{sent} sent, {skipped} already sent, {failed} failed")
+	return 1 if failed else 0
+
+
+def run_optimize(args):
+	from .optimize import optimize_batch
+	paths = []
+	for path in args.paths:
+		if os.path.isdir(path):
+			for directory, _, names in os.walk(path):
+				paths.extend(os.path.join(directory, name) for name in sorted(names) if name.lower().endswith(".pdf"))
+		else:
+			paths.append(path)
+	if not paths:
+		print("No PDF files found", file=sys.stderr)
+		return 1
+	results = optimize_batch(paths, args.output_dir, args.workers, strip_metadata=not args.keep_metadata)
+	for result in results:
+		print(result)
+	failed = [result for result in results if result.error]
+	original = sum(result.original_size for result in results)
+	saved = sum(result.saved for result in results)
+	percent = 100 * saved / original if original else 0
+	print(f"{len(results) - len(failed)} optimized, {len(failed)} failed, {saved} bytes saved ({percent:.1f}%)")
+	return 1 if failed else 0
+
+
+def build_parser():
+	parser = argparse.ArgumentParser(prog="invoice-gen", description="Generate invoices. Run without a command to open the GUI.")
+	parser.add_argument("--trace", metavar="FILE", help="Record per-stage timings to FILE as Chrome trace-event JSON")
+	parser.add_argument("--trace-memory", action="store_true", help="With --trace, also write a tracemalloc snapshot to FILE.memory.txt")
+	subparsers = parser.add_subparsers(dest="command")
+	recurring = subparsers.add_parser("recurring", help="Generate invoices for templates with a due recurrence rule")
+	recurring.add_argument("--date", help="Treat this date (YYYY-MM-DD) as today")
+	recurring.add_argument("--workers", type=int, default=8, help="Number of invoices generated concurrently")
+	recurring.add_argument("--dry-run", action="store_true", help="List due runs without generating them")
+	recurring.set_defaults(func=run_recurring)
+	report = subparsers.add_parser("report", help="Summarize generated invoices from the ledger")
+	report.add_argument("report", choices=["revenue", "tax", "aging"], help="Revenue per client and period, tax per period, or receivables aging")
+	report.add_argument("--ledger", help="Ledger database to read (default: the ledger_file setting, or ledger.db)")
+	report.add_argument("--period", choices=["month", "quarter", "year"], default="month", help="Grouping period for revenue and tax")
+	report.add_argument("--as-of", help="Aging reference date (YYYY-MM-DD, default: today)")
+	report.add_argument("--format", choices=["csv", "json"], default="csv", help="Output format")
+	report.add_argument("--output", help="Write to this file instead of standard output")
+	report.set_defaults(func=run_report)
+	statement = subparsers.add_parser("statement", help="Merge a client's generated invoice PDFs into one statement")
+	statement.add_argument("recipient", help="Client, matched on the first line of the invoice recipient")
+	statement.add_argument("--from", dest="start", help="First invoice date (YYYY-MM-DD, default: start of this month)")
+	statement.add_argument("--to", dest="end", help="Last invoice date (YYYY-MM-DD, default: today)")
+	statement.add_argument("--ledger", help="Ledger database to read (default: the ledger_file setting, or ledger.db)")
+	statement.add_argument("--title", help="Summary page title")
+	statement.add_argument("--output", default="statement.pdf", help="Statement file to write (default: statement.pdf)")
+	statement.set_defaults(func=run_statement)
+	deliver = subparsers.add_parser("deliver", help="Email generated invoices from the ledger to their recipients")
+	deliver.add_argument("--from", dest="start", help="First invoice date (YYYY-MM-DD, default: start of this month)")
+	deliver.add_argument("--to", dest="end", help="Last invoice date (YYYY-MM-DD, default: today)")
+	deliver.add_argument("--recipient", help="Only invoices for this client, matched on the first line of the recipient")
+	deliver.add_argument("--ledger", help="Ledger database to read (default: the ledger_file setting, or ledger.db)")
+	deliver.add_argument("--deliveries", default="deliveries.db", help="Delivery status database (default: deliveries.db)")
+	deliver.add_argument("--force", action="store_true", help="Also resend invoices that were already sent")
+	deliver.add_argument("--dry-run", action="store_true", help="List the invoices and addresses without sending")
+	deliver.set_defaults(func=run_deliver)
+	daemon = subparsers.add_parser("daemon", help="Generate invoices from JSON files dropped into a folder")
+	daemon.add_argument("inbox", help="Folder to watch for invoice JSON files")
+	daemon.add_argument("--output-dir", help="Save documents here, named after the input files (default: the usual output naming)")
+	daemon.add_argument("--format", choices=["pdf", "ubl"], default="pdf", help="Output format")
+	daemon.add_argument("--workers", type=int, default=4, help="Maximum number of invoices generated concurrently")
+	daemon.add_argument("--interval", type=float, default=2.0, help="Seconds between checks of the inbox")
+	daemon.set_defaults(func=run_daemon)
+	serve = subparsers.add_parser("serve", help="Serve invoice generation over a local HTTP endpoint")
+	serve.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+	serve.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+	serve.add_argument("--workers", type=int, default=8, help="Maximum number of concurrent upstream API calls")
+	serve.add_argument("--verbose", action="store_true", help="Log every request")
+	serve.set_defaults(func=run_serve)
+	optimize = subparsers.add_parser("optimize", help="Shrink generated PDF files")
+	optimize.add_argument("paths", nargs="+", help="PDF files, or folders to search for them")
+	optimize.add_argument("--output-dir", help="Write optimized copies here instead of replacing the files")
+	optimize.add_argument("--workers", type=int, help="Number of worker processes (default: one per CPU)")
+	optimize.add_argument("--keep-metadata", action="store_true", help="Keep creation dates, producer details and XMP metadata")
+	optimize.set_defaults(func=run_optimize)
+	return parser
+
+
+def main(argv=None):
+	args = build_parser().parse_args(argv)
+	if args.trace:
+		from .tracing import tracer
+		tracer.enable(args.trace, memory=args.trace_memory)
+	if args.command:
+		return args.func(args)
+	from .ig import InvoiceApp
 	app = InvoiceApp()
 	app.MainLoop()
 
 
 
 if __name__ == "__main__":
-	main()
+	raise SystemExit(main())
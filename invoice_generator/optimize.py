@@ -0,0 +1,293 @@
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple, Any
+from .statement import PDFError, _Name, _PDFSource, _Raw, _Ref, _references, _serialize
+
+
+_OBJECTS_PER_STREAM = 100
+_MERGE_PASSES = 8
+_VOLATILE_INFO = (b"CreationDate", b"ModDate", b"Producer", b"Creator")
+_VOLATILE_KEYS = (b"Metadata", b"PieceInfo")  # Dropped from the catalog and pages
+_UNIQUE_TYPES = (b"Catalog", b"Pages", b"Page")  # Never merged with an identical-looking object
+_VERSION = re.compile(rb"%PDF-(\d)\.(\d)")
+
+
+@dataclass
+class OptimizationResult:
+	"""Outcome of optimizing one PDF."""
+	path: str
+	original_size: int
+	optimized_size: int
+	error: Optional[str] = None
+
+	@property
+	def saved(self) -> int:
+		"""Bytes saved (0 when the file was left unchanged)."""
+		return self.original_size - self.optimized_size
+
+	def __str__(self) -> str:
+		if self.error:
+			return f"{self.path}: Error: {self.error}"
+		percent = 100 * self.saved / self.original_size if self.original_size else 0
+		return f"{self.path}: {self.original_size} -> {self.optimized_size} bytes (saved {self.saved}, {percent:.1f}%)"
+
+
+def _recompress(source: _PDFSource, value: Dict[bytes, Any], span: Tuple[int, int], level: int) -> Tuple[Dict[bytes, Any], bytes]:
+	"""Stream dictionary and data, deflated at `level` if that makes the stream smaller."""
+	raw = bytes(source.data[span[0]:span[0] + span[1]])
+	dictionary = {key: item for key, item in value.items() if key != b"Length"}
+	if dictionary.get(b"Type") == b"Metadata":
+		# XMP packets are meant to stay readable by tools that do not parse PDF
+		return dictionary, raw
+	filters = source.resolve(dictionary.get(b"Filter"))
+	if filters not in (None, b"FlateDecode", [b"FlateDecode"]):
+		# Images in JPEG, CCITT and similar formats are already compact
+		return dictionary, raw
+	try:
+		decoded = source._decode(value, span)
+	except (PDFError, zlib.error, ValueError, TypeError):
+		return dictionary, raw
+	compressed = zlib.compress(decoded, level)
+	if len(compressed) >= len(raw):
+		return dictionary, raw
+	dictionary.pop(b"DecodeParms", None)
+	dictionary[b"Filter"] = _Name(b"FlateDecode")
+	return dictionary, compressed
+
+
+def _collect(source: _PDFSource, level: int, strip_metadata: bool) -> Tuple[Dict[int, Tuple[Any, Optional[bytes]]], int, Optional[int]]:
+	"""Read every object reachable from the catalog and document info, recompressing streams.
+	Returns the objects by number, with stream data for streams, and the catalog and info numbers.
+	"""
+	trailer = source.trailer
+	root = trailer[b"Root"][0]
+	info = trailer.get(b"Info")
+	info = info[0] if isinstance(info, _Ref) else None
+	objects: Dict[int, Tuple[Any, Optional[bytes]]] = {}
+	stack = [root] + ([info] if info is not None else [])
+	while stack:
+		number = stack.pop()
+		if number in objects:
+			continue
+		value, span = source.object(number)
+		data = None
+		if span is not None:
+			if value.get(b"Type") in (b"XRef", b"ObjStm"):
+				value, span = _Raw(b"null"), None
+			else:
+				value, data = _recompress(source, value, span, level)
+		if strip_metadata and isinstance(value, dict):
+			if number == info:
+				value = {key: item for key, item in value.items() if key not in _VOLATILE_INFO}
+			elif value.get(b"Type") in (b"Catalog", b"Page"):
+				value = {key: item for key, item in value.items() if key not in _VOLATILE_KEYS}
+		objects[number] = (value, data)
+		stack.extend(reference[0] for reference in _references(value) if reference[0] not in objects)
+	if strip_metadata and info is not None and not objects[info][0]:
+		del objects[info]
+		info = None
+	return objects, root, info
+
+
+def _merge_duplicates(objects: Dict[int, Tuple[Any, Optional[bytes]]], keep: Sequence[int]) -> Dict[int, int]:
+	"""Find objects identical to an earlier one, including objects that only differ in which of
+	two identical objects they refer to (so duplicate fonts merge along with their font files).
+	Returns a mapping from each duplicate to the object that replaces it.
+	"""
+	merged: Dict[int, int] = {}
+
+	def find(number: int) -> int:
+		while number in merged:
+			number = merged[number]
+		return number
+
+	candidates = [number for number, (value, _) in objects.items()
+				  if number not in keep and not (isinstance(value, dict) and value.get(b"Type") in _UNIQUE_TYPES)]
+	for _ in range(_MERGE_PASSES):
+		seen: Dict[bytes, int] = {}
+		changed = False
+		for number in candidates:
+			if number in merged:
+				continue
+			value, data = objects[number]
+			digest = hashlib.sha256(_serialize(value, lambda reference: find(reference[0])))
+			if data is not None:
+				digest.update(b"\nstream\n")
+				digest.update(data)
+			key = digest.digest()
+			first = seen.setdefault(key, number)
+			if first != number:
+				merged[number] = first
+				changed = True
+		if not changed:
+			break
+	return {number: find(number) for number in merged}
+
+
+def _write(source: _PDFSource, out: BinaryIO, level: int, strip_metadata: bool) -> None:
+	"""Write an optimized copy of a document: reachable objects only, renumbered, with duplicates
+	merged and every non-stream object packed into compressed object streams.
+	"""
+	objects, root, info = _collect(source, level, strip_metadata)
+	merged = _merge_duplicates(objects, [root] + ([info] if info is not None else []))
+	numbers: Dict[int, int] = {}
+	for number in objects:
+		if number not in merged:
+			numbers[number] = len(numbers) + 1
+
+	def remap(reference: _Ref) -> int:
+		number = merged.get(reference[0], reference[0])
+		return numbers.get(number, 0)
+
+	version = _VERSION.match(source.data, 0)
+	version = max((int(version.group(1)), int(version.group(2))), (1, 5)) if version else (1, 7)
+	out.write(b"%%PDF-%d.%d\n%%\xe2\xe3\xcf\xd3\n" % version)
+	# Entries are (type, field 2, field 3) as in a cross-reference stream
+	entries: List[Tuple[int, int, int]] = [(0, 0, 0xFFFF)] + [(0, 0, 0)] * len(numbers)
+	packed: List[Tuple[int, bytes]] = []
+	for number, new_number in numbers.items():
+		value, data = objects[number]
+		if data is None:
+			packed.append((new_number, _serialize(value, remap)))
+			continue
+		value = dict(value)
+		value[b"Length"] = len(data)
+		entries[new_number] = (1, out.tell(), 0)
+		out.write(b"%d 0 obj\n" % new_number + _serialize(value, remap) + b"\nstream\n")
+		out.write(data)
+		out.write(b"\nendstream\nendobj\n")
+	for batch_start in range(0, len(packed), _OBJECTS_PER_STREAM):
+		batch = packed[batch_start:batch_start + _OBJECTS_PER_STREAM]
+		stream_number = len(entries)
+		header, bodies, offset = [], [], 0
+		for index, (new_number, body) in enumerate(batch):
+			entries[new_number] = (2, stream_number, index)
+			header.append(b"%d %d" % (new_number, offset))
+			bodies.append(body)
+			offset += len(body) + 1
+		header = b" ".join(header) + b"\n"
+		data = zlib.compress(header + b"\n".join(bodies) + b"\n", level)
+		entries.append((1, out.tell(), 0))
+		out.write(b"%d 0 obj\n<</Type/ObjStm/N %d/First %d/Filter/FlateDecode/Length %d>>\nstream\n"
+				  % (stream_number, len(batch), len(header), len(data)))
+		out.write(data)
+		out.write(b"\nendstream\nendobj\n")
+	xref_number = len(entries)
+	xref_offset = out.tell()
+	entries.append((1, xref_offset, 0))
+	width = max(1, (xref_offset.bit_length() + 7) // 8)
+	table = b"".join(kind.to_bytes(1, "big") + second.to_bytes(width, "big") + third.to_bytes(2, "big")
+					 for kind, second, third in entries)
+	table = zlib.compress(table, level)
+	trailer = b"/Root %d 0 R" % numbers[root]
+	if info is not None:
+		trailer += b"/Info %d 0 R" % numbers[info]
+	if not strip_metadata and b"ID" in source.trailer:
+		trailer += b"/ID" + _serialize(source.trailer[b"ID"], remap)
+	out.write(b"%d 0 obj\n<</Type/XRef/Size %d/W[1 %d 2]%s/Filter/FlateDecode/Length %d>>\nstream\n"
+			  % (xref_number, len(entries), width, trailer, len(table)))
+	out.write(table)
+	out.write(b"\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n" % xref_offset)
+
+
+def optimize_document(content: bytes, level: int = 9, strip_metadata: bool = True) -> bytes:
+	"""
+	Optimize a PDF held in memory. Returns the smaller of the optimized and the original document.
+	Raises:
+		PDFError: The document cannot be read (e.g. it is encrypted)
+	"""
+	source = _PDFSource("<document>", content)
+	try:
+		out = io.BytesIO()
+		_write(source, out, level, strip_metadata)
+	finally:
+		source.close()
+	optimized = out.getvalue()
+	return optimized if len(optimized) < len(content) else content
+
+
+def optimize_pdf(path: str, output_path: str = None, level: int = 9, strip_metadata: bool = True) -> OptimizationResult:
+	"""
+	Shrink a PDF without changing how it looks.
+	Streams are recompressed, other objects are packed into compressed object streams, identical
+	fonts, images and other resources are stored once, and unused objects are dropped. With
+	`strip_metadata`, creation and modification dates, producer details, XMP metadata and the
+	document ID are removed as well, so regenerating an unchanged invoice gives an identical file.
+	The file is only replaced if the result is smaller.
+	Args:
+		path: PDF to optimize
+		output_path: Where to write the result (default: replace `path`)
+		level: zlib compression level, 1 (fastest) to 9 (smallest)
+		strip_metadata: Remove volatile metadata
+	Raises:
+		PDFError: The file cannot be read (e.g. it is encrypted)
+		OSError: The file cannot be read or written
+	"""
+	output_path = output_path or path
+	original_size = os.path.getsize(path)
+	directory = os.path.dirname(os.path.abspath(output_path))
+	fd, temp_path = tempfile.mkstemp(prefix=".optimize-", suffix=".pdf", dir=directory)
+	try:
+		with os.fdopen(fd, 'wb') as out:
+			source = _PDFSource(path)
+			try:
+				_write(source, out, level, strip_metadata)
+			finally:
+				source.close()
+			optimized_size = out.tell()
+		if optimized_size < original_size:
+			os.replace(temp_path, output_path)
+			return OptimizationResult(path, original_size, optimized_size)
+		os.remove(temp_path)
+		if output_path != path:
+			shutil.copyfile(path, output_path)
+		return OptimizationResult(path, original_size, original_size)
+	except BaseException:
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+		raise
+
+
+def _optimize_task(path: str, output_dir: Optional[str], level: int, strip_metadata: bool) -> OptimizationResult:
+	"""Optimize one file in a worker process, reporting failures in the result instead of raising."""
+	output_path = os.path.join(output_dir, os.path.basename(path)) if output_dir else None
+	try:
+		return optimize_pdf(path, output_path, level, strip_metadata)
+	except (PDFError, OSError, ValueError, TypeError, KeyError, IndexError, AttributeError, zlib.error) as e:
+		try:
+			size = os.path.getsize(path)
+		except OSError:
+			size = 0
+		return OptimizationResult(path, size, size, error=str(e) or type(e).__name__)
+
+
+def optimize_batch(paths: Sequence[str], output_dir: str = None, workers: int = None, level: int = 9,
+				   strip_metadata: bool = True) -> List[OptimizationResult]:
+	"""
+	Optimize many PDFs in parallel worker processes.
+	Files that cannot be optimized are left untouched and reported with an `error`.
+	Args:
+		paths: PDFs to optimize
+		output_dir: Write results here under their original names (default: replace the files)
+		workers: Number of processes (default: one per CPU)
+		level: zlib compression level
+		strip_metadata: Remove volatile metadata
+	Returns:
+		One result per path, in order
+	"""
+	if output_dir:
+		os.makedirs(output_dir, exist_ok=True)
+	task = partial(_optimize_task, output_dir=output_dir, level=level, strip_metadata=strip_metadata)
+	if len(paths) <= 1 or workers == 1:
+		return [task(path) for path in paths]
+	workers = workers or os.cpu_count() or 1
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		return list(executor.map(task, paths, chunksize=max(1, len(paths) // (workers * 4))))
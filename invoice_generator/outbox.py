@@ -0,0 +1,213 @@
+import os
+import threading
+import time
+from datetime import datetime
+from enum import Enum
+from typing import Dict, List, Optional, Any
+from .invoice_api import ErrorCategory, GenerationResult, Invoice, InvoiceFormat, InvoiceGeneratorAPI
+from .utils import ensure_directory, safe_json_load, atomic_json_save, payload_hash
+
+
+FORMAT_EXTENSIONS = {
+	InvoiceFormat.PDF: "pdf",
+	InvoiceFormat.UBL: "xml",
+}
+
+
+class OutboxStatus(Enum):
+	PENDING = "pending"
+	FAILED = "failed"  # Failed for a transient reason; retried later
+	REJECTED = "rejected"  # Failed for a reason retrying does not fix, e.g. the API rejected the invoice
+	DONE = "done"
+
+
+class Outbox:
+	"""Persistent queue of requested generations.
+	Every request is written to disk, keyed by an idempotency key derived from the invoice payload,
+	before anything is sent to the API. Entries that failed for a transient reason stay queued and
+	are retried later. Entries the API rejected are kept, but only sent again by `generate`, and
+	entries that already succeeded are never sent again.
+	"""
+
+	def __init__(self, outbox_dir: str = "outbox", retry_delay: float = 30.0, max_retry_delay: float = 3600.0):
+		self.outbox_dir = outbox_dir
+		self.retry_delay = retry_delay
+		self.max_retry_delay = max_retry_delay
+		self._lock = threading.Lock()
+		self._in_flight = set()
+		self._stop_event = threading.Event()
+		self._worker = None
+		ensure_directory(self.outbox_dir)
+
+	@staticmethod
+	def idempotency_key(data: Dict[str, Any], format_type: InvoiceFormat) -> str:
+		"""Derive the idempotency key for a serialized invoice and output format."""
+		return payload_hash({"format": format_type.value, "invoice": data})
+
+	def _entry_path(self, key: str) -> str:
+		return os.path.join(self.outbox_dir, f"{key}.json")
+
+	def _load_entry(self, key: str) -> Optional[Dict[str, Any]]:
+		return safe_json_load(self._entry_path(key))
+
+	def _save_entry(self, entry: Dict[str, Any]) -> bool:
+		entry["updated"] = datetime.now().isoformat()
+		return atomic_json_save(self._entry_path(entry["key"]), entry)
+
+	def enqueue(self, invoice: Invoice, format_type: InvoiceFormat = InvoiceFormat.PDF, output_path: str = None,
+				api: InvoiceGeneratorAPI = None) -> str:
+		"""
+		Record a generation request without sending it.
+		Args:
+			invoice: The invoice to generate
+			format_type: Output format to request
+			output_path: Where to save the document (if None, derived from the invoice number)
+			api: Client used to derive the default output path
+		Returns:
+			The idempotency key of the (possibly pre-existing) entry
+		"""
+		data = invoice.to_dict()
+		key = self.idempotency_key(data, format_type)
+		with self._lock:
+			if self._load_entry(key) is not None:
+				return key
+			if output_path is None:
+				extension = FORMAT_EXTENSIONS[format_type]
+				output_path = api._generate_filename(invoice, extension) if api else f"invoice_{key[:12]}.{extension}"
+			entry = {
+				"key": key,
+				"format": format_type.value,
+				"output_path": output_path,
+				"payload": data,
+				"status": OutboxStatus.PENDING.value,
+				"attempts": 0,
+				"last_error": None,
+				"next_attempt": 0.0,
+				"created": datetime.now().isoformat(),
+			}
+			if not self._save_entry(entry):
+				raise IOError(f"Unable to write outbox entry {key}")
+		return key
+
+	def generate(self, api: InvoiceGeneratorAPI, invoice: Invoice, format_type: InvoiceFormat = InvoiceFormat.PDF,
+				 output_path: str = None) -> GenerationResult:
+		"""
+		Record a generation request and attempt it immediately, also when it was rejected before.
+		If the same payload already succeeded, nothing is sent.
+		Returns:
+			The `GenerationResult` returned by the API client, or a skipped result if nothing was sent
+		"""
+		key = self.enqueue(invoice, format_type, output_path, api=api)
+		return self._attempt(api, key, force=True)
+
+	def _attempt(self, api: InvoiceGeneratorAPI, key: str, force: bool = False) -> GenerationResult:
+		"""Send a single queued entry unless it already succeeded or is being sent elsewhere."""
+		with self._lock:
+			entry = self._load_entry(key)
+			if entry is None:
+				return GenerationResult.failure(f"Error: Unknown outbox entry {key}", ErrorCategory.INVALID)
+			if entry["status"] == OutboxStatus.DONE.value:
+				return GenerationResult("skipped", f"Invoice already generated as {entry['output_path']}", output_path=entry["output_path"])
+			if key in self._in_flight:
+				return GenerationResult("skipped", f"Invoice {key[:12]} is already being generated")
+			if not force and entry["status"] == OutboxStatus.REJECTED.value:
+				return GenerationResult("skipped", entry.get("last_error") or "Rejected")
+			if not force and entry.get("next_attempt", 0) > time.time():
+				return GenerationResult("skipped", entry.get("last_error") or "Waiting for retry")
+			self._in_flight.add(key)
+		try:
+			result = api._send_payload(entry["payload"], InvoiceFormat(entry["format"]), entry["output_path"])
+			with self._lock:
+				entry["attempts"] += 1
+				if result.succeeded:
+					entry["status"] = OutboxStatus.DONE.value
+					entry["last_error"] = None
+				elif not result.transient:
+					entry["status"] = OutboxStatus.REJECTED.value
+					entry["last_error"] = str(result)
+				else:
+					entry["status"] = OutboxStatus.FAILED.value
+					entry["last_error"] = str(result)
+					delay = min(self.retry_delay * (2 ** (entry["attempts"] - 1)), self.max_retry_delay)
+					entry["next_attempt"] = time.time() + delay
+				self._save_entry(entry)
+			return result
+		finally:
+			with self._lock:
+				self._in_flight.discard(key)
+
+	def entries(self, status: OutboxStatus = None) -> List[Dict[str, Any]]:
+		"""List outbox entries, optionally filtered by status, oldest first."""
+		entries = []
+		try:
+			filenames = os.listdir(self.outbox_dir)
+		except OSError:
+			return []
+		for filename in filenames:
+			if not filename.endswith('.json'):
+				continue
+			entry = safe_json_load(os.path.join(self.outbox_dir, filename))
+			if entry is None:
+				continue
+			if status is None or entry.get("status") == status.value:
+				entries.append(entry)
+		entries.sort(key=lambda x: x.get("created", ""))
+		return entries
+
+	def pending(self) -> List[Dict[str, Any]]:
+		"""List entries that have not succeeded yet and may still succeed when retried."""
+		return [entry for entry in self.entries()
+				if entry.get("status") not in (OutboxStatus.DONE.value, OutboxStatus.REJECTED.value)]
+
+	def replay(self, api: InvoiceGeneratorAPI, force: bool = False) -> Dict[str, GenerationResult]:
+		"""
+		Retry every pending entry. Rejected entries are left alone.
+		Args:
+			api: Client used to send the queued payloads
+			force: Ignore the retry backoff and send every unfinished entry now
+		Returns:
+			Mapping of idempotency key to `GenerationResult` for each entry that was attempted
+		"""
+		results = {}
+		for entry in self.pending():
+			if self._stop_event.is_set():
+				break
+			if not force and entry.get("next_attempt", 0) > time.time():
+				continue
+			results[entry["key"]] = self._attempt(api, entry["key"], force=force)
+		return results
+
+	def purge_completed(self) -> int:
+		"""Delete entries that succeeded. Returns the number of entries removed.
+		Once purged, the same payload is no longer recognized as already generated.
+		"""
+		removed = 0
+		with self._lock:
+			for entry in self.entries(OutboxStatus.DONE):
+				try:
+					os.remove(self._entry_path(entry["key"]))
+					removed += 1
+				except OSError:
+					continue
+		return removed
+
+	def start_background_retry(self, api: InvoiceGeneratorAPI, interval: float = 60.0) -> threading.Thread:
+		"""Start a daemon thread that replays unfinished entries every `interval` seconds."""
+		if self._worker is not None and self._worker.is_alive():
+			return self._worker
+		self._stop_event.clear()
+
+		def run():
+			while not self._stop_event.wait(interval):
+				self.replay(api)
+
+		self._worker = threading.Thread(target=run, name="outbox-retry", daemon=True)
+		self._worker.start()
+		return self._worker
+
+	def stop_background_retry(self, timeout: float = None) -> None:
+		"""Stop the background retry thread, waiting for the current attempt to finish."""
+		self._stop_event.set()
+		if self._worker is not None:
+			self._worker.join(timeout)
+			self._worker = None
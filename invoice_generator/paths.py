@@ -0,0 +1,176 @@
+import hashlib
+import os
+import re
+import string
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Any
+from .utils import payload_hash
+
+
+_SLUG_INVALID = re.compile(r"[^a-z0-9]+")
+_COMPONENT_INVALID = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+_MAX_CLAIMS = 10000  # Paths remembered per template; older claims are forgotten first
+
+
+def slugify(text: Optional[str], max_length: int = 40) -> str:
+	"""Lowercase slug of the first line of `text`, e.g. "ACME Corp\\n..." becomes "acme-corp"."""
+	first_line = (text or "").strip().split("\n", 1)[0]
+	slug = _SLUG_INVALID.sub("-", first_line.lower()).strip("-")
+	return slug[:max_length].rstrip("-") or "unknown"
+
+
+def _clean_component(value: str) -> str:
+	"""Replace characters that are invalid in a path component, without truncating."""
+	return _COMPONENT_INVALID.sub("_", value).strip().strip(".") or "_"
+
+
+class OutputPathTemplate:
+	"""Builds output paths for generated invoices from a format string.
+	Available fields are `number`, `recipient_slug`, `sender_slug`, `yyyy`, `mm`, `dd`, `ext`
+	and `hash` (the first 12 characters of the payload hash). For example
+	`{recipient_slug}/{yyyy}/{mm}/{number}.{ext}` groups invoices by client and month.
+
+	Templates without a directory separator are flat layouts; those are spread over
+	`shard_depth` levels of hash-named subdirectories so no single directory grows without bound.
+
+	Two different invoices that render to the same path are told apart by appending part of
+	their payload hash. Within one `plan` batch every such invoice gets the suffix, so the outcome
+	does not depend on their order. Invoices rendered one at a time are resolved as they come: the
+	first keeps the plain path and later ones get the suffix, for as long as the template
+	remembers the claim (the most recent 10,000 paths).
+	"""
+
+	def __init__(self, template: str = "{number}.{ext}", root: str = ".", shard_depth: int = 2,
+				 shard_width: int = 2, overwrite: bool = True, max_component_length: int = 120):
+		"""
+		Args:
+			template: Format string for the path relative to `root`
+			root: Base directory for all generated files
+			shard_depth: Number of hash directory levels added to flat layouts (0 to disable)
+			shard_width: Hex characters per shard directory name
+			overwrite: If False, existing files not written in this session are treated as collisions
+			max_component_length: Longer path components are shortened and given a hash suffix
+		"""
+		field_names = {name for _, name, _, _ in string.Formatter().parse(template) if name}
+		unknown = field_names - {"number", "recipient_slug", "sender_slug", "yyyy", "mm", "dd", "ext", "hash"}
+		if unknown:
+			raise ValueError(f"Unknown template fields: {', '.join(sorted(unknown))}")
+		self.template = template
+		self.root = root
+		self.flat = "/" not in template
+		self.shard_depth = shard_depth if self.flat else 0
+		self.shard_width = shard_width
+		self.overwrite = overwrite
+		self.max_component_length = max_component_length
+		self._claimed: "OrderedDict[str, str]" = OrderedDict()
+		self._created_dirs = set()
+		self._lock = threading.Lock()
+
+	@classmethod
+	def from_config(cls, config: Any) -> Optional["OutputPathTemplate"]:
+		"""Build a template from the `output_template` and `output_dir` settings, or None if unset."""
+		template = config.get('output_template')
+		if not template:
+			return None
+		return cls(template, root=config.get('output_dir', '.'))
+
+	def _fields(self, invoice: Any, extension: str, digest: str) -> Dict[str, str]:
+		invoice_date = invoice.date or date.today()
+		number = (invoice.number or "").strip()
+		return {
+			"number": _clean_component(number) if number else f"invoice-{digest[:12]}",
+			"recipient_slug": slugify(invoice.recipient),
+			"sender_slug": slugify(invoice.sender),
+			"yyyy": f"{invoice_date.year:04d}",
+			"mm": f"{invoice_date.month:02d}",
+			"dd": f"{invoice_date.day:02d}",
+			"ext": extension,
+			"hash": digest[:12],
+		}
+
+	def _shorten(self, component: str) -> str:
+		if len(component) <= self.max_component_length:
+			return component
+		stem, dot, ext = component.rpartition(".")
+		if not dot:
+			stem, ext = component, ""
+		suffix = "-" + hashlib.sha256(component.encode('utf-8')).hexdigest()[:8]
+		keep = self.max_component_length - len(suffix) - (len(ext) + 1 if ext else 0)
+		return f"{stem[:keep]}{suffix}" + (f".{ext}" if ext else "")
+
+	def _candidate(self, invoice: Any, extension: str, digest: str) -> str:
+		relative = self.template.format(**self._fields(invoice, extension, digest))
+		parts = [self._shorten(part) for part in relative.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+		if self.shard_depth:
+			shard_hash = hashlib.sha256(parts[-1].encode('utf-8')).hexdigest()
+			shards = [shard_hash[i * self.shard_width:(i + 1) * self.shard_width] for i in range(self.shard_depth)]
+			parts = shards + parts
+		return os.path.join(self.root, *parts)
+
+	def _taken(self, path: str, digest: str) -> bool:
+		owner = self._claimed.get(path)
+		if owner is not None:
+			return owner != digest
+		return not self.overwrite and os.path.exists(path)
+
+	def _claim(self, path: str, digest: str, shared: bool = False) -> str:
+		"""
+		Reserve `path` for the payload `digest`, appending part of the digest if another payload
+		owns the path or, with `shared`, renders to it in the same batch. The suffix is lengthened
+		while the suffixed path is taken too.
+		"""
+		if shared or self._taken(path, digest):
+			stem, ext = os.path.splitext(path)
+			for length in (8, 16, len(digest)):
+				path = f"{stem}-{digest[:length]}{ext}"
+				if not self._taken(path, digest):
+					break
+		self._claimed[path] = digest
+		self._claimed.move_to_end(path)
+		while len(self._claimed) > _MAX_CLAIMS:
+			self._claimed.popitem(last=False)
+		return path
+
+	def resolve(self, invoice: Any, extension: str) -> str:
+		"""Render the path for one invoice without creating any directories."""
+		digest = payload_hash(invoice.to_dict())
+		with self._lock:
+			return self._claim(self._candidate(invoice, extension, digest), digest)
+
+	def render(self, invoice: Any, extension: str) -> str:
+		"""Render the path for one invoice and make sure its directory exists."""
+		path = self.resolve(invoice, extension)
+		self.ensure_directories([os.path.dirname(path)])
+		return path
+
+	def plan(self, invoices: Iterable[Any], extension: str) -> List[str]:
+		"""
+		Render paths for a whole batch and create every needed directory once.
+		Args:
+			invoices: The invoices to be generated
+			extension: File extension (without dot)
+		Returns:
+			One path per invoice, in the same order
+		"""
+		invoices = list(invoices)
+		digests = [payload_hash(invoice.to_dict()) for invoice in invoices]
+		candidates = [self._candidate(invoice, extension, digest) for invoice, digest in zip(invoices, digests)]
+		owners: Dict[str, set] = {}
+		for candidate, digest in zip(candidates, digests):
+			owners.setdefault(candidate, set()).add(digest)
+		with self._lock:
+			paths = [self._claim(candidate, digest, shared=len(owners[candidate]) > 1)
+					 for candidate, digest in zip(candidates, digests)]
+		self.ensure_directories({os.path.dirname(path) for path in paths})
+		return paths
+
+	def ensure_directories(self, directories: Iterable[str]) -> None:
+		"""Create directories that have not been created by this template yet."""
+		for directory in directories:
+			if not directory or directory in self._created_dirs:
+				continue
+			os.makedirs(directory, exist_ok=True)
+			with self._lock:
+				self._created_dirs.add(directory)
@@ -0,0 +1,223 @@
+import hashlib
+import threading
+import time
+from datetime import date
+from typing import Callable, Dict, Optional, Any
+from .utils import safe_json_load, atomic_json_save, file_lock
+
+
+class QuotaExceededError(Exception):
+	"""Raised when a request is held back by the rate or monthly limits."""
+
+
+class QuotaPausedError(QuotaExceededError):
+	"""Raised when the soft monthly limit is reached and work has not been resumed."""
+
+
+class QuotaExhaustedError(QuotaExceededError):
+	"""Raised when the hard monthly limit would be exceeded; nothing more can be sent this month."""
+
+
+class TokenBucket:
+	"""Thread-safe token bucket limiting how often requests are sent."""
+
+	def __init__(self, rate: float, capacity: float = None):
+		"""
+		Args:
+			rate: Tokens added per second
+			capacity: Maximum burst size (defaults to one second worth of tokens, at least 1)
+		"""
+		if rate <= 0:
+			raise ValueError("Rate must be positive")
+		self.rate = rate
+		self.capacity = capacity if capacity is not None else max(1.0, rate)
+		self._tokens = self.capacity
+		self._updated = time.monotonic()
+		self._lock = threading.Lock()
+		self._reserved = threading.local()
+
+	def _refill(self) -> None:
+		now = time.monotonic()
+		self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+		self._updated = now
+
+	def try_acquire(self, tokens: float = 1) -> float:
+		"""Take tokens if available. Returns 0 on success, otherwise the seconds to wait before retrying."""
+		with self._lock:
+			self._refill()
+			if self._tokens >= tokens:
+				self._tokens -= tokens
+				return 0.0
+			return (tokens - self._tokens) / self.rate
+
+	def reserve(self, tokens: float = 1) -> float:
+		"""
+		Take tokens like `try_acquire`, holding them for the calling thread: its next `acquire`
+		uses them instead of taking more. Lets a scheduler hand out tokens in its own order.
+		"""
+		wait = self.try_acquire(tokens)
+		if wait == 0:
+			self._reserved.tokens = getattr(self._reserved, "tokens", 0) + tokens
+		return wait
+
+	def cancel_reservation(self) -> None:
+		"""Drop tokens the calling thread reserved and did not use."""
+		self._reserved.tokens = 0
+
+	def acquire(self, tokens: float = 1, timeout: float = None) -> bool:
+		"""Block until tokens are available. Returns `False` if `timeout` expires first."""
+		reserved = getattr(self._reserved, "tokens", 0)
+		if reserved >= tokens:
+			self._reserved.tokens = reserved - tokens
+			return True
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while True:
+			wait = self.try_acquire(tokens)
+			if wait == 0:
+				return True
+			if deadline is not None:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					return False
+				wait = min(wait, remaining)
+			time.sleep(wait)
+
+
+class UsageCounter:
+	"""Monthly count of generated invoices per API key, persisted to a JSON file.
+	Keys are stored as a short hash so the usage file never contains credentials.
+	"""
+
+	def __init__(self, usage_file: str = "usage.json"):
+		self.usage_file = usage_file
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def _key_id(api_key: Optional[str]) -> str:
+		return hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()[:16]
+
+	@staticmethod
+	def _month(day: date = None) -> str:
+		return (day or date.today()).strftime("%Y-%m")
+
+	def _load(self) -> Dict[str, Dict[str, int]]:
+		return safe_json_load(self.usage_file) or {}
+
+	def get(self, api_key: Optional[str], day: date = None) -> int:
+		"""Get the number of invoices generated with `api_key` in the month containing `day`."""
+		with self._lock:
+			return self._load().get(self._key_id(api_key), {}).get(self._month(day), 0)
+
+	def increment(self, api_key: Optional[str], count: int = 1) -> int:
+		"""Add to this month's usage and save. Returns the new monthly total.
+		The read-modify-write is serialized across processes (GUI, daemon, serve) with a file lock.
+		"""
+		with self._lock, file_lock(self.usage_file):
+			data = self._load()
+			months = data.setdefault(self._key_id(api_key), {})
+			month = self._month()
+			months[month] = months.get(month, 0) + count
+			atomic_json_save(self.usage_file, data)
+			return months[month]
+
+
+class QuotaGovernor:
+	"""Client-side request rate and monthly quota enforcement for a single API key.
+	`acquire` is called before each request is sent and reserves one unit of quota.
+	The reservation is turned into recorded usage by `commit` when the invoice is generated,
+	or handed back by `release` when the request fails.
+	"""
+
+	def __init__(self, api_key: Optional[str], monthly_limit: int = None, soft_limit: int = None,
+				 requests_per_second: float = None, counter: UsageCounter = None,
+				 on_soft_limit: Callable[[int], None] = None):
+		"""
+		Args:
+			api_key: Key whose usage is tracked
+			monthly_limit: Hard limit; requests beyond it are rejected (None for no limit)
+			soft_limit: Work pauses once usage reaches this value until `resume` is called
+			requests_per_second: Sustained request rate (None for no rate limiting)
+			counter: Persisted usage store shared between clients
+			on_soft_limit: Called with the current usage the first time the soft limit is reached
+		"""
+		if monthly_limit is not None and soft_limit is not None and soft_limit > monthly_limit:
+			raise ValueError("Soft limit cannot exceed the monthly limit")
+		self.api_key = api_key
+		self.monthly_limit = monthly_limit
+		self.soft_limit = soft_limit
+		self.bucket = TokenBucket(requests_per_second) if requests_per_second else None
+		self.counter = counter or UsageCounter()
+		self.on_soft_limit = on_soft_limit
+		self._reserved = 0
+		self._resumed = False
+		self._soft_limit_notified = False
+		self._lock = threading.Lock()
+
+	@classmethod
+	def from_config(cls, api_key: Optional[str], config: Any, counter: UsageCounter = None) -> Optional["QuotaGovernor"]:
+		"""Build a governor from the `monthly_quota`, `quota_soft_limit` and `requests_per_second` settings.
+		Pass the same `counter` to every governor that records usage in the same file.
+		Returns `None` when none of them are configured.
+		"""
+		monthly_limit = config.get('monthly_quota')
+		soft_limit = config.get('quota_soft_limit')
+		requests_per_second = config.get('requests_per_second')
+		if monthly_limit is None and soft_limit is None and requests_per_second is None:
+			return None
+		return cls(api_key, monthly_limit=monthly_limit, soft_limit=soft_limit,
+				   requests_per_second=requests_per_second,
+				   counter=counter or UsageCounter(config.get('usage_file', 'usage.json')))
+
+	def used(self) -> int:
+		"""Invoices generated this month, including requests currently in flight."""
+		return self.counter.get(self.api_key) + self._reserved
+
+	def remaining_quota(self) -> Optional[int]:
+		"""Invoices that can still be generated this month, or `None` when no hard limit is set."""
+		if self.monthly_limit is None:
+			return None
+		return max(0, self.monthly_limit - self.used())
+
+	@property
+	def paused(self) -> bool:
+		"""Whether the soft limit has been reached and work is held until `resume` is called."""
+		return self.soft_limit is not None and not self._resumed and self.used() >= self.soft_limit
+
+	def resume(self) -> None:
+		"""Allow work to continue past the soft limit, up to the hard limit."""
+		with self._lock:
+			self._resumed = True
+
+	def acquire(self, timeout: float = None) -> None:
+		"""
+		Wait for rate limit capacity and reserve one unit of monthly quota.
+		Raises:
+			QuotaPausedError: The soft limit was reached and `resume` has not been called
+			QuotaExhaustedError: The hard limit was reached
+			QuotaExceededError: The rate limit wait timed out
+		"""
+		with self._lock:
+			used = self.used()
+			if self.monthly_limit is not None and used >= self.monthly_limit:
+				raise QuotaExhaustedError(f"Monthly quota of {self.monthly_limit} invoices exhausted")
+			if self.soft_limit is not None and used >= self.soft_limit and not self._resumed:
+				notify = not self._soft_limit_notified
+				self._soft_limit_notified = True
+				if notify and self.on_soft_limit:
+					self.on_soft_limit(used)
+				raise QuotaPausedError(f"Soft limit of {self.soft_limit} invoices reached ({used} used this month)")
+			self._reserved += 1
+		if self.bucket and not self.bucket.acquire(timeout=timeout):
+			self.release()
+			raise QuotaExceededError("Timed out waiting for rate limit")
+
+	def commit(self) -> None:
+		"""Record a reserved request as a generated invoice."""
+		with self._lock:
+			self._reserved = max(0, self._reserved - 1)
+			self.counter.increment(self.api_key)
+
+	def release(self) -> None:
+		"""Hand back a reservation for a request that did not produce an invoice."""
+		with self._lock:
+			self._reserved = max(0, self._reserved - 1)
@@ -0,0 +1,172 @@
+import os
+import sqlite3
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple, Any
+import numpy as np
+
+
+PERIODS = ("month", "quarter", "year")
+AGING_BUCKETS = ("current", "1-30", "31-60", "61-90", "90+")
+_NAT = np.iinfo(np.int64).min  # Integer value of NaT
+
+
+def _to_datetime(values: Sequence[Any]) -> np.ndarray:
+	"""Convert ISO strings, dates or None to a datetime64[D] array (None becomes NaT)."""
+	return np.array([value if value else "NaT" for value in values], dtype="datetime64[D]")
+
+
+@dataclass
+class InvoiceColumns:
+	"""Invoice records held as NumPy columns, one row per invoice."""
+	recipient: np.ndarray  # str
+	currency: np.ndarray  # str
+	date: np.ndarray  # datetime64[D], NaT when unset
+	due_date: np.ndarray  # datetime64[D], NaT when unset
+	total: np.ndarray  # float64
+	tax: np.ndarray  # float64
+	amount_paid: np.ndarray  # float64
+	balance_due: np.ndarray  # float64
+
+	def __len__(self) -> int:
+		return len(self.total)
+
+	@classmethod
+	def from_rows(cls, rows: Iterable[Tuple]) -> "InvoiceColumns":
+		"""Build columns from (recipient, currency, date, due_date, total, tax, amount_paid, balance_due) tuples."""
+		columns = list(zip(*rows)) or [()] * 8
+		recipient, currency, invoice_date, due_date, total, tax, amount_paid, balance_due = columns
+		return cls(
+			recipient=np.array(recipient, dtype=str),
+			currency=np.array(currency, dtype=str),
+			date=_to_datetime(invoice_date),
+			due_date=_to_datetime(due_date),
+			total=np.array(total, dtype=np.float64),
+			tax=np.array(tax, dtype=np.float64),
+			amount_paid=np.array(amount_paid, dtype=np.float64),
+			balance_due=np.array(balance_due, dtype=np.float64),
+		)
+
+	@classmethod
+	def from_invoices(cls, invoices: Iterable[Any]) -> "InvoiceColumns":
+		"""Build columns from `Invoice` objects."""
+		return cls.from_rows(
+			(invoice.recipient.strip().split("\n", 1)[0], invoice.currency, invoice.date, invoice.due_date,
+			 invoice.total(), invoice.tax, invoice.amount_paid, invoice.balance_due())
+			for invoice in invoices
+		)
+
+	@classmethod
+	def from_ledger(cls, db_path: str = "ledger.db") -> "InvoiceColumns":
+		"""Load successful generations from an `InvoiceLedger` database.
+		Reprints of an identical payload are counted once.
+		The database is opened read-only, so a mistyped path is reported rather than created.
+		Raises:
+			ValueError: The file does not exist or is not a ledger
+		"""
+		if not os.path.isfile(db_path):
+			raise ValueError(f"No ledger found at {db_path}")
+		try:
+			connection = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+			try:
+				rows = connection.execute(
+					"SELECT recipient_key, currency, date, due_date, total, tax, amount_paid, balance_due "
+					"FROM entries WHERE id IN (SELECT MAX(id) FROM entries WHERE status = 'success' GROUP BY payload_hash)"
+				).fetchall()
+			finally:
+				connection.close()
+		except sqlite3.Error as e:
+			raise ValueError(f"Cannot read ledger {db_path}: {e}") from e
+		return cls.from_rows(rows)
+
+
+def _group(keys: Sequence[np.ndarray], values: Dict[str, np.ndarray]) -> Tuple[List[np.ndarray], np.ndarray, Dict[str, np.ndarray]]:
+	"""Sum `values` over every distinct combination of `keys` in a single vectorized pass.
+	Returns the key columns of each group, the row count of each group and the summed values.
+	"""
+	if len(keys[0]) == 0:
+		return [key[:0] for key in keys], np.zeros(0, dtype=np.int64), {name: column[:0] for name, column in values.items()}
+	uniques, codes = zip(*(np.unique(key, return_inverse=True) for key in keys))
+	combined = np.ravel_multi_index([code.ravel() for code in codes], [len(unique) for unique in uniques])
+	group_ids, group_index = np.unique(combined, return_inverse=True)
+	group_codes = np.unravel_index(group_ids, [len(unique) for unique in uniques])
+	counts = np.bincount(group_index)
+	sums = {name: np.bincount(group_index, weights=column, minlength=len(group_ids)) for name, column in values.items()}
+	return [unique[code] for unique, code in zip(uniques, group_codes)], counts, sums
+
+
+def _period_keys(dates: np.ndarray, period: str) -> np.ndarray:
+	"""Integer period index per row (months since 1970, quarters or years); NaT stays as the NaT integer."""
+	if period not in PERIODS:
+		raise ValueError(f"Period must be one of {', '.join(PERIODS)}")
+	unit = "Y" if period == "year" else "M"
+	keys = dates.astype(f"datetime64[{unit}]").astype(np.int64)
+	if period == "quarter":
+		keys = np.where(keys == _NAT, _NAT, keys // 3)
+	return keys
+
+
+def _period_label(key: int, period: str) -> str:
+	if key == _NAT:
+		return "undated"
+	if period == "year":
+		return str(1970 + key)
+	if period == "quarter":
+		return f"{1970 + key // 4}-Q{key % 4 + 1}"
+	return f"{1970 + key // 12}-{key % 12 + 1:02d}"
+
+
+def revenue_by_recipient(columns: InvoiceColumns, period: str = "month") -> List[Dict[str, Any]]:
+	"""Invoice count, revenue, tax and outstanding balance per recipient, period and currency."""
+	(recipients, periods, currencies), counts, sums = _group(
+		[columns.recipient, _period_keys(columns.date, period), columns.currency],
+		{"revenue": columns.total, "tax": columns.tax, "balance_due": columns.balance_due}
+	)
+	return [{
+		"recipient": str(recipients[i]),
+		"period": _period_label(int(periods[i]), period),
+		"currency": str(currencies[i]),
+		"invoices": int(counts[i]),
+		"revenue": round(float(sums["revenue"][i]), 2),
+		"tax": round(float(sums["tax"][i]), 2),
+		"balance_due": round(float(sums["balance_due"][i]), 2),
+	} for i in range(len(counts))]
+
+
+def tax_by_period(columns: InvoiceColumns, period: str = "month") -> List[Dict[str, Any]]:
+	"""Tax collected and revenue per period and currency."""
+	(periods, currencies), counts, sums = _group(
+		[_period_keys(columns.date, period), columns.currency],
+		{"tax": columns.tax, "revenue": columns.total}
+	)
+	return [{
+		"period": _period_label(int(periods[i]), period),
+		"currency": str(currencies[i]),
+		"invoices": int(counts[i]),
+		"tax": round(float(sums["tax"][i]), 2),
+		"revenue": round(float(sums["revenue"][i]), 2),
+	} for i in range(len(counts))]
+
+
+def aging(columns: InvoiceColumns, as_of: date = None) -> List[Dict[str, Any]]:
+	"""Outstanding balances per recipient and currency, split into days-overdue buckets.
+	Invoices without a due date are considered due on their invoice date; undated ones are current.
+	"""
+	as_of = np.datetime64(as_of or date.today(), "D")
+	outstanding = columns.balance_due > 0
+	due = np.where(np.isnat(columns.due_date), columns.date, columns.due_date)[outstanding]
+	days_overdue = np.where(np.isnat(due), 0, (as_of - due).astype(np.int64))
+	bucket = np.digitize(days_overdue, [1, 31, 61, 91])
+	balance = columns.balance_due[outstanding]
+	values = {name: np.where(bucket == index, balance, 0.0) for index, name in enumerate(AGING_BUCKETS)}
+	(recipients, currencies), counts, sums = _group(
+		[columns.recipient[outstanding], columns.currency[outstanding]], values
+	)
+	rows = []
+	for i in range(len(counts)):
+		row = {"recipient": str(recipients[i]), "currency": str(currencies[i]), "invoices": int(counts[i])}
+		row.update({name: round(float(sums[name][i]), 2) for name in AGING_BUCKETS})
+		row["total"] = round(sum(row[name] for name in AGING_BUCKETS), 2)
+		rows.append(row)
+	return rows
@@ -0,0 +1,257 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Union, Any
+from requests.adapters import HTTPAdapter
+from .invoice_api import ErrorCategory, GenerationResult, Invoice, InvoiceFormat, InvoiceGeneratorAPI, create_api_client
+from .ledger import ledger_from_config
+from .paths import OutputPathTemplate
+from .quota import QuotaGovernor, UsageCounter
+
+# Settings an entry in `api_keys` can override for its own account
+_KEY_SETTINGS = ("monthly_quota", "quota_soft_limit", "requests_per_second")
+
+
+def _field(invoice: Union[Invoice, Dict[str, Any]], attribute: str, key: str) -> str:
+	"""Read a field from an invoice or from its `to_dict()` form."""
+	if isinstance(invoice, dict):
+		return str(invoice.get(key) or "")
+	return str(getattr(invoice, attribute, None) or "")
+
+
+def sender_entity(invoice: Union[Invoice, Dict[str, Any]]) -> str:
+	"""The sending entity of an invoice: the first line of its sender, case-folded."""
+	lines = _field(invoice, "sender", "from").strip().splitlines()
+	return lines[0].strip().casefold() if lines else ""
+
+
+@dataclass
+class RouteRule:
+	"""Sends matching invoices through the API key named `key`.
+	`sender` and `recipient` are regular expressions searched (case-insensitively) in those fields;
+	`currency` must match exactly. Every condition given must match.
+	"""
+	key: str
+	sender: Optional[str] = None
+	recipient: Optional[str] = None
+	currency: Optional[str] = None
+
+	def __post_init__(self):
+		if self.sender is None and self.recipient is None and self.currency is None:
+			raise ValueError(f"Route to {self.key!r} needs a sender, recipient or currency condition")
+		for pattern in (self.sender, self.recipient):
+			if pattern is not None:
+				try:
+					re.compile(pattern)
+				except re.error as e:
+					raise ValueError(f"Invalid pattern {pattern!r} in route to {self.key!r}: {e}")
+
+	def matches(self, invoice: Union[Invoice, Dict[str, Any]]) -> bool:
+		if self.sender is not None and not re.search(self.sender, _field(invoice, "sender", "from"), re.IGNORECASE):
+			return False
+		if self.recipient is not None and not re.search(self.recipient, _field(invoice, "recipient", "to"), re.IGNORECASE):
+			return False
+		if self.currency is not None and _field(invoice, "currency", "currency").upper() != self.currency.upper():
+			return False
+		return True
+
+
+def _build_client(api_key: str, limits: Any, config: Any, pool_size: int = None,
+				  counter: UsageCounter = None) -> InvoiceGeneratorAPI:
+	"""Client for one key, with the rate and quota limits in `limits` and the other settings from `config`."""
+	api = create_api_client(api_key, QuotaGovernor.from_config(api_key, limits, counter))
+	api.path_template = OutputPathTemplate.from_config(config)
+	api.optimize_pdfs = config.get('optimize_pdfs', False)
+	api.ledger = ledger_from_config(config)
+	if pool_size:
+		api.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+	return api
+
+
+class ApiRouter:
+	"""Routes each invoice to the API account of the entity that sends it.
+	Every named key has its own client, with its own connection pool and its own rate and quota
+	limits, so work for different accounts never waits on another account's limits. An invoice is
+	routed by the first matching rule, then by a key named after its sender's first line, then to
+	the default key.
+
+	The router can be used wherever an `InvoiceGeneratorAPI` is expected for generating and
+	validating invoices, e.g. by `RecurringScheduler.run_due`, `Outbox` and `InboxDaemon`.
+	"""
+
+	def __init__(self, clients: Dict[str, InvoiceGeneratorAPI], routes: Sequence[RouteRule] = (), default: str = None):
+		"""
+		Args:
+			clients: Client for each key name
+			routes: Rules checked in order before routing by sender
+			default: Key used when nothing else matches (None to reject such invoices)
+		Raises:
+			ValueError: A rule or the default refers to an unknown key
+		"""
+		if not clients:
+			raise ValueError("At least one API key is required")
+		for name in [route.key for route in routes] + ([default] if default else []):
+			if name not in clients:
+				raise ValueError(f"Unknown API key name: {name!r}")
+		self.clients = dict(clients)
+		self.routes = list(routes)
+		self.default = default
+		self._entities = {name.strip().casefold(): name for name in self.clients}
+
+	@classmethod
+	def from_config(cls, config: Any, pool_size: int = 8) -> "ApiRouter":
+		"""
+		Build a router from the `api_keys`, `api_routes` and `default_api_key` settings.
+		`api_keys` maps names (typically the sender entity) to an API key, or to a dict with a `key`
+		and its own `monthly_quota`, `quota_soft_limit` or `requests_per_second`. Limits not given
+		per key fall back to the global settings. `api_routes` is a list of `RouteRule` fields.
+		Raises:
+			ValueError: The settings are invalid
+		"""
+		entries = config.get('api_keys') or {}
+		if not isinstance(entries, dict):
+			raise ValueError("api_keys must map names to API keys")
+		clients = {}
+		# One counter for every key: they share the usage file, and the counter's lock serializes its updates
+		counter = UsageCounter(config.get('usage_file', 'usage.json'))
+		for name, entry in entries.items():
+			if isinstance(entry, str):
+				entry = {"key": entry}
+			if not isinstance(entry, dict) or not entry.get("key"):
+				raise ValueError(f"API key {name!r} needs a key")
+			settings = {setting: entry.get(setting, config.get(setting)) for setting in _KEY_SETTINGS}
+			clients[name] = _build_client(entry["key"], settings, config, pool_size, counter)
+		try:
+			routes = [RouteRule(**route) for route in config.get('api_routes') or []]
+		except TypeError as e:
+			raise ValueError(f"Invalid api_routes entry: {e}")
+		default = config.get('default_api_key')
+		if default is None and config.get('api_key') and "default" not in clients:
+			# The single-key setting keeps working as the fallback account
+			default = "default"
+			clients[default] = _build_client(config.get('api_key'), config, config, pool_size, counter)
+		return cls(clients, routes, default)
+
+	def route(self, invoice: Union[Invoice, Dict[str, Any]]) -> str:
+		"""
+		Name of the key an invoice is sent with.
+		Raises:
+			ValueError: No rule, sender or default applies
+		"""
+		for route in self.routes:
+			if route.matches(invoice):
+				return route.key
+		name = self._entities.get(sender_entity(invoice))
+		if name is not None:
+			return name
+		if self.default is not None:
+			return self.default
+		raise ValueError(f"No API key configured for sender {sender_entity(invoice) or '(empty)'!r}")
+
+	def client_for(self, invoice: Union[Invoice, Dict[str, Any]]) -> InvoiceGeneratorAPI:
+		"""The client an invoice is sent with. Raises `ValueError` like `route`."""
+		return self.clients[self.route(invoice)]
+
+	def generate_pdf(self, invoice: Invoice, output_path: str = None) -> GenerationResult:
+		"""Generate a PDF with the invoice's account. See `InvoiceGeneratorAPI.generate_pdf`."""
+		try:
+			client = self.client_for(invoice)
+		except ValueError as e:
+			return GenerationResult.failure(f"Error: {str(e)}", ErrorCategory.INVALID)
+		return client.generate_pdf(invoice, output_path)
+
+	def generate_ubl(self, invoice: Invoice, output_path: str = None) -> GenerationResult:
+		"""Generate a UBL e-invoice with the invoice's account. See `InvoiceGeneratorAPI.generate_ubl`."""
+		try:
+			client = self.client_for(invoice)
+		except ValueError as e:
+			return GenerationResult.failure(f"Error: {str(e)}", ErrorCategory.INVALID)
+		return client.generate_ubl(invoice, output_path)
+
+	def _send_payload(self, data: Dict[str, Any], format_type: InvoiceFormat, output_path: str) -> GenerationResult:
+		try:
+			client = self.client_for(data)
+		except ValueError as e:
+			return GenerationResult.failure(f"Error: {str(e)}", ErrorCategory.INVALID)
+		return client._send_payload(data, format_type, output_path)
+
+	def fetch_document(self, data: Dict[str, Any], format_type: InvoiceFormat = InvoiceFormat.PDF) -> Tuple[Optional[bytes], GenerationResult]:
+		"""Generate a document with the invoice's account without saving it. See `InvoiceGeneratorAPI.fetch_document`."""
+		try:
+			client = self.client_for(data)
+		except ValueError as e:
+			return None, GenerationResult.failure(f"Error: {str(e)}", ErrorCategory.INVALID)
+		return client.fetch_document(data, format_type)
+
+	def generate_document(self, data: Dict[str, Any], format_type: InvoiceFormat = InvoiceFormat.PDF) -> Tuple[Optional[bytes], GenerationResult]:
+		"""Generate a document with the invoice's account and return it. See `InvoiceGeneratorAPI.generate_document`."""
+		try:
+			client = self.client_for(data)
+		except ValueError as e:
+			return None, GenerationResult.failure(f"Error: {str(e)}", ErrorCategory.INVALID)
+		return client.generate_document(data, format_type)
+
+	def _generate_filename(self, invoice: Invoice, extension: str) -> str:
+		try:
+			client = self.client_for(invoice)
+		except ValueError:
+			client = next(iter(self.clients.values()))
+		return client._generate_filename(invoice, extension)
+
+	def validate_invoice(self, invoice: Invoice) -> List[str]:
+		"""Validate an invoice, including that it can be routed to an account."""
+		try:
+			client = self.client_for(invoice)
+		except ValueError as e:
+			client = next(iter(self.clients.values()))
+			return client.validate_invoice(invoice) + [str(e)]
+		return client.validate_invoice(invoice)
+
+	def validate_batch(self, invoices_or_rows: List[Union[Invoice, Dict[str, Any]]]) -> Any:
+		return next(iter(self.clients.values())).validate_batch(invoices_or_rows)
+
+	def remaining_quota(self) -> Dict[str, Optional[int]]:
+		"""Invoices that can still be generated this month, per key name (None where no hard limit is set)."""
+		return {name: client.remaining_quota() for name, client in self.clients.items()}
+
+	def generate_batch(self, invoices: Sequence[Invoice], format_type: InvoiceFormat = InvoiceFormat.PDF,
+					   output_paths: Sequence[Optional[str]] = None, workers_per_key: int = 4) -> List[GenerationResult]:
+		"""
+		Generate many invoices, running each account's share in parallel with the others.
+		Every key gets its own `workers_per_key` threads, so one account waiting on its rate or
+		quota limits does not hold up the rest of the batch.
+		Returns:
+			A `GenerationResult` per invoice, in order
+		"""
+		output_paths = list(output_paths) if output_paths is not None else [None] * len(invoices)
+		results: List[Optional[GenerationResult]] = [None] * len(invoices)
+		groups: Dict[str, List[int]] = {}
+		for index, invoice in enumerate(invoices):
+			try:
+				groups.setdefault(self.route(invoice), []).append(index)
+			except ValueError as e:
+				results[index] = GenerationResult.failure(f"Error: {str(e)}", ErrorCategory.INVALID)
+		generate = "generate_ubl" if format_type == InvoiceFormat.UBL else "generate_pdf"
+		executors = {name: ThreadPoolExecutor(max_workers=workers_per_key, thread_name_prefix=f"api-{name}") for name in groups}
+		try:
+			futures = {index: executors[name].submit(getattr(self.clients[name], generate), invoices[index], output_paths[index])
+					   for name, indices in groups.items() for index in indices}
+			for index, future in futures.items():
+				results[index] = future.result()
+		finally:
+			for executor in executors.values():
+				executor.shutdown()
+		return results
+
+
+def client_from_config(config: Any) -> Union[InvoiceGeneratorAPI, ApiRouter]:
+	"""
+	Create the client described by the settings: an `ApiRouter` when `api_keys` is set, otherwise
+	a single client for `api_key`. Rate and quota limits, the output path template, PDF
+	optimization and the invoice ledger are applied from the settings.
+	Raises:
+		ValueError: The routing settings are invalid
+	"""
+	if config.get('api_keys'):
+		return ApiRouter.from_config(config)
+	return _build_client(config.get('api_key'), config, config)
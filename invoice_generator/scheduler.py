@@ -0,0 +1,200 @@
+import calendar
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple, Any
+from .invoice_api import ErrorCategory, GenerationResult, InvoiceGeneratorAPI
+from .templates import TemplateManager, InvoiceFactory
+from .utils import safe_json_load, atomic_json_save
+
+
+FREQUENCIES = ("monthly", "weekly", "business_day")
+
+
+def _add_months(year: int, month: int, months: int) -> Tuple[int, int]:
+	index = year * 12 + (month - 1) + months
+	return index // 12, index % 12 + 1
+
+
+def nth_business_day(year: int, month: int, nth: int) -> date:
+	"""Get the Nth weekday (Monday to Friday) of a month. Negative values count from the end, -1 being the last."""
+	days_in_month = calendar.monthrange(year, month)[1]
+	business_days = [day for day in range(1, days_in_month + 1) if date(year, month, day).weekday() < 5]
+	index = nth - 1 if nth > 0 else nth
+	index = max(-len(business_days), min(index, len(business_days) - 1))
+	return date(year, month, business_days[index])
+
+
+@dataclass
+class RecurrenceRule:
+	"""When a template should be invoiced.
+	- monthly: on `day` of every `interval` months (clamped to the last day of short months)
+	- weekly: on `weekday` (0 = Monday) of every `interval` weeks
+	- business_day: on the `nth` business day of every `interval` months (-1 for the last)
+	"""
+	frequency: str = "monthly"
+	start: date = None
+	interval: int = 1
+	day: int = 1
+	weekday: int = 0
+	nth: int = 1
+	due_days: Optional[int] = 30  # Due date is the run date plus this many days (None to leave unset)
+	number_format: Optional[str] = None  # e.g. "INV-{date:%Y%m}-{name}"; None appends the run date to the template number
+
+	def __post_init__(self):
+		if self.frequency not in FREQUENCIES:
+			raise ValueError(f"Frequency must be one of {', '.join(FREQUENCIES)}")
+		if self.interval < 1:
+			raise ValueError("Interval must be at least 1")
+		if isinstance(self.start, str):
+			self.start = date.fromisoformat(self.start)
+		if self.start is None:
+			self.start = date.today()
+
+	@classmethod
+	def from_dict(cls, data: Dict[str, Any]) -> "RecurrenceRule":
+		return cls(**{key: value for key, value in data.items() if key in cls.__dataclass_fields__})
+
+	def to_dict(self) -> Dict[str, Any]:
+		data = asdict(self)
+		data["start"] = self.start.isoformat()
+		return data
+
+	def _occurrence_in_month(self, year: int, month: int) -> date:
+		if self.frequency == "business_day":
+			return nth_business_day(year, month, self.nth)
+		return date(year, month, min(self.day, calendar.monthrange(year, month)[1]))
+
+	def next_after(self, day: date) -> date:
+		"""Get the first occurrence strictly after `day` (and not before `start`)."""
+		if self.frequency == "weekly":
+			first = self.start + timedelta(days=(self.weekday - self.start.weekday()) % 7)
+			if day < first:
+				return first
+			periods = (day - first).days // (7 * self.interval) + 1
+			return first + timedelta(weeks=periods * self.interval)
+		year, month = self.start.year, self.start.month
+		if day > self.start:
+			elapsed = (day.year - year) * 12 + (day.month - month)
+			year, month = _add_months(year, month, elapsed - elapsed % self.interval)
+		while True:
+			candidate = self._occurrence_in_month(year, month)
+			if candidate > day and candidate >= self.start:
+				return candidate
+			year, month = _add_months(year, month, self.interval)
+
+
+class RecurringScheduler:
+	"""Generates invoices for templates with a recurrence rule.
+	Next fire times are kept in a priority queue, and the last completed run of each template is
+	persisted, so runs missed while the application was not running are caught up on the next pass.
+	All due runs of a pass are generated concurrently.
+	"""
+
+	def __init__(self, manager: TemplateManager, state_file: str = "schedule_state.json"):
+		self.manager = manager
+		self.state_file = state_file
+		self._lock = threading.Lock()
+
+	def _load_state(self) -> Dict[str, str]:
+		return safe_json_load(self.state_file) or {}
+
+	def _schedules(self) -> Dict[str, Tuple[RecurrenceRule, InvoiceFactory]]:
+		"""Load every template that has a valid recurrence rule, with its compiled invoice factory."""
+		schedules = {}
+		for template in self.manager.list_templates():
+			if not template.get("recurrence"):
+				continue
+			try:
+				rule = RecurrenceRule.from_dict(template["recurrence"])
+			except (ValueError, TypeError):
+				continue
+			factory = self.manager.compile_template(template["filename"])
+			if factory is not None:
+				schedules[template["filename"]] = (rule, factory)
+		return schedules
+
+	def due_runs(self, today: date = None, schedules: Dict[str, Tuple[RecurrenceRule, InvoiceFactory]] = None) -> List[Tuple[str, date]]:
+		"""
+		Compute every run that is due, including runs missed since the last completed one.
+		Args:
+			today: Runs up to and including this date are due (defaults to today)
+		Returns:
+			(template filename, run date) pairs in fire order
+		"""
+		today = today or date.today()
+		if schedules is None:
+			schedules = self._schedules()
+		state = self._load_state()
+		queue = []
+		for name, (rule, _) in schedules.items():
+			last_run = state.get(name)
+			after = date.fromisoformat(last_run) if last_run else rule.start - timedelta(days=1)
+			heapq.heappush(queue, (rule.next_after(after), name))
+		runs = []
+		while queue and queue[0][0] <= today:
+			fire_date, name = heapq.heappop(queue)
+			runs.append((name, fire_date))
+			heapq.heappush(queue, (schedules[name][0].next_after(fire_date), name))
+		return runs
+
+	def _generate(self, api: InvoiceGeneratorAPI, name: str, run_date: date, rule: RecurrenceRule,
+				  factory: InvoiceFactory) -> GenerationResult:
+		overrides = {"date": run_date, "due_date": None}
+		if rule.due_days is not None:
+			overrides["due_date"] = run_date + timedelta(days=rule.due_days)
+		if rule.number_format:
+			overrides["number"] = rule.number_format.format(date=run_date, name=name)
+		try:
+			invoice = factory(**overrides)
+		except (ValueError, KeyError, TypeError) as e:
+			return GenerationResult.failure(f"Error: {str(e)}", ErrorCategory.INVALID)
+		if not rule.number_format:
+			# Every run would otherwise share the template's number and overwrite the last one
+			invoice.number = f"{invoice.number}-{run_date.isoformat()}" if invoice.number else run_date.isoformat()
+		errors = api.validate_invoice(invoice)
+		if errors:
+			return GenerationResult.failure("Validation errors: " + "; ".join(errors), ErrorCategory.INVALID)
+		return api.generate_pdf(invoice)
+
+	def _run_template(self, api: InvoiceGeneratorAPI, name: str, run_dates: List[date], rule: RecurrenceRule,
+					  factory: InvoiceFactory) -> Dict[date, GenerationResult]:
+		"""Generate a template's due runs in order, recording each success and stopping at the first failure."""
+		results = {}
+		for run_date in run_dates:
+			result = self._generate(api, name, run_date, rule, factory)
+			results[run_date] = result
+			if not result.succeeded:
+				break
+			with self._lock:
+				state = self._load_state()
+				state[name] = run_date.isoformat()
+				atomic_json_save(self.state_file, state)
+		return results
+
+	def run_due(self, api: InvoiceGeneratorAPI, today: date = None, max_workers: int = 8) -> List[Tuple[str, date, GenerationResult]]:
+		"""
+		Generate all due runs and record completed ones. Templates run concurrently; each template's
+		runs are generated in date order, and stop at the first failure so that no later run is
+		generated before an earlier one. The failed run and those after it are retried next pass.
+		Without a `number_format`, each run's invoice number gets the run date appended, so a run
+		has the same number however many runs are due in a pass.
+		Returns:
+			(template filename, run date, `GenerationResult`) for each run, in fire order; runs after
+			a failure are returned as skipped
+		"""
+		schedules = self._schedules()
+		runs = self.due_runs(today, schedules)
+		if not runs:
+			return []
+		dates: Dict[str, List[date]] = {}
+		for name, run_date in runs:
+			dates.setdefault(name, []).append(run_date)
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			futures = {name: executor.submit(self._run_template, api, name, run_dates, *schedules[name])
+					   for name, run_dates in dates.items()}
+			outcomes = {name: future.result() for name, future in futures.items()}
+		skipped = GenerationResult("skipped", "Skipped: an earlier run of this template failed")
+		return [(name, run_date, outcomes[name].get(run_date, skipped)) for name, run_date in runs]
@@ -0,0 +1,209 @@
+import json
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple, Union, Any
+from requests.adapters import HTTPAdapter
+from .invoice_api import ErrorCategory, GenerationResult, InvoiceFormat, InvoiceGeneratorAPI, invoice_from_dict
+from .dispatch import Priority, PriorityDispatcher
+from .routing import ApiRouter
+from .utils import payload_hash
+
+
+CONTENT_TYPES = {
+	InvoiceFormat.PDF: "application/pdf",
+	InvoiceFormat.UBL: "application/xml",
+}
+MAX_BODY_SIZE = 5 * 1024 * 1024
+_CHUNK_SIZE = 64 * 1024
+
+
+class ServiceBusy(Exception):
+	"""Raised when no upstream slot frees up within the queue timeout."""
+
+
+@dataclass
+class _Call:
+	"""One upstream generation, shared by every caller that asked for the same payload meanwhile."""
+	done: threading.Event = field(default_factory=threading.Event)
+	content: Optional[bytes] = None
+	result: Optional[GenerationResult] = None
+	busy: bool = False
+	callers: int = 1
+	priority: Priority = Priority.NORMAL
+	started: bool = False
+
+
+class InvoiceService:
+	"""Generates documents for many callers through one shared API client.
+	Concurrent requests for an identical payload and format are merged into a single upstream
+	call, and at most `max_concurrency` upstream calls run at once, admitted by priority through a
+	`PriorityDispatcher` that keeps one slot for interactive requests. Callers wait up to
+	`queue_timeout` seconds for a slot before being turned away.
+	"""
+
+	def __init__(self, api: Union[InvoiceGeneratorAPI, ApiRouter], max_concurrency: int = 8, queue_timeout: float = 30.0):
+		self.api = api
+		self.max_concurrency = max_concurrency
+		self.queue_timeout = queue_timeout
+		self.dispatcher = PriorityDispatcher(api, max_concurrency, reserved_interactive=min(1, max_concurrency - 1))
+		# One connection pool per account, shared by every caller and sized for the concurrency limit
+		for client in (api.clients.values() if isinstance(api, ApiRouter) else [api]):
+			adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+			client.session.mount("https://", adapter)
+			client.session.mount("http://", adapter)
+		self._calls: Dict[str, _Call] = {}
+		self._lock = threading.Lock()
+		self.stats = {"requests": 0, "upstream_calls": 0, "coalesced": 0, "rejected": 0, "in_flight": 0}
+
+	def generate(self, data: Dict[str, Any], format_type: InvoiceFormat,
+				 priority: Priority = Priority.NORMAL) -> Tuple[Optional[bytes], Optional[GenerationResult], bool]:
+		"""
+		Generate a document, joining an identical call already in progress if there is one.
+		An identical call still queued at a lower priority is not joined, so it cannot hold this one up.
+		Returns:
+			(document bytes or None, `GenerationResult` of the upstream call, whether the call was shared)
+		Raises:
+			ServiceBusy: No upstream slot became free in time
+		"""
+		key = payload_hash({"format": format_type.value, "invoice": data})
+		with self._lock:
+			self.stats["requests"] += 1
+			call = self._calls.get(key)
+			if call is not None and (call.started or call.priority <= priority):
+				call.callers += 1
+				self.stats["coalesced"] += 1
+				leader = False
+			else:
+				call = self._calls[key] = _Call(priority=priority)
+				leader = True
+		if not leader:
+			call.done.wait()
+			if call.busy:
+				raise ServiceBusy(str(call.result))
+			return call.content, call.result, True
+		try:
+			try:
+				with self.dispatcher.slot(priority, self.queue_timeout, data):
+					with self._lock:
+						call.started = True
+						self.stats["upstream_calls"] += 1
+						self.stats["in_flight"] += 1
+					try:
+						call.content, call.result = self.api.generate_document(data, format_type)
+					finally:
+						with self._lock:
+							self.stats["in_flight"] -= 1
+			except TimeoutError:
+				with self._lock:
+					self.stats["rejected"] += call.callers
+				call.result, call.busy = GenerationResult.failure("Error: Service busy", ErrorCategory.TIMEOUT), True
+				raise ServiceBusy(str(call.result))
+		except ServiceBusy:
+			raise
+		except Exception as e:
+			call.result = GenerationResult.failure(f"Error: {e}", ErrorCategory.CONNECTION)
+		finally:
+			with self._lock:
+				if self._calls.get(key) is call:
+					del self._calls[key]
+			call.done.set()
+		return call.content, call.result, call.callers > 1
+
+	def health(self) -> Dict[str, Any]:
+		with self._lock:
+			status = dict(self.stats)
+		status["max_concurrency"] = self.max_concurrency
+		status["remaining_quota"] = self.api.remaining_quota()
+		status["priorities"] = self.dispatcher.stats()
+		return status
+
+
+class _Handler(BaseHTTPRequestHandler):
+	server_version = "InvoiceGenerator/1.0"
+	protocol_version = "HTTP/1.1"
+
+	@property
+	def service(self) -> InvoiceService:
+		return self.server.service
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			BaseHTTPRequestHandler.log_message(self, format, *args)
+
+	def _send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None) -> None:
+		body = json.dumps(payload).encode('utf-8')
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if self.path.rstrip("/") == "/health":
+			self._send_json(200, self.service.health())
+		else:
+			self._send_json(404, {"error": "Not found"})
+
+	def do_POST(self):
+		route = self.path.split("?", 1)[0].rstrip("/")
+		format_type = {"/pdf": InvoiceFormat.PDF, "/ubl": InvoiceFormat.UBL}.get(route)
+		if format_type is None:
+			self._send_json(404, {"error": "Not found. POST invoice JSON to /pdf or /ubl"})
+			return
+		priority = Priority.__members__.get((self.headers.get("X-Priority") or "normal").strip().upper())
+		if priority is None:
+			self._send_json(400, {"error": "X-Priority must be interactive, normal or bulk"})
+			return
+		try:
+			length = int(self.headers.get("Content-Length") or 0)
+		except ValueError:
+			length = -1
+		if length <= 0 or length > MAX_BODY_SIZE:
+			self.close_connection = True
+			self._send_json(411 if length == 0 else 413, {"error": f"Send a JSON body of at most {MAX_BODY_SIZE} bytes with Content-Length"})
+			return
+		try:
+			invoice = invoice_from_dict(json.loads(self.rfile.read(length)))
+			errors = self.service.api.validate_invoice(invoice)
+		except (ValueError, TypeError) as e:
+			self._send_json(400, {"error": str(e)})
+			return
+		if errors:
+			self._send_json(400, {"error": "; ".join(errors), "errors": errors})
+			return
+		# Send the invoice as parsed, not the request body: unknown fields are dropped and values normalized
+		data = invoice.to_dict()
+		try:
+			content, result, shared = self.service.generate(data, format_type, priority)
+		except ServiceBusy as e:
+			self._send_json(503, {"error": str(e)}, {"Retry-After": "5"})
+			return
+		if content is None:
+			status = 429 if result.error in (ErrorCategory.QUOTA, ErrorCategory.QUOTA_EXHAUSTED) or result.http_status == 429 else 502
+			self._send_json(status, {"error": str(result), "category": result.error.value if result.error else None})
+			return
+		self.send_response(200)
+		self.send_header("Content-Type", CONTENT_TYPES[format_type])
+		self.send_header("Content-Length", str(len(content)))
+		self.send_header("X-Coalesced", "true" if shared else "false")
+		self.end_headers()
+		view = memoryview(content)
+		for offset in range(0, len(view), _CHUNK_SIZE):
+			self.wfile.write(view[offset:offset + _CHUNK_SIZE])
+
+
+class InvoiceServer(ThreadingHTTPServer):
+	"""Local HTTP front end for an `InvoiceService`.
+	POST invoice JSON in the `Invoice.to_dict()` format to `/pdf` or `/ubl` to get the document back,
+	with an optional `X-Priority: interactive|normal|bulk` header; GET `/health` for request counters,
+	per-priority latencies and the remaining quota.
+	"""
+	daemon_threads = True
+
+	def __init__(self, service: InvoiceService, host: str = "127.0.0.1", port: int = 8765, verbose: bool = False):
+		self.service = service
+		self.verbose = verbose
+		ThreadingHTTPServer.__init__(self, (host, port), _Handler)
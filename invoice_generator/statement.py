@@ -0,0 +1,686 @@
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Iterable, List, Optional, Sequence, Tuple, Any
+
+
+class PDFError(ValueError):
+	"""Raised for input PDFs that cannot be read."""
+
+
+class _Name(bytes):
+	"""A PDF name, without the leading slash."""
+
+
+class _Raw(bytes):
+	"""A token written back unchanged: strings, real numbers, booleans and null."""
+
+
+class _Ref(tuple):
+	"""An indirect reference (object number, generation)."""
+
+	def __new__(cls, number: int, generation: int = 0):
+		return tuple.__new__(cls, (number, generation))
+
+
+_WHITESPACE = re.compile(rb"(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)*")
+_REGULAR = re.compile(rb"[^\x00\t\n\x0c\r ()<>\[\]{}/%]+")
+_INTEGER = re.compile(rb"[+-]?\d+$")
+_REFERENCE_TAIL = re.compile(rb"[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+R(?![^\x00\t\n\x0c\r ()<>\[\]{}/%])")
+_OBJECT_HEADER = re.compile(rb"[\x00\t\n\x0c\r ]*(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj")
+_XREF_ENTRY = re.compile(rb"[\x00\t\n\x0c\r ]*(\d{10})[\x00\t\n\x0c\r ]+(\d{5})[\x00\t\n\x0c\r ]+([nf])")
+_XREF_SUBSECTION = re.compile(rb"[\x00\t\n\x0c\r ]*(\d+)[\x00\t\n\x0c\r ]+(\d+)")
+_ANY_OBJECT = re.compile(rb"(?<![0-9])(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj\b")
+_INHERITED = (b"Resources", b"MediaBox", b"CropBox", b"Rotate")
+_COPY_CHUNK = 1024 * 1024
+
+
+def _parse(data: Any, pos: int) -> Tuple[Any, int]:
+	"""Parse one PDF object from `data` at `pos`. Returns the object and the position after it."""
+	pos = _WHITESPACE.match(data, pos).end()
+	first = data[pos:pos + 1]
+	if first == b"/":
+		match = _REGULAR.match(data, pos + 1)
+		end = match.end() if match else pos + 1
+		return _Name(data[pos + 1:end]), end
+	if first == b"<":
+		if data[pos + 1:pos + 2] == b"<":
+			result = {}
+			pos += 2
+			while True:
+				pos = _WHITESPACE.match(data, pos).end()
+				if data[pos:pos + 2] == b">>":
+					return result, pos + 2
+				key, pos = _parse(data, pos)
+				if not isinstance(key, _Name):
+					raise PDFError(f"Expected a name at offset {pos}")
+				result[bytes(key)], pos = _parse(data, pos)
+		end = data.find(b">", pos)
+		if end < 0:
+			raise PDFError(f"Unterminated hex string at offset {pos}")
+		return _Raw(data[pos:end + 1]), end + 1
+	if first == b"(":
+		depth, index = 0, pos
+		while True:
+			char = data[index:index + 1]
+			if not char:
+				raise PDFError(f"Unterminated string at offset {pos}")
+			if char == b"\\":
+				index += 2
+				continue
+			if char == b"(":
+				depth += 1
+			elif char == b")":
+				depth -= 1
+				if depth == 0:
+					return _Raw(data[pos:index + 1]), index + 1
+			index += 1
+	if first == b"[":
+		result = []
+		pos += 1
+		while True:
+			pos = _WHITESPACE.match(data, pos).end()
+			if data[pos:pos + 1] == b"]":
+				return result, pos + 1
+			value, pos = _parse(data, pos)
+			result.append(value)
+	match = _REGULAR.match(data, pos)
+	if not match:
+		raise PDFError(f"Unexpected character at offset {pos}")
+	token = match.group()
+	if _INTEGER.match(token):
+		reference = _REFERENCE_TAIL.match(data, match.end())
+		if reference:
+			return _Ref(int(token), int(reference.group(1))), reference.end()
+		return int(token), match.end()
+	return _Raw(token), match.end()
+
+
+def _serialize(value: Any, remap) -> bytes:
+	"""Serialize a parsed object, passing every indirect reference through `remap`."""
+	if isinstance(value, _Ref):
+		return b"%d 0 R" % remap(value)
+	if isinstance(value, dict):
+		return b"<<" + b"".join(b"/" + key + b" " + _serialize(item, remap) for key, item in value.items()) + b">>"
+	if isinstance(value, list):
+		return b"[" + b" ".join(_serialize(item, remap) for item in value) + b"]"
+	if isinstance(value, _Name):
+		return b"/" + value
+	if isinstance(value, int):
+		return b"%d" % value
+	return bytes(value)
+
+
+def _references(value: Any, skip: Tuple[bytes, ...] = ()) -> Iterable[_Ref]:
+	if isinstance(value, _Ref):
+		yield value
+	elif isinstance(value, dict):
+		for key, item in value.items():
+			if key not in skip:
+				yield from _references(item)
+	elif isinstance(value, list):
+		for item in value:
+			yield from _references(item)
+
+
+def _png_unpredict(data: bytes, columns: int) -> bytes:
+	"""Undo the PNG row predictors used by cross-reference and object streams."""
+	row_length = columns + 1
+	previous = bytearray(columns)
+	output = bytearray()
+	for start in range(0, len(data), row_length):
+		kind, row = data[start], bytearray(data[start + 1:start + row_length])
+		for i in range(len(row)):
+			left = row[i - 1] if i else 0
+			up = previous[i]
+			if kind == 1:
+				row[i] = (row[i] + left) & 0xFF
+			elif kind == 2:
+				row[i] = (row[i] + up) & 0xFF
+			elif kind == 3:
+				row[i] = (row[i] + (left + up) // 2) & 0xFF
+			elif kind == 4:
+				upper_left = previous[i - 1] if i else 0
+				estimate = left + up - upper_left
+				distances = (abs(estimate - left), abs(estimate - up), abs(estimate - upper_left))
+				row[i] = (row[i] + (left, up, upper_left)[distances.index(min(distances))]) & 0xFF
+		output += row
+		previous = row
+	return bytes(output)
+
+
+class _PDFSource:
+	"""Random access to the objects of one memory-mapped PDF file."""
+
+	def __init__(self, path: str, data: bytes = None):
+		"""
+		Args:
+			path: File to read, or a name used in error messages when `data` is given
+			data: Document already in memory, read instead of the file
+		"""
+		self._file = None
+		if data is not None:
+			if not data:
+				raise PDFError(f"{path} is empty")
+			self.data = data
+		else:
+			self._file = open(path, 'rb')
+			try:
+				self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+			except ValueError:
+				self._file.close()
+				raise PDFError(f"{path} is empty")
+		self.path = path
+		self._offsets: Dict[int, int] = {}  # Object number -> file offset
+		self._compressed: Dict[int, Tuple[int, int]] = {}  # Object number -> (object stream, index)
+		self._object_streams: "OrderedDict[int, Tuple[bytes, List[int]]]" = OrderedDict()
+		self._object_stream_numbers: Dict[int, List[int]] = {}
+		try:
+			self.trailer = self._read_xref()
+		except (PDFError, ValueError, IndexError, KeyError, zlib.error):
+			self.trailer = self._reconstruct_xref()
+		if b"Encrypt" in self.trailer:
+			self.close()
+			raise PDFError(f"{path} is encrypted")
+
+	def close(self) -> None:
+		self._object_streams.clear()
+		if self._file is not None:
+			self.data.close()
+			self._file.close()
+
+	# Cross-reference table
+
+	def _read_xref(self) -> Dict[bytes, Any]:
+		tail = self.data.rfind(b"startxref", max(0, len(self.data) - 2048))
+		if tail < 0:
+			raise PDFError("startxref not found")
+		offset, _ = _parse(self.data, tail + len(b"startxref"))
+		trailer = None
+		seen = set()
+		while offset is not None and offset not in seen:
+			seen.add(offset)
+			if self.data[offset:offset + 4] == b"xref":
+				section = self._read_xref_table(offset)
+				if b"XRefStm" in section:
+					self._read_xref_stream(section[b"XRefStm"])
+			else:
+				section = self._read_xref_stream(offset)
+			if trailer is None:
+				trailer = section
+			offset = section.get(b"Prev")
+		if trailer is None or b"Root" not in trailer:
+			raise PDFError("Trailer has no /Root")
+		return trailer
+
+	def _read_xref_table(self, offset: int) -> Dict[bytes, Any]:
+		pos = offset + 4
+		while True:
+			pos = _WHITESPACE.match(self.data, pos).end()
+			if self.data[pos:pos + 7] == b"trailer":
+				trailer, _ = _parse(self.data, pos + 7)
+				return trailer
+			match = _XREF_SUBSECTION.match(self.data, pos)
+			if not match:
+				raise PDFError(f"Malformed xref table at offset {offset}")
+			start, count = int(match.group(1)), int(match.group(2))
+			pos = match.end()
+			for number in range(start, start + count):
+				entry = _XREF_ENTRY.match(self.data, pos)
+				if not entry:
+					raise PDFError(f"Malformed xref entry at offset {pos}")
+				pos = entry.end()
+				if entry.group(3) == b"n" and number not in self._offsets and number not in self._compressed:
+					self._offsets[number] = int(entry.group(1))
+
+	def _read_xref_stream(self, offset: int) -> Dict[bytes, Any]:
+		_, _, dictionary, span = self._read_at(offset)
+		data = self._decode(dictionary, span)
+		widths = dictionary[b"W"]
+		index = dictionary.get(b"Index", [0, dictionary[b"Size"]])
+		entry_length = sum(widths)
+		pos = 0
+		for start, count in zip(index[::2], index[1::2]):
+			for number in range(start, start + count):
+				fields, field_pos = [], pos
+				for width in widths:
+					fields.append(int.from_bytes(data[field_pos:field_pos + width], "big"))
+					field_pos += width
+				pos += entry_length
+				kind = fields[0] if widths[0] else 1
+				if number in self._offsets or number in self._compressed:
+					continue
+				if kind == 1:
+					self._offsets[number] = fields[1]
+				elif kind == 2:
+					self._compressed[number] = (fields[1], fields[2])
+		return dictionary
+
+	def _reconstruct_xref(self) -> Dict[bytes, Any]:
+		"""Rebuild the object index by scanning the file, for damaged cross-reference data."""
+		self._offsets.clear()
+		self._compressed.clear()
+		for match in _ANY_OBJECT.finditer(self.data):
+			self._offsets[int(match.group(1))] = match.start()
+		trailer: Dict[bytes, Any] = {}
+		position = self.data.rfind(b"trailer")
+		if position >= 0:
+			try:
+				trailer, _ = _parse(self.data, position + 7)
+			except (PDFError, IndexError):
+				trailer = {}
+		for number in list(self._offsets):
+			try:
+				value, _ = self.object(number)
+			except (PDFError, ValueError, IndexError):
+				continue
+			if isinstance(value, dict):
+				if value.get(b"Type") == b"ObjStm":
+					self._index_object_stream(number)
+				elif value.get(b"Type") == b"Catalog" and b"Root" not in trailer:
+					trailer[b"Root"] = _Ref(number)
+		if b"Root" not in trailer:
+			raise PDFError(f"{self.path} is not a readable PDF")
+		return trailer
+
+	def _index_object_stream(self, number: int) -> None:
+		self._object_stream(number)
+		for index, object_number in enumerate(self._object_stream_numbers[number]):
+			if object_number not in self._offsets:
+				self._compressed.setdefault(object_number, (number, index))
+
+	# Objects
+
+	def _read_at(self, offset: int) -> Tuple[int, int, Any, Optional[Tuple[int, int]]]:
+		"""Read the object at a file offset: number, generation, value and (start, length) of its stream data."""
+		header = _OBJECT_HEADER.match(self.data, offset)
+		if not header:
+			raise PDFError(f"No object at offset {offset}")
+		value, pos = _parse(self.data, header.end())
+		span = None
+		pos = _WHITESPACE.match(self.data, pos).end()
+		if isinstance(value, dict) and self.data[pos:pos + 6] == b"stream":
+			pos += 6
+			if self.data[pos:pos + 2] == b"\r\n":
+				pos += 2
+			elif self.data[pos:pos + 1] in (b"\n", b"\r"):
+				pos += 1
+			length = self.resolve(value.get(b"Length"))
+			if not isinstance(length, int) or not self.data[pos + length:pos + length + 32].lstrip(b"\x00\t\n\x0c\r ").startswith(b"endstream"):
+				# Missing or wrong /Length: the data runs up to the end-of-line before "endstream"
+				end = self.data.find(b"endstream", pos)
+				if end < 0:
+					raise PDFError(f"Unterminated stream at offset {offset}")
+				if self.data[end - 2:end] == b"\r\n":
+					end -= 2
+				elif self.data[end - 1:end] in (b"\n", b"\r"):
+					end -= 1
+				length = max(0, end - pos)
+			span = (pos, length)
+		return int(header.group(1)), int(header.group(2)), value, span
+
+	def object(self, number: int) -> Tuple[Any, Optional[Tuple[int, int]]]:
+		"""Get an object's value and, for streams, the (start, length) of its raw data in the file."""
+		if number in self._offsets:
+			_, _, value, span = self._read_at(self._offsets[number])
+			return value, span
+		if number in self._compressed:
+			stream_number, index = self._compressed[number]
+			data, offsets = self._object_stream(stream_number)
+			value, _ = _parse(data, offsets[index])
+			return value, None
+		return _Raw(b"null"), None
+
+	def resolve(self, value: Any) -> Any:
+		if isinstance(value, _Ref):
+			return self.object(value[0])[0]
+		return value
+
+	def _object_stream(self, number: int) -> Tuple[bytes, List[int]]:
+		"""Decompressed contents and object offsets of an object stream. A few are kept decoded at a time."""
+		cached = self._object_streams.get(number)
+		if cached is not None:
+			self._object_streams.move_to_end(number)
+			return cached
+		_, _, dictionary, span = self._read_at(self._offsets[number])
+		data = self._decode(dictionary, span)
+		first = self.resolve(dictionary[b"First"])
+		pairs, pos = [], 0
+		for _ in range(self.resolve(dictionary[b"N"]) * 2):
+			value, pos = _parse(data, pos)
+			pairs.append(value)
+		self._object_stream_numbers[number] = pairs[::2]
+		cached = (data, [first + offset for offset in pairs[1::2]])
+		self._object_streams[number] = cached
+		if len(self._object_streams) > 4:
+			self._object_streams.popitem(last=False)
+		return cached
+
+	def _decode(self, dictionary: Dict[bytes, Any], span: Tuple[int, int]) -> bytes:
+		data = self.data[span[0]:span[0] + span[1]]
+		filters = self.resolve(dictionary.get(b"Filter"))
+		params = self.resolve(dictionary.get(b"DecodeParms"))
+		filters = filters if isinstance(filters, list) else [filters] if filters else []
+		params = params if isinstance(params, list) else [params]
+		for position, name in enumerate(filters):
+			if name != b"FlateDecode":
+				raise PDFError(f"Unsupported filter /{name.decode('latin-1')}")
+			data = zlib.decompress(data)
+			param = self.resolve(params[position]) if position < len(params) else None
+			if isinstance(param, dict) and self.resolve(param.get(b"Predictor", 1)) >= 10:
+				data = _png_unpredict(data, self.resolve(param.get(b"Columns", 1)))
+		return data
+
+	def pages(self) -> Tuple[List[Tuple[int, Dict[bytes, Any]]], set]:
+		"""The page objects in order, with inherited attributes filled in, and the numbers of the page tree nodes."""
+		catalog = self.resolve(self.trailer[b"Root"])
+		root = catalog.get(b"Pages")
+		if not isinstance(root, _Ref):
+			raise PDFError(f"{self.path} has no page tree")
+		pages, nodes = [], set()
+		stack = [(root, {})]
+		while stack:
+			reference, inherited = stack.pop()
+			if reference[0] in nodes:
+				continue
+			node = self.resolve(reference)
+			if not isinstance(node, dict):
+				continue
+			if node.get(b"Type") == b"Pages" or (b"Kids" in node and node.get(b"Type") != b"Page"):
+				nodes.add(reference[0])
+				inherited = dict(inherited, **{key.decode(): node[key] for key in _INHERITED if key in node})
+				kids = self.resolve(node.get(b"Kids", []))
+				stack.extend((kid, inherited) for kid in reversed(kids) if isinstance(kid, _Ref))
+			else:
+				page = dict(node)
+				for key, value in inherited.items():
+					page.setdefault(key.encode(), value)
+				pages.append((reference[0], page))
+		return pages, nodes
+
+
+class StatementBuilder:
+	"""Concatenates invoice PDFs, and optional summary pages, into a single statement PDF.
+	Input files are memory-mapped and their objects are copied to the output one at a time, so
+	memory use does not grow with the number or size of the documents. Identical fonts and images
+	shared by the inputs are written once.
+
+	Use as a context manager, or call `close()` to finish the file:
+
+		with StatementBuilder("statement.pdf") as statement:
+			statement.add_summary("Acme Corp - January 2025", ["Invoice", "Total"], rows)
+			for path in invoice_paths:
+				statement.add_pdf(path)
+	"""
+
+	def __init__(self, output_path: str, page_size: Tuple[float, float] = (612, 792)):
+		"""
+		Args:
+			output_path: The statement file to write. It is replaced only when the statement is complete.
+			page_size: Width and height, in points, of summary pages (default: US Letter)
+		"""
+		self.output_path = output_path
+		self.page_size = page_size
+		directory = os.path.dirname(os.path.abspath(output_path))
+		fd, self._temp_path = tempfile.mkstemp(prefix=".statement-", suffix=".pdf", dir=directory)
+		self._out: BinaryIO = os.fdopen(fd, 'wb')
+		self._offsets = array('Q', [0, 0, 0])  # Object 1 is the catalog, 2 the page tree
+		self._kids = array('L')
+		self._streams: Dict[bytes, int] = {}  # Digest of a reference-free stream -> output object number
+		self._fonts: Dict[str, int] = {}
+		self._closed = False
+		self._out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+	def __enter__(self) -> "StatementBuilder":
+		return self
+
+	def __exit__(self, exc_type, exc, tb) -> None:
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
+
+	@property
+	def page_count(self) -> int:
+		return len(self._kids)
+
+	def _allocate(self) -> int:
+		self._offsets.append(0)
+		return len(self._offsets) - 1
+
+	def _begin(self, number: int) -> None:
+		self._offsets[number] = self._out.tell()
+		self._out.write(b"%d 0 obj\n" % number)
+
+	def _write_object(self, number: int, body: bytes) -> None:
+		self._begin(number)
+		self._out.write(body)
+		self._out.write(b"\nendobj\n")
+
+	def _write_stream(self, number: int, dictionary: bytes, chunks: Iterable[bytes]) -> None:
+		self._begin(number)
+		self._out.write(dictionary)
+		self._out.write(b"\nstream\n")
+		for chunk in chunks:
+			self._out.write(chunk)
+		self._out.write(b"\nendstream\nendobj\n")
+
+	@staticmethod
+	def _chunks(source: _PDFSource, span: Tuple[int, int]) -> Iterable[bytes]:
+		start, length = span
+		for offset in range(start, start + length, _COPY_CHUNK):
+			yield source.data[offset:min(offset + _COPY_CHUNK, start + length)]
+
+	def _stream_digest(self, source: _PDFSource, value: Dict[bytes, Any], span: Tuple[int, int]) -> Optional[bytes]:
+		"""Digest identifying a stream that can be shared between documents, or None."""
+		if any(True for _ in _references(value, skip=(b"Length",))):
+			return None
+		digest = hashlib.sha256(_serialize({key: item for key, item in value.items() if key != b"Length"}, None))
+		for chunk in self._chunks(source, span):
+			digest.update(chunk)
+		return digest.digest()
+
+	def add_pdf(self, path: str) -> int:
+		"""Append every page of a PDF. Returns the number of pages added."""
+		source = _PDFSource(path)
+		try:
+			pages, tree_nodes = source.pages()
+			page_objects = dict(pages)
+			mapping: Dict[int, int] = {node: 2 for node in tree_nodes}
+			pending: List[int] = []
+			pending_digests: Dict[int, bytes] = {}
+
+			def remap(reference: _Ref) -> int:
+				number = reference[0]
+				mapped = mapping.get(number)
+				if mapped is not None:
+					return mapped
+				if number not in page_objects:
+					value, span = source.object(number)
+					if span is not None:
+						digest = self._stream_digest(source, value, span)
+						if digest is not None:
+							shared = self._streams.get(digest)
+							if shared is not None:
+								mapping[number] = shared
+								return shared
+							pending_digests[number] = digest
+				mapping[number] = self._allocate()
+				pending.append(number)
+				return mapping[number]
+
+			for number, _ in pages:
+				self._kids.append(remap(_Ref(number)))
+			while pending:
+				number = pending.pop()
+				new_number = mapping[number]
+				if number in page_objects:
+					# /Parent points at an old page tree node, which maps to the new page tree
+					value, span = page_objects.pop(number), None
+				else:
+					value, span = source.object(number)
+				if span is None:
+					self._write_object(new_number, _serialize(value, remap))
+					continue
+				dictionary = {key: item for key, item in value.items() if key != b"Length"}
+				dictionary[b"Length"] = span[1]
+				self._write_stream(new_number, _serialize(dictionary, remap), self._chunks(source, span))
+				if number in pending_digests:
+					self._streams[pending_digests.pop(number)] = new_number
+			return len(pages)
+		finally:
+			source.close()
+
+	def _font(self, base_font: str) -> int:
+		number = self._fonts.get(base_font)
+		if number is None:
+			number = self._fonts[base_font] = self._allocate()
+			self._write_object(number, b"<</Type/Font/Subtype/Type1/BaseFont/%s/Encoding/WinAnsiEncoding>>"
+							   % base_font.encode('ascii'))
+		return number
+
+	def add_summary(self, title: str, header: Sequence[str], rows: Iterable[Sequence[Any]],
+					footer: Sequence[str] = ()) -> int:
+		"""
+		Append summary pages: a title, then a table, then optional footer lines such as totals.
+		Columns are laid out in a monospaced font, with numeric columns right-aligned, and the
+		table continues on further pages as needed.
+		Returns the number of pages added.
+		"""
+		rows = [[str(cell) for cell in row] for row in rows]
+		widths = [max([len(str(heading))] + [len(row[i]) for row in rows if i < len(row)]) for i, heading in enumerate(header)]
+
+		numeric = [bool(rows) and all(_is_amount(row[i]) for row in rows if i < len(row)) for i in range(len(header))]
+
+		def line(cells):
+			return "  ".join(cell.rjust(width) if numeric[i] else cell.ljust(width)
+							 for i, (cell, width) in enumerate(zip(cells, widths))).rstrip()
+
+		heading = line([str(heading) for heading in header])
+		table = [heading, "-" * len(heading)]
+		table += [line(row) for row in rows]
+		table += [""] + list(footer) if footer else []
+		width, height = self.page_size
+		margin, leading, size = 54, 13, 9
+		per_page = max(1, int((height - 2 * margin - 36) // leading))
+		fonts = b"<</F1 %d 0 R/F2 %d 0 R>>" % (self._font("Helvetica-Bold"), self._font("Courier"))
+		pages = 0
+		for start in range(0, max(len(table), 1), per_page):
+			lines = [b"BT", b"/F1 14 Tf %.2f %.2f Td (%s) Tj" % (margin, height - margin, _pdf_text(title)),
+					 b"/F2 %d Tf %d TL 0 -30 Td" % (size, leading)]
+			lines += [b"(%s) '" % _pdf_text(text) for text in table[start:start + per_page]]
+			lines.append(b"ET")
+			content = b"\n".join(lines)
+			content_number = self._allocate()
+			self._write_stream(content_number, b"<</Length %d>>" % len(content), [content])
+			page_number = self._allocate()
+			self._write_object(page_number, b"<</Type/Page/Parent 2 0 R/MediaBox[0 0 %.2f %.2f]/Resources<</Font %s>>/Contents %d 0 R>>"
+							   % (width, height, fonts, content_number))
+			self._kids.append(page_number)
+			pages += 1
+		return pages
+
+	def close(self) -> None:
+		"""Write the page tree and cross-reference table, and move the statement into place."""
+		if self._closed:
+			return
+		kids = b" ".join(b"%d 0 R" % number for number in self._kids)
+		self._write_object(2, b"<</Type/Pages/Kids[%s]/Count %d>>" % (kids, len(self._kids)))
+		self._write_object(1, b"<</Type/Catalog/Pages 2 0 R>>")
+		xref_offset = self._out.tell()
+		self._out.write(b"xref\n0 %d\n0000000000 65535 f \n" % len(self._offsets))
+		for offset in self._offsets[1:]:
+			self._out.write(b"%010d 00000 n \n" % offset)
+		self._out.write(b"trailer\n<</Size %d/Root 1 0 R>>\nstartxref\n%d\n%%%%EOF\n" % (len(self._offsets), xref_offset))
+		self._out.flush()
+		os.fsync(self._out.fileno())
+		self._out.close()
+		os.replace(self._temp_path, self.output_path)
+		self._closed = True
+
+	def abort(self) -> None:
+		"""Discard the partly written statement."""
+		if self._closed:
+			return
+		self._out.close()
+		try:
+			os.remove(self._temp_path)
+		except OSError:
+			pass
+		self._closed = True
+
+
+def _is_amount(text: str) -> bool:
+	try:
+		float(text.replace(",", ""))
+		return True
+	except ValueError:
+		return False
+
+
+def _pdf_text(text: str) -> bytes:
+	"""Encode text for a literal string shown with a WinAnsiEncoding standard font."""
+	encoded = text.encode('cp1252', errors='replace')
+	return encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def build_statement(pdf_paths: Sequence[str], output_path: str, title: str = None,
+					summary: Sequence[Sequence[Any]] = None, header: Sequence[str] = None,
+					footer: Sequence[str] = ()) -> int:
+	"""
+	Merge invoice PDFs into one statement, optionally preceded by summary pages.
+	Args:
+		pdf_paths: Invoice PDFs, in order
+		output_path: Statement file to write
+		title: Summary page title (default: "Statement")
+		summary: Summary table rows; no summary pages are added without them
+		header: Column headings for the summary rows
+		footer: Lines printed after the table, such as totals
+	Returns:
+		The number of pages in the statement
+	"""
+	with StatementBuilder(output_path) as statement:
+		if summary is not None:
+			statement.add_summary(title or "Statement", header or [], summary, footer)
+		for path in pdf_paths:
+			statement.add_pdf(path)
+		return statement.page_count
+
+
+def statement_from_ledger(entries: Sequence[Any], output_path: str, title: str = "Statement") -> Tuple[int, List[Any]]:
+	"""
+	Build a statement from `InvoiceLedger` entries, with a summary page listing each invoice.
+	Only successful PDF generations whose files still exist are included. An invoice number
+	generated more than once is included once, using its latest file.
+	Returns:
+		(page count, entries whose PDF was missing)
+	Raises:
+		ValueError: None of the entries has a PDF to include
+	"""
+	latest: Dict[Any, Any] = {}
+	for entry in entries:
+		if entry.succeeded and entry.format == "pdf" and entry.output_path:
+			latest[entry.number or entry.output_path] = entry
+	included, missing = [], []
+	for entry in latest.values():
+		(included if os.path.exists(entry.output_path) else missing).append(entry)
+	if not included:
+		raise ValueError(f"No invoice PDFs to include ({len(missing)} not found)" if missing else "No generated invoice PDFs to include")
+	included.sort(key=lambda entry: (entry.date or "", entry.number or ""))
+	totals: Dict[str, List[float]] = {}
+	for entry in included:
+		total = totals.setdefault(entry.currency, [0.0, 0.0])
+		total[0] += entry.total
+		total[1] += entry.balance_due
+	rows = [[entry.number or "", entry.date or "", entry.due_date or "", entry.currency,
+			 f"{entry.total:,.2f}", f"{entry.balance_due:,.2f}"] for entry in included]
+	footer = [f"{currency}: {len([e for e in included if e.currency == currency])} invoices, "
+			  f"total {amounts[0]:,.2f}, balance due {amounts[1]:,.2f}" for currency, amounts in sorted(totals.items())]
+	pages = build_statement([entry.output_path for entry in included], output_path, title, rows,
+							["Invoice", "Date", "Due", "Currency", "Total", "Balance"], footer)
+	return pages, missing
@@ -0,0 +1,153 @@
+import csv
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Union, Any
+try:
+	import numpy as np
+except ImportError as e:
+	raise ImportError("Tax rates require NumPy. Install it with: uv pip install 'invoice-gen[reports]'") from e
+from .invoice_api import DisplayFields
+
+
+DEFAULT_CATEGORY = "*"  # Matches items without a category, and categories without a rule of their own
+
+
+class TaxRuleTable:
+	"""Tax rates in percent, indexed by jurisdiction and item category.
+	Jurisdictions are hierarchical codes separated by "-", such as "US-CA-SF". A lookup tries the
+	exact jurisdiction first, then each parent ("US-CA", then "US"), first for the item's
+	category and then for the "*" category. Resolved lookups are cached.
+	"""
+
+	def __init__(self, rules: Dict[Tuple[str, str], float] = None):
+		self._rules: Dict[Tuple[str, str], float] = {}
+		self._resolved: Dict[Tuple[str, str], Optional[float]] = {}
+		self._lock = threading.Lock()
+		for (jurisdiction, category), rate in (rules or {}).items():
+			self.add_rule(jurisdiction, category, rate)
+
+	@staticmethod
+	def _key(jurisdiction: str, category: Optional[str]) -> Tuple[str, str]:
+		return (jurisdiction or "").strip().upper(), (category or DEFAULT_CATEGORY).strip().lower()
+
+	@classmethod
+	def from_csv(cls, path: str) -> "TaxRuleTable":
+		"""Load rules from a CSV file with `jurisdiction`, `category` and `rate` (percent) columns."""
+		table = cls()
+		with open(path, 'r', encoding='utf-8', newline='') as f:
+			for row in csv.DictReader(f):
+				table.add_rule(row["jurisdiction"], row.get("category") or DEFAULT_CATEGORY, float(row["rate"]))
+		return table
+
+	def add_rule(self, jurisdiction: str, category: str, rate: float) -> None:
+		if rate < 0:
+			raise ValueError("Tax rate cannot be negative")
+		with self._lock:
+			self._rules[self._key(jurisdiction, category)] = rate
+			self._resolved.clear()
+
+	def rate(self, jurisdiction: str, category: Optional[str] = None) -> Optional[float]:
+		"""Get the rate in percent for an item category in a jurisdiction, or None if no rule applies."""
+		key = self._key(jurisdiction, category)
+		try:
+			return self._resolved[key]
+		except KeyError:
+			pass
+		code, category = key
+		parts = code.split("-") if code else []
+		rate = None
+		for length in range(len(parts), -1, -1):
+			candidate = "-".join(parts[:length])
+			for lookup_category in dict.fromkeys([category, DEFAULT_CATEGORY]):
+				rate = self._rules.get((candidate, lookup_category))
+				if rate is not None:
+					break
+			if rate is not None:
+				break
+		self._resolved[key] = rate
+		return rate
+
+
+@dataclass
+class TaxBreakdown:
+	"""Result of computing tax over a batch. Item arrays are flat, in invoice then item order."""
+	item_invoice: np.ndarray  # Index of the invoice each item belongs to
+	item_rates: np.ndarray  # Percent, NaN where no rule applies
+	item_tax: np.ndarray
+	invoice_tax: np.ndarray
+
+	def items_of(self, index: int) -> np.ndarray:
+		"""Per-item tax amounts of one invoice."""
+		return self.item_tax[self.item_invoice == index]
+
+
+class TaxEngine:
+	"""Computes tax for batches of invoices from a `TaxRuleTable`."""
+
+	def __init__(self, rules: TaxRuleTable, strict: bool = False):
+		"""
+		Args:
+			rules: The rate table
+			strict: Raise `KeyError` for items no rule applies to, instead of taxing them at 0
+		"""
+		self.rules = rules
+		self.strict = strict
+
+	def compute(self, invoices: Sequence[Any], jurisdictions: Union[str, Sequence[str]]) -> TaxBreakdown:
+		"""
+		Compute per-item and per-invoice tax without changing the invoices.
+		Rates are resolved once per distinct (jurisdiction, category) pair in the batch; the
+		taxable amounts and totals are then computed over flat item arrays.
+		Args:
+			invoices: `Invoice` objects
+			jurisdictions: One jurisdiction for the whole batch, or one per invoice
+		"""
+		if isinstance(jurisdictions, str):
+			jurisdictions = [jurisdictions] * len(invoices)
+		if len(jurisdictions) != len(invoices):
+			raise ValueError("Expected one jurisdiction per invoice")
+		item_invoice, quantities, unit_costs, discounts, pair_index = [], [], [], [], []
+		pairs: Dict[Tuple[str, Optional[str]], int] = {}
+		for index, (invoice, jurisdiction) in enumerate(zip(invoices, jurisdictions)):
+			for item in invoice.items:
+				item_invoice.append(index)
+				quantities.append(item.quantity)
+				unit_costs.append(item.unit_cost)
+				discounts.append(item.discount or 0.0)
+				pair_index.append(pairs.setdefault((jurisdiction, item.tax_category), len(pairs)))
+		pair_rates = np.array([self.rules.rate(*pair) for pair in pairs], dtype=np.float64)
+		if self.strict and np.isnan(pair_rates).any():
+			jurisdiction, category = list(pairs)[int(np.argmax(np.isnan(pair_rates)))]
+			raise KeyError(f"No tax rule for category '{category or DEFAULT_CATEGORY}' in '{jurisdiction}'")
+		item_invoice = np.array(item_invoice, dtype=np.int64)
+		item_rates = pair_rates[np.array(pair_index, dtype=np.int64)] if pair_index else np.zeros(0)
+		taxable = np.maximum(0.0, np.array(quantities, dtype=np.float64) * np.array(unit_costs, dtype=np.float64)
+							 - np.array(discounts, dtype=np.float64))
+		item_tax = np.round(taxable * np.nan_to_num(item_rates) / 100.0, 2)
+		invoice_tax = np.round(np.bincount(item_invoice, weights=item_tax, minlength=len(invoices)), 2)
+		return TaxBreakdown(item_invoice, item_rates, item_tax, invoice_tax)
+
+	def apply(self, invoices: Sequence[Any], jurisdictions: Union[str, Sequence[str]],
+			  percent_when_uniform: bool = False) -> TaxBreakdown:
+		"""
+		Compute tax and store it on each invoice.
+		`Invoice.tax` is set to the tax amount and shown as an amount. With `percent_when_uniform`,
+		invoices whose items all share one rate store that rate instead and show it as a percentage.
+		Returns:
+			The computed breakdown
+		"""
+		breakdown = self.compute(invoices, jurisdictions)
+		starts = np.searchsorted(breakdown.item_invoice, np.arange(len(invoices) + 1))
+		for index, invoice in enumerate(invoices):
+			rates = breakdown.item_rates[starts[index]:starts[index + 1]]
+			uniform = percent_when_uniform and len(rates) > 0 and not np.isnan(rates[0]) and (rates == rates[0]).all()
+			if uniform:
+				invoice.tax = float(rates[0])
+			else:
+				invoice.tax = float(breakdown.invoice_tax[index])
+			invoice.display_fields = DisplayFields(
+				tax="%" if uniform else True,
+				discounts=invoice.display_fields.discounts,
+				shipping=invoice.display_fields.shipping
+			)
+		return breakdown
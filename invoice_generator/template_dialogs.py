@@ -1,14 +1,36 @@
 import wx
 from .templates import template_manager
+from .template_watcher import template_catalog
+from .utils import sanitize_filename
+
+
+def _selected_filename(template_list, templates):
+	"""Filename of the selected template in a template list, or None."""
+	selection = template_list.GetFirstSelected()
+	if selection == -1:
+		return None
+	return templates[template_list.GetItemData(selection)]["filename"]
+
+
+def _fill_template_list(template_list, templates, selected=None):
+	"""Fill a template list control, reselecting the template named `selected` if it is still present."""
+	for i, template in enumerate(templates):
+		index = template_list.InsertItem(i, template["name"])
+		template_list.SetItem(index, 1, template["created"])
+		template_list.SetItem(index, 2, str(template["field_count"]))
+		template_list.SetItemData(index, i)
+		if template["filename"] == selected:
+			template_list.Select(index)
 
 
 class SaveTemplateDialog(wx.Dialog):
 	"""Dialog for saving current values as a template."""
 
 	def __init__(self, parent):
-		wx.Dialog.__init__(self, parent, title="Save as Template", size=(400, 150),
+		wx.Dialog.__init__(self, parent, title="Save as Template", size=(400, 220),
 						   style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
 		self.template_name = ""
+		self.base_template = None
 		self._create_ui()
 
 	def _create_ui(self):
@@ -19,6 +41,15 @@ class SaveTemplateDialog(wx.Dialog):
 		self.name_ctrl.SetToolTip("Enter a name for this template")
 		main_sizer.Add(name_label, 0, wx.ALL, 8)
 		main_sizer.Add(self.name_ctrl, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 8)
+		base_label = wx.StaticText(self, label="Based on:")
+		self.all_templates = template_catalog.templates()
+		self.base_templates = []
+		self.base_ctrl = wx.Choice(self)
+		self.base_ctrl.SetToolTip("Only values that differ from the base template are saved")
+		self._update_base_choices()
+		self.name_ctrl.Bind(wx.EVT_TEXT, self._update_base_choices)
+		main_sizer.Add(base_label, 0, wx.LEFT | wx.RIGHT, 8)
+		main_sizer.Add(self.base_ctrl, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 8)
 		# Status text
 		self.status_text = wx.StaticText(self, label="")
 		main_sizer.Add(self.status_text, 0, wx.ALL, 8)
@@ -36,6 +67,29 @@ class SaveTemplateDialog(wx.Dialog):
 		save_btn.SetDefault()
 		self.name_ctrl.SetFocus()
 
+	def _update_base_choices(self, event=None):
+		"""List possible base templates, leaving out the named template and those based on it."""
+		name = self.name_ctrl.GetValue().strip()
+		filename = sanitize_filename(name) if name else None
+		parents = {template["filename"]: template.get("extends") for template in self.all_templates}
+
+		def based_on_named(current):
+			seen = set()
+			while current and current not in seen:
+				if current == filename:
+					return True
+				seen.add(current)
+				parent = parents.get(current)
+				current = sanitize_filename(parent) if parent else None
+			return False
+
+		selected = self.base_ctrl.GetSelection()
+		selected = self.base_templates[selected - 1]["filename"] if selected > 0 else None
+		self.base_templates = [template for template in self.all_templates if not based_on_named(template["filename"])]
+		self.base_ctrl.SetItems(["(none)"] + [template["name"] for template in self.base_templates])
+		filenames = [template["filename"] for template in self.base_templates]
+		self.base_ctrl.SetSelection(filenames.index(selected) + 1 if selected in filenames else 0)
+
 	def _on_save(self, event):
 		"""Handle save button."""
 		name = self.name_ctrl.GetValue().strip()
@@ -43,6 +97,9 @@ class SaveTemplateDialog(wx.Dialog):
 			self.status_text.SetLabel("Please enter a template name")
 			return
 		self.template_name = name
+		base_index = self.base_ctrl.GetSelection()
+		if base_index > 0:
+			self.base_template = self.base_templates[base_index - 1]["filename"]
 		self.EndModal(wx.ID_OK)
 
 	def _on_cancel(self, event):
@@ -53,6 +110,10 @@ class SaveTemplateDialog(wx.Dialog):
 		"""Get the entered template name."""
 		return self.template_name
 
+	def get_base_template(self):
+		"""Get the filename of the selected base template, or None."""
+		return self.base_template
+
 
 class LoadTemplateDialog(wx.Dialog):
 	"""Dialog for loading a saved template."""
@@ -61,8 +122,11 @@ class LoadTemplateDialog(wx.Dialog):
 		wx.Dialog.__init__(self, parent, title="Load Template", size=(500, 400),
 						   style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
 		self.selected_template = None
+		self.templates = []
 		self._create_ui()
 		self._load_templates()
+		template_catalog.subscribe(self._on_catalog_changed)
+		self.Bind(wx.EVT_WINDOW_DESTROY, self._on_destroy)
 
 	def _create_ui(self):
 		"""Build the load template dialog UI."""
@@ -92,19 +156,30 @@ class LoadTemplateDialog(wx.Dialog):
 		load_btn.SetDefault()
 
 	def _load_templates(self):
-		"""Load available templates into the list."""
-		templates = template_manager.list_templates()
+		"""Load available templates into the list, keeping the current selection."""
+		selected = _selected_filename(self.template_list, self.templates)
+		self.template_list.DeleteAllItems()
+		templates = template_catalog.templates()
+		self.templates = templates  # Keep reference for loading
 		if not templates:
 			self.status_text.SetLabel("No templates found")
 			return
-		for i, template in enumerate(templates):
-			index = self.template_list.InsertItem(i, template["name"])
-			self.template_list.SetItem(index, 1, template["created"])
-			self.template_list.SetItem(index, 2, str(template["field_count"]))
-			self.template_list.SetItemData(index, i)
-		self.templates = templates  # Keep reference for loading
+		_fill_template_list(self.template_list, templates, selected)
 		self.status_text.SetLabel(f"Found {len(templates)} templates")
 
+	def _on_catalog_changed(self, changed):
+		"""Called from the watcher thread when template files change."""
+		wx.CallAfter(self._refresh_if_alive)
+
+	def _refresh_if_alive(self):
+		if self:
+			self._load_templates()
+
+	def _on_destroy(self, event):
+		if event.GetEventObject() is self:
+			template_catalog.unsubscribe(self._on_catalog_changed)
+		event.Skip()
+
 	def _on_load(self, event):
 		"""Handle load button."""
 		selection = self.template_list.GetFirstSelected()
@@ -130,8 +205,11 @@ class ManageTemplatesDialog(wx.Dialog):
 	def __init__(self, parent):
 		wx.Dialog.__init__(self, parent, title="Manage Templates", size=(600, 450),
 						   style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+		self.templates = []
 		self._create_ui()
 		self._load_templates()
+		template_catalog.subscribe(self._on_catalog_changed)
+		self.Bind(wx.EVT_WINDOW_DESTROY, self._on_destroy)
 
 	def _create_ui(self):
 		"""Build the template management dialog UI."""
@@ -165,22 +243,32 @@ class ManageTemplatesDialog(wx.Dialog):
 		self.Layout()
 
 	def _load_templates(self):
-		"""Load available templates into the list."""
+		"""Load available templates into the list, keeping the current selection."""
+		selected = _selected_filename(self.template_list, self.templates)
 		self.template_list.DeleteAllItems()
-		templates = template_manager.list_templates()
+		templates = template_catalog.templates()
+		self.templates = templates  # Keep reference
 		if not templates:
 			self.status_text.SetLabel("No templates found")
 			self.delete_btn.Enable(False)
 			return
-		for i, template in enumerate(templates):
-			index = self.template_list.InsertItem(i, template["name"])
-			self.template_list.SetItem(index, 1, template["created"])
-			self.template_list.SetItem(index, 2, str(template["field_count"]))
-			self.template_list.SetItemData(index, i)
-		self.templates = templates  # Keep reference
+		_fill_template_list(self.template_list, templates, selected)
 		self.status_text.SetLabel(f"Found {len(templates)} templates")
 		self.delete_btn.Enable(True)
 
+	def _on_catalog_changed(self, changed):
+		"""Called from the watcher thread when template files change."""
+		wx.CallAfter(self._refresh_if_alive)
+
+	def _refresh_if_alive(self):
+		if self:
+			self._load_templates()
+
+	def _on_destroy(self, event):
+		if event.GetEventObject() is self:
+			template_catalog.unsubscribe(self._on_catalog_changed)
+		event.Skip()
+
 	def _on_delete(self, event):
 		"""Handle delete button."""
 		selection = self.template_list.GetFirstSelected()
@@ -196,6 +284,7 @@ class ManageTemplatesDialog(wx.Dialog):
 		if dlg.ShowModal() == wx.ID_YES:
 			if template_manager.delete_template(template["filename"]):
 				self.status_text.SetLabel(f"Template '{template['name']}' deleted successfully")
+				template_catalog.update([f"{template['filename']}.json"])
 				self._load_templates()  # Refresh list
 			else:
 				self.status_text.SetLabel(f"Failed to delete template '{template['name']}'")
@@ -0,0 +1,224 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Any
+from .templates import TemplateManager, template_manager
+
+
+# inotify event masks (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class TemplateCatalog:
+	"""In-memory listing of the templates directory, kept current incrementally.
+	Each file's (mtime, size) is remembered, so a refresh only parses templates that were
+	added or changed since the last one. Listeners are called with the set of changed
+	filenames, from whichever thread applied the change.
+	"""
+
+	def __init__(self, manager: TemplateManager):
+		self.manager = manager
+		self._entries: Dict[str, Tuple[Tuple[int, int], Optional[Dict[str, Any]]]] = {}
+		self._listeners: List[Callable[[set], None]] = []
+		self._lock = threading.Lock()
+		self.watched = False  # True while a `TemplateWatcher` keeps the catalog current
+
+	def subscribe(self, listener: Callable[[set], None]) -> None:
+		with self._lock:
+			self._listeners.append(listener)
+
+	def unsubscribe(self, listener: Callable[[set], None]) -> None:
+		with self._lock:
+			if listener in self._listeners:
+				self._listeners.remove(listener)
+
+	def _notify(self, changed: set) -> None:
+		if not changed:
+			return
+		with self._lock:
+			listeners = list(self._listeners)
+		for listener in listeners:
+			try:
+				listener(changed)
+			except Exception:
+				pass
+
+	def _stat(self, filename: str) -> Optional[Tuple[int, int]]:
+		try:
+			stat = os.stat(os.path.join(self.manager.templates_dir, filename))
+		except OSError:
+			return None
+		return stat.st_mtime_ns, stat.st_size
+
+	def _apply(self, filename: str) -> bool:
+		"""Bring one file's entry up to date. Returns True if it changed."""
+		signature = self._stat(filename)
+		with self._lock:
+			current = self._entries.get(filename)
+			if signature is None:
+				return self._entries.pop(filename, None) is not None
+			if current is not None and current[0] == signature:
+				return False
+		summary = self.manager.read_summary(filename)
+		with self._lock:
+			self._entries[filename] = (signature, summary)
+		return True
+
+	def update(self, filenames: List[str]) -> set:
+		"""Re-check specific template files (e.g. "client.json") and notify listeners of any changes."""
+		changed = {filename for filename in filenames if filename.endswith('.json') and self._apply(filename)}
+		self._notify(changed)
+		return changed
+
+	def refresh(self) -> set:
+		"""Re-scan the whole directory, parsing only new or modified files."""
+		try:
+			on_disk = {filename for filename in os.listdir(self.manager.templates_dir) if filename.endswith('.json')}
+		except OSError:
+			on_disk = set()
+		with self._lock:
+			known = set(self._entries)
+		changed = {filename for filename in on_disk | known if self._apply(filename)}
+		self._notify(changed)
+		return changed
+
+	def templates(self) -> List[Dict[str, Any]]:
+		"""Template metadata in the same form as `TemplateManager.list_templates`, sorted by name.
+		Without a running watcher, the catalog is refreshed first.
+		"""
+		if not self.watched:
+			self.refresh()
+		with self._lock:
+			summaries = [dict(summary) for _, summary in self._entries.values() if summary is not None]
+		summaries.sort(key=lambda x: x["name"].lower())
+		return summaries
+
+
+class _Inotify:
+	"""Minimal ctypes binding to Linux inotify for a single directory."""
+
+	def __init__(self, path: str):
+		libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+		self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+		if libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK) < 0:
+			errno = ctypes.get_errno()
+			os.close(self.fd)
+			raise OSError(errno, "inotify_add_watch failed")
+		self.alive = True  # False once the watched directory is moved or deleted
+
+	def read(self, timeout: float) -> Tuple[List[str], bool]:
+		"""Wait up to `timeout` seconds for events.
+		Returns the changed filenames, and whether a full rescan is needed (queue overflow or the
+		directory itself was moved or deleted).
+		"""
+		readable, _, _ = select.select([self.fd], [], [], timeout)
+		if not readable:
+			return [], False
+		try:
+			data = os.read(self.fd, 64 * 1024)
+		except BlockingIOError:
+			return [], False
+		names, rescan, offset = [], False, 0
+		while offset + _EVENT_HEADER.size <= len(data):
+			_, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+			offset += _EVENT_HEADER.size
+			name = data[offset:offset + length].rstrip(b"\0")
+			offset += length
+			if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+				self.alive = False
+				rescan = True
+			elif mask & IN_Q_OVERFLOW:
+				rescan = True
+			elif name:
+				names.append(os.fsdecode(name))
+		return names, rescan
+
+	def close(self) -> None:
+		os.close(self.fd)
+
+
+class TemplateWatcher:
+	"""Keeps a `TemplateCatalog` current in a background thread.
+	On Linux, inotify reports changes as they happen; a periodic full rescan still runs to pick
+	up changes that inotify cannot see, such as edits made on another machine to a network share.
+	Elsewhere, or if inotify is unavailable, the directory is polled.
+	"""
+
+	def __init__(self, catalog: TemplateCatalog, poll_interval: float = 2.0, rescan_interval: float = 30.0):
+		"""
+		Args:
+			catalog: The catalog to keep current
+			poll_interval: Seconds between scans when polling
+			rescan_interval: Seconds between full rescans when using inotify
+		"""
+		self.catalog = catalog
+		self.poll_interval = poll_interval
+		self.rescan_interval = rescan_interval
+		self.backend: Optional[str] = None  # "inotify" or "polling" once started
+		self._stop = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+
+	def start(self) -> None:
+		if self._thread is not None and self._thread.is_alive():
+			return
+		self._stop.clear()
+		self.catalog.refresh()
+		self.catalog.watched = True
+		inotify = None
+		if sys.platform.startswith("linux"):
+			try:
+				inotify = _Inotify(self.catalog.manager.templates_dir)
+			except (OSError, AttributeError):
+				inotify = None
+		self.backend = "inotify" if inotify else "polling"
+		self._thread = threading.Thread(target=self._run, args=(inotify,), name="template-watcher", daemon=True)
+		self._thread.start()
+
+	def stop(self, timeout: float = 5.0) -> None:
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join(timeout)
+			self._thread = None
+		self.catalog.watched = False
+
+	def _run(self, inotify: Optional[_Inotify]) -> None:
+		if inotify is not None:
+			try:
+				next_rescan = time.monotonic() + self.rescan_interval
+				while inotify.alive and not self._stop.is_set():
+					# Short waits keep stop() responsive
+					names, rescan = inotify.read(min(0.5, self.rescan_interval))
+					if names:
+						self.catalog.update(names)
+					if rescan or time.monotonic() >= next_rescan:
+						self.catalog.refresh()
+						next_rescan = time.monotonic() + self.rescan_interval
+			finally:
+				inotify.close()
+			# The directory was replaced; keep watching by polling
+			self.backend = "polling"
+		while not self._stop.wait(self.poll_interval):
+			self.catalog.refresh()
+
+
+# Global catalog of the default templates directory
+template_catalog = TemplateCatalog(template_manager)
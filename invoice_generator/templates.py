@@ -1,42 +1,260 @@
 import json
 import os
 import os
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Tuple, Any
 from datetime import date
+from .invoice_api import Invoice, InvoiceItem, DisplayFields
+from .tracing import tracer
 from .utils import sanitize_filename, prepare_for_json_serialization, safe_json_load, safe_json_save, ensure_directory
 
 
+TAX_DISPLAY_CHOICES = [False, True, "%"]  # Indexed by the "tax_display" choice saved from the form
+
+
+def invoice_kwargs_from_fields(field_values: Dict[str, Any]) -> Dict[str, Any]:
+	"""Convert form or template field values into `Invoice` keyword arguments.
+	Items are returned as a list of `InvoiceItem` keyword dicts and display options as a
+	`DisplayFields` keyword dict, so callers can build fresh objects from them as often as needed.
+	"""
+	kwargs = {
+		"sender": str(field_values.get('from') or '').strip(),
+		"recipient": str(field_values.get('to') or '').strip(),
+		"items": [{
+			"name": item_data['name'],
+			"quantity": item_data.get('quantity', 1),
+			"unit_cost": item_data['unit_cost'],
+			"description": item_data.get('description'),
+			"discount": item_data.get('discount'),
+			"tax_category": item_data.get('tax_category')
+		} for item_data in field_values.get('items', [])]
+	}
+	for field_name in ['number', 'currency', 'payment_terms', 'logo', 'ship_to', 'notes', 'terms']:
+		value = str(field_values.get(field_name) or '').strip()
+		if value:
+			kwargs[field_name] = value
+	for field_name in ['discounts', 'tax', 'shipping', 'amount_paid']:
+		try:
+			value = float(field_values.get(field_name) or 0)
+		except (ValueError, TypeError):
+			continue
+		if value > 0:
+			kwargs[field_name] = value
+	for field_name in ['date', 'due_date']:
+		value = field_values.get(field_name)
+		if isinstance(value, date):
+			kwargs[field_name] = value
+		elif value:
+			try:
+				kwargs[field_name] = date.fromisoformat(value)
+			except (ValueError, TypeError):
+				pass
+	try:
+		tax_display = TAX_DISPLAY_CHOICES[int(field_values.get('tax_display', 2))]
+	except (ValueError, TypeError, IndexError):
+		tax_display = "%"
+	kwargs["display_fields"] = {
+		"tax": tax_display,
+		"discounts": bool(field_values.get('discounts_display', False)),
+		"shipping": bool(field_values.get('shipping_display', False))
+	}
+	return kwargs
+
+
+def invoice_from_fields(field_values: Dict[str, Any]) -> Invoice:
+	"""Build an `Invoice` from form or template field values, as the Generate button does.
+	Raises `ValueError` if required fields are missing or an item is invalid.
+	"""
+	return InvoiceFactory("", field_values)()
+
+
+class InvoiceFactory:
+	"""Builds `Invoice` objects from resolved template fields without going through the form.
+	Field values are converted once, when the factory is created; each call only constructs objects.
+	"""
+
+	def __init__(self, name: str, field_values: Dict[str, Any]):
+		self.name = name
+		self._kwargs = invoice_kwargs_from_fields(field_values)
+		self._frozen = None
+
+	def __call__(self, **overrides: Any) -> Invoice:
+		"""
+		Build a new invoice.
+		Args:
+			overrides: `Invoice` attributes to set instead of the template values,
+				e.g. `recipient`, `number`, `date` or `items` (a list of `InvoiceItem`)
+		Raises:
+			ValueError: Required fields are missing or an item is invalid
+		"""
+		with tracer.span("build_invoice", template=self.name):
+			kwargs = dict(self._kwargs)
+			kwargs["items"] = [InvoiceItem(**item) for item in kwargs["items"]]
+			kwargs["display_fields"] = DisplayFields(**kwargs["display_fields"])
+			kwargs.update(overrides)
+			return Invoice(**kwargs)
+
+	def frozen(self) -> Any:
+		"""Get the template's invoice as a shared `frozen.FrozenInvoice`; derive variants with `evolve()`.
+		Built on first use, then reused. Raises `ValueError` like calling the factory.
+		"""
+		if self._frozen is None:
+			self._frozen = self().freeze()
+		return self._frozen
+
+
 class TemplateManager:
 	def __init__(self, templates_dir: str = "templates"):
 		self.templates_dir = templates_dir
+		self._factories: Dict[str, Tuple[Tuple[Tuple[str, int], ...], InvoiceFactory]] = {}
 		ensure_directory(self.templates_dir)
 
-	def save_template(self, name: str, field_values: Dict[str, Any]) -> bool:
+	def save_template(self, name: str, field_values: Dict[str, Any], extends: Optional[str] = None) -> bool:
+		"""Save field values as a template.
+		A template that extends a base (given here, or already recorded in the existing file)
+		only stores the values that differ from the resolved base.
+		Raises:
+			ValueError: The base is this template or is based on it
+		"""
 		try:
 			safe_name = sanitize_filename(name)
 			file_path = os.path.join(self.templates_dir, f"{safe_name}.json")
 			serializable_values = prepare_for_json_serialization(field_values)
+			existing = safe_json_load(file_path)
+			if extends is None and existing:
+				extends = existing.get("extends")
+			if extends:
+				try:
+					chain = self._resolve_chain(extends)
+				except ValueError:
+					return False
+				if self._template_path(extends) == file_path:
+					raise ValueError(f"Template '{name}' cannot be based on itself")
+				if any(path == file_path for path, _ in chain):
+					raise ValueError(f"Template '{name}' cannot be based on '{extends}', which is based on it")
+				base_fields = {}
+				for _, template_data in chain:
+					base_fields.update(template_data.get("fields", {}))
+				serializable_values = {key: value for key, value in serializable_values.items()
+									   if base_fields.get(key) != value}
 			template_data = {
 				"name": name,
 				"created": date.today().isoformat(),
 				"fields": serializable_values
 			}
+			if extends:
+				template_data["extends"] = extends
+			# Overwriting a template from the form keeps its schedule
+			if existing and existing.get("recurrence"):
+				template_data["recurrence"] = existing["recurrence"]
 			with open(file_path, 'w', encoding='utf-8') as f:
 				json.dump(template_data, f, indent=2, ensure_ascii=False)
 			return True
 		except (IOError, OSError):
 			return False
 
+	def _template_path(self, name: str) -> str:
+		return os.path.join(self.templates_dir, f"{sanitize_filename(name)}.json")
+
+	def get_recurrence(self, name: str) -> Optional[Dict[str, Any]]:
+		"""Get the recurrence rule attached to a template, if any."""
+		template_data = safe_json_load(self._template_path(name))
+		if not template_data:
+			return None
+		return template_data.get("recurrence")
+
+	def set_recurrence(self, name: str, recurrence: Optional[Dict[str, Any]]) -> bool:
+		"""Attach a recurrence rule (as produced by `RecurrenceRule.to_dict`) to a template, or remove it with None."""
+		file_path = self._template_path(name)
+		template_data = safe_json_load(file_path)
+		if template_data is None:
+			return False
+		if recurrence is None:
+			template_data.pop("recurrence", None)
+		else:
+			template_data["recurrence"] = recurrence
+		return safe_json_save(file_path, template_data)
+
+	def _resolve_chain(self, name: str) -> List[Tuple[str, Dict[str, Any]]]:
+		"""Get (file path, template data) for a template and its ancestors, base first.
+		Raises `ValueError` if an ancestor is missing or the chain loops.
+		"""
+		chain = []
+		seen = set()
+		current = name
+		while current:
+			file_path = self._template_path(current)
+			if file_path in seen:
+				raise ValueError(f"Template inheritance loop at '{current}'")
+			seen.add(file_path)
+			template_data = safe_json_load(file_path)
+			if template_data is None:
+				raise ValueError(f"Template '{current}' not found")
+			chain.append((file_path, template_data))
+			current = template_data.get("extends")
+		chain.reverse()
+		return chain
+
+	def resolve_template(self, name: str) -> Optional[Dict[str, Any]]:
+		"""Get the fields of a template merged over those of its ancestors, or None if it cannot be resolved."""
+		try:
+			chain = self._resolve_chain(name)
+		except ValueError:
+			return None
+		fields = {}
+		for _, template_data in chain:
+			fields.update(template_data.get("fields", {}))
+		return fields
+
 	def load_template(self, name: str) -> Optional[Dict[str, Any]]:
+		fields = self.resolve_template(name)
+		if fields is None:
+			return None
+		return self._process_loaded_data(fields)
+
+	@staticmethod
+	def _chain_signature(paths: List[str]) -> Optional[Tuple[Tuple[str, int], ...]]:
 		try:
-			safe_name = sanitize_filename(name)
-			file_path = os.path.join(self.templates_dir, f"{safe_name}.json")
-			if not os.path.exists(file_path):
-				return None
-			with open(file_path, 'r', encoding='utf-8') as f:
+			return tuple((path, os.stat(path).st_mtime_ns) for path in paths)
+		except OSError:
+			return None
+
+	def compile_template(self, name: str) -> Optional[InvoiceFactory]:
+		"""Get a cached `InvoiceFactory` for a resolved template, or None if it cannot be resolved.
+		The factory is rebuilt whenever the template or any of its ancestors changes on disk.
+		"""
+		cached = self._factories.get(name)
+		if cached is not None:
+			signature, factory = cached
+			if self._chain_signature([path for path, _ in signature]) == signature:
+				return factory
+		try:
+			chain = self._resolve_chain(name)
+		except ValueError:
+			self._factories.pop(name, None)
+			return None
+		fields = {}
+		for _, template_data in chain:
+			fields.update(template_data.get("fields", {}))
+		signature = self._chain_signature([path for path, _ in chain])
+		factory = InvoiceFactory(name, self._process_loaded_data(fields))
+		if signature is not None:
+			self._factories[name] = (signature, factory)
+		return factory
+
+	def read_summary(self, filename: str) -> Optional[Dict[str, Any]]:
+		"""Read the listing metadata of one template file (e.g. "client.json"), or None if it is unreadable."""
+		try:
+			with open(os.path.join(self.templates_dir, filename), 'r', encoding='utf-8') as f:
 				template_data = json.load(f)
-			return self._process_loaded_data(template_data.get("fields", {}))
-		except (IOError, OSError, json.JSONDecodeError):
+			return {
+				"name": template_data.get("name", filename[:-5]),
+				"filename": filename[:-5],
+				"created": template_data.get("created", "Unknown"),
+				"field_count": len(template_data.get("fields", {})),
+				"extends": template_data.get("extends"),
+				"recurrence": template_data.get("recurrence")
+			}
+		except (IOError, json.JSONDecodeError, AttributeError):
 			return None
 
 	def list_templates(self) -> List[Dict[str, str]]:
@@ -44,18 +262,9 @@ class TemplateManager:
 		try:
 			for filename in os.listdir(self.templates_dir):
 				if filename.endswith('.json'):
-					try:
-						file_path = os.path.join(self.templates_dir, filename)
-						with open(file_path, 'r', encoding='utf-8') as f:
-							template_data = json.load(f)
-						templates.append({
-							"name": template_data.get("name", filename[:-5]),
-							"filename": filename[:-5],
-							"created": template_data.get("created", "Unknown"),
-							"field_count": len(template_data.get("fields", {}))
-						})
-					except (IOError, json.JSONDecodeError):
-						continue
+					summary = self.read_summary(filename)
+					if summary is not None:
+						templates.append(summary)
 			templates.sort(key=lambda x: x["name"].lower())
 			return templates
 		except OSError:
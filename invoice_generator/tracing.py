@@ -0,0 +1,107 @@
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Any
+
+
+TRACE_ENV = "INVOICE_GEN_TRACE"  # Path of the Chrome trace file to write on exit
+TRACE_MEMORY_ENV = "INVOICE_GEN_TRACE_MEMORY"  # Set to 1 to also record a tracemalloc snapshot
+
+
+class Tracer:
+	"""Opt-in recorder of timed spans, written in Chrome trace-event format.
+	Open the output in chrome://tracing or https://ui.perfetto.dev to see each stage of each
+	invoice on a per-thread timeline. When disabled, `span` costs a single attribute check.
+	"""
+
+	def __init__(self):
+		self.enabled = False
+		self.path: Optional[str] = None
+		self.memory = False
+		self._events: List[Dict[str, Any]] = []
+		self._lock = threading.Lock()
+		self._origin = time.perf_counter()
+		self._registered = False
+
+	def enable(self, path: str, memory: bool = False) -> None:
+		"""
+		Start recording spans and write them to `path` when the process exits.
+		Args:
+			path: Chrome trace JSON output file
+			memory: Also track allocations and write the largest allocation sites to `<path>.memory.txt`
+		"""
+		self.enabled = True
+		self.path = path
+		self.memory = memory
+		if memory and not tracemalloc.is_tracing():
+			tracemalloc.start(10)
+		if not self._registered:
+			atexit.register(self.write)
+			self._registered = True
+
+	@contextlib.contextmanager
+	def _record(self, name: str, args: Dict[str, Any]):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			end = time.perf_counter()
+			event = {
+				"name": name,
+				"ph": "X",
+				"ts": (start - self._origin) * 1e6,
+				"dur": (end - start) * 1e6,
+				"pid": os.getpid(),
+				"tid": threading.get_ident(),
+				"args": args,
+			}
+			with self._lock:
+				self._events.append(event)
+
+	def span(self, name: str, **args: Any):
+		"""Context manager timing one stage, e.g. `with tracer.span("http_post", number="42"):`."""
+		if not self.enabled:
+			return contextlib.nullcontext()
+		return self._record(name, args)
+
+	def write(self, path: str = None) -> Optional[str]:
+		"""Write recorded spans (and the memory snapshot, if enabled). Returns the trace path, or None."""
+		path = path or self.path
+		if not path:
+			return None
+		with self._lock:
+			events = list(self._events)
+		thread_names = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread.ident,
+						 "args": {"name": thread.name}} for thread in threading.enumerate()]
+		try:
+			with open(path, 'w', encoding='utf-8') as f:
+				json.dump({"traceEvents": thread_names + events, "displayTimeUnit": "ms"}, f, default=str)
+			if self.memory and tracemalloc.is_tracing():
+				self.write_memory_snapshot(f"{path}.memory.txt")
+		except (IOError, OSError):
+			return None
+		return path
+
+	def write_memory_snapshot(self, path: str, limit: int = 25) -> None:
+		"""Write the source lines holding the most memory, largest first."""
+		snapshot = tracemalloc.take_snapshot().filter_traces([
+			tracemalloc.Filter(False, tracemalloc.__file__),
+			tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+		])
+		stats = snapshot.statistics("lineno")
+		current, peak = tracemalloc.get_traced_memory()
+		with open(path, 'w', encoding='utf-8') as f:
+			f.write(f"Current: {current / 1024:.1f} KiB, peak: {peak / 1024:.1f} KiB\n\n")
+			for stat in stats[:limit]:
+				f.write(f"{stat.size / 1024:10.1f} KiB  {stat.count:8d} blocks  {stat.traceback}\n")
+
+
+# Global tracer instance
+tracer = Tracer()
+
+if os.environ.get(TRACE_ENV):
+	tracer.enable(os.environ[TRACE_ENV], memory=os.environ.get(TRACE_MEMORY_ENV) == "1")
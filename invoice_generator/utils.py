@@ -1,6 +1,9 @@
 import os
 import json
-from typing import Dict, Any, Optional
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional
 from datetime import date, datetime
 
 
@@ -61,6 +64,72 @@ def safe_json_save(file_path: str, data: Dict[str, Any]) -> bool:
 		return False
 
 
+def atomic_json_save(file_path: str, data: Dict[str, Any]) -> bool:
+	"""Save data as JSON by writing a temporary file and renaming it into place.
+	Readers never observe a half-written file, even if the process dies mid-write.
+	Returns a bool (`True` on success, `False` on failure).
+	"""
+	# A unique temporary file per call, so concurrent writers never share one
+	try:
+		fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(file_path)}.", suffix=".tmp",
+										 dir=os.path.dirname(os.path.abspath(file_path)))
+	except OSError:
+		return False
+	try:
+		with os.fdopen(fd, 'w', encoding='utf-8') as f:
+			json.dump(data, f, indent=2, ensure_ascii=False)
+			f.flush()
+			os.fsync(f.fileno())
+		if os.path.exists(file_path):
+			os.chmod(temp_path, os.stat(file_path).st_mode & 0o777)  # mkstemp creates owner-only files
+		os.replace(temp_path, file_path)
+		return True
+	except (IOError, OSError, TypeError, ValueError):
+		try:
+			os.remove(temp_path)
+		except OSError:
+			pass
+		return False
+
+
+@contextmanager
+def file_lock(file_path: str) -> Iterator[None]:
+	"""Hold an exclusive OS lock shared by every process using `file_path`.
+	The lock is taken on a `<file_path>.lock` sidecar, because `atomic_json_save` replaces
+	the file itself and a lock on the old inode would not exclude the next writer.
+	"""
+	with open(f"{file_path}.lock", 'a+b') as f:
+		if os.name == 'nt':
+			import msvcrt
+			f.seek(0)
+			while True:
+				try:
+					msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+					break
+				except OSError:  # LK_LOCK gives up after ~10 seconds
+					pass
+			try:
+				yield
+			finally:
+				f.seek(0)
+				msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+		else:
+			import fcntl
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def payload_hash(data: Any) -> str:
+	"""Return a stable SHA-256 hex digest of JSON-serializable data.
+	Keys are sorted so that equal payloads always hash the same, regardless of insertion order.
+	"""
+	canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+	return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
 def ensure_directory(directory: str) -> bool:
 	"""Create directory if it doesn't exist.
 	Returns a bool (`True` on success, `False` on failure).
@@ -0,0 +1,175 @@
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union, Any
+
+try:
+	import numpy as np
+except ImportError as e:
+	raise ImportError("Batch validation requires NumPy. Install it with: uv pip install 'invoice-gen[reports]'") from e
+
+
+@dataclass(frozen=True)
+class ValidationIssue:
+	"""A single problem with one field of one invoice in a batch."""
+	index: int  # Position of the invoice in the batch
+	field: str  # API field name, e.g. "to", "due_date" or "items[2].quantity"
+	message: str
+
+
+@dataclass
+class BatchValidation:
+	"""Result of `validate_batch`."""
+	count: int
+	issues: List[ValidationIssue]
+	valid: np.ndarray  # bool per invoice
+
+	@property
+	def ok(self) -> bool:
+		return not self.issues
+
+	def valid_indices(self) -> List[int]:
+		return np.flatnonzero(self.valid).tolist()
+
+	def invalid_indices(self) -> List[int]:
+		return np.flatnonzero(~self.valid).tolist()
+
+	def by_invoice(self) -> Dict[int, List[ValidationIssue]]:
+		"""Issues grouped by invoice position."""
+		grouped: Dict[int, List[ValidationIssue]] = {}
+		for issue in self.issues:
+			grouped.setdefault(issue.index, []).append(issue)
+		return grouped
+
+	def filter(self, batch: Sequence[Any]) -> List[Any]:
+		"""Keep only the valid entries of the validated batch."""
+		return [entry for entry, valid in zip(batch, self.valid) if valid]
+
+
+def _row_from_invoice(invoice: Any) -> Dict[str, Any]:
+	return {
+		"from": invoice.sender,
+		"to": invoice.recipient,
+		"items": [(item.name, item.quantity, item.unit_cost, item.discount) for item in invoice.items],
+		"date": invoice.date,
+		"due_date": invoice.due_date,
+		"tax": invoice.tax,
+		"discounts": invoice.discounts,
+		"shipping": invoice.shipping,
+		"amount_paid": invoice.amount_paid,
+	}
+
+
+def _row_from_dict(row: Dict[str, Any], index: int, issues: List[ValidationIssue]) -> Dict[str, Any]:
+	items = row.get("items") or []
+	if not isinstance(items, (list, tuple)):
+		issues.append(ValidationIssue(index, "items", "Items must be a list"))
+		items = []
+	parsed = []
+	for position, item in enumerate(items):
+		if not isinstance(item, dict):
+			issues.append(ValidationIssue(index, f"items[{position}]", "Item must be an object"))
+			item = {}
+		parsed.append((item.get("name", ""), item.get("quantity", 1), item.get("unit_cost", 0), item.get("discount")))
+	return dict(row, items=parsed)
+
+
+def _to_dates(values: List[Any], field: str, issues: List[ValidationIssue]) -> np.ndarray:
+	"""Parse dates or ISO strings into datetime64[D], recording unparsable values as issues (and NaT)."""
+	parsed = []
+	for index, value in enumerate(values):
+		if not value:
+			parsed.append("NaT")
+		elif isinstance(value, datetime):
+			parsed.append(value.date().isoformat())
+		elif isinstance(value, date):
+			parsed.append(value.isoformat())
+		else:
+			try:
+				parsed.append(date.fromisoformat(str(value)).isoformat())
+			except ValueError:
+				issues.append(ValidationIssue(index, field, f"Invalid date: {value}"))
+				parsed.append("NaT")
+	return np.array(parsed, dtype="datetime64[D]")
+
+
+def _to_floats(values: List[Any], field: str, issues: List[ValidationIssue],
+			   location: Optional[Callable[[int], Tuple[int, str]]] = None) -> np.ndarray:
+	"""
+	Convert values to float64, recording non-numeric values as issues (and NaN, which fails no check).
+	`location` maps a value's position to its (invoice index, field name), for item columns.
+	"""
+	values = [value or 0 for value in values]
+	try:
+		return np.array(values, dtype=np.float64)
+	except (TypeError, ValueError):
+		pass
+	parsed = np.empty(len(values), dtype=np.float64)
+	for index, value in enumerate(values):
+		try:
+			parsed[index] = float(value)
+		except (TypeError, ValueError):
+			invoice, name = location(index) if location else (index, field)
+			issues.append(ValidationIssue(invoice, name, f"Must be a number: {value!r}"))
+			parsed[index] = np.nan
+	return parsed
+
+
+def validate_batch(invoices_or_rows: Sequence[Union[Any, Dict[str, Any]]]) -> BatchValidation:
+	"""
+	Validate a whole batch before any request is sent.
+	Accepts `Invoice` objects or rows in the `Invoice.to_dict()` format. The checks match
+	`InvoiceGeneratorAPI.validate_invoice` and the `Invoice`/`InvoiceItem` constructors,
+	but run column-wise over the entire batch.
+	Returns:
+		A `BatchValidation` with one `ValidationIssue` per problem, ordered by invoice
+	"""
+	issues: List[ValidationIssue] = []
+	rows = [_row_from_dict(entry, index, issues) if isinstance(entry, dict) else _row_from_invoice(entry)
+			for index, entry in enumerate(invoices_or_rows)]
+	count = len(rows)
+	sender_missing = np.array([not str(row.get("from") or "").strip() for row in rows], dtype=bool)
+	recipient_missing = np.array([not str(row.get("to") or "").strip() for row in rows], dtype=bool)
+	item_counts = np.array([len(row["items"]) for row in rows], dtype=np.int64)
+	invoice_dates = _to_dates([row.get("date") for row in rows], "date", issues)
+	due_dates = _to_dates([row.get("due_date") for row in rows], "due_date", issues)
+	tax = _to_floats([row.get("tax") for row in rows], "tax", issues)
+	discounts = _to_floats([row.get("discounts") for row in rows], "discounts", issues)
+	shipping = _to_floats([row.get("shipping") for row in rows], "shipping", issues)
+	amount_paid = _to_floats([row.get("amount_paid") for row in rows], "amount_paid", issues)
+	# Flat item columns
+	item_invoice = np.repeat(np.arange(count), item_counts)
+	item_position = np.arange(len(item_invoice)) - np.repeat(np.cumsum(item_counts) - item_counts, item_counts)
+	items = [item for row in rows for item in row["items"]]
+	name_missing = np.array([not str(name or "").strip() for name, _, _, _ in items], dtype=bool)
+
+	def item_field(field: str) -> Callable[[int], Tuple[int, str]]:
+		return lambda index: (int(item_invoice[index]), f"items[{int(item_position[index])}].{field}")
+
+	quantity = _to_floats([quantity for _, quantity, _, _ in items], "quantity", issues, item_field("quantity"))
+	unit_cost = _to_floats([unit_cost for _, _, unit_cost, _ in items], "unit_cost", issues, item_field("unit_cost"))
+	discount = _to_floats([discount for _, _, _, discount in items], "discount", issues, item_field("discount"))
+	checks = [
+		(sender_missing, "from", "Sender information is required"),
+		(recipient_missing, "to", "Recipient information is required"),
+		(item_counts == 0, "items", "At least one item is required"),
+		(due_dates < invoice_dates, "due_date", "Due date cannot be before invoice date"),
+	]
+	item_checks = [
+		(name_missing, "name", "Item name cannot be empty"),
+		(quantity <= 0, "quantity", "Quantity must be positive"),
+		(unit_cost < 0, "unit_cost", "Unit cost cannot be negative"),
+		(discount < 0, "discount", "Discount cannot be negative"),
+	]
+	subtotal = np.bincount(item_invoice, weights=np.maximum(0, quantity * unit_cost - discount), minlength=count)
+	total = np.maximum(0, subtotal + tax + shipping - discounts)
+	checks.append((amount_paid > total, "amount_paid", "Amount paid cannot exceed total"))
+	for mask, field, message in checks:
+		issues.extend(ValidationIssue(int(index), field, message) for index in np.flatnonzero(mask))
+	for mask, field, message in item_checks:
+		issues.extend(ValidationIssue(int(item_invoice[index]), f"items[{int(item_position[index])}].{field}", message)
+					  for index in np.flatnonzero(mask))
+	issues.sort(key=lambda issue: issue.index)
+	valid = np.ones(count, dtype=bool)
+	if issues:
+		valid[[issue.index for issue in issues]] = False
+	return BatchValidation(count, issues, valid)